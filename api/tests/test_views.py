@@ -4,13 +4,17 @@ from unittest import mock
 from dateutil import parser as dateparser
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.db import connection
 from django.http import QueryDict
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIRequestFactory, force_authenticate
 
 import mediaplatform_jwp.api.delivery as api
 import mediaplatform.models as mpmodels
+from mediaplatform.tests import explain_sql, seed_media_items
 
 from . import create_stats_table, delete_stats_table, add_stat
 from .. import views
@@ -155,6 +159,153 @@ class MediaItemListViewTestCase(ViewTestCase):
         for item in response_data['results']:
             self.assertIn(item['id'], expected_ids)
 
+    def test_search_title(self):
+        """Searching matches words in the title."""
+        item = self.create_public_item(title='Quantum chromodynamics lecture')
+        self.assertEqual(self.search_ids('chromodynamics'), [item.id])
+
+    def test_search_description(self):
+        """Searching matches words in the description."""
+        item = self.create_public_item(title='Lecture', description='All about chromodynamics')
+        self.assertEqual(self.search_ids('chromodynamics'), [item.id])
+
+    def test_search_prefix(self):
+        """The last word of the search is matched as a prefix."""
+        item = self.create_public_item(title='Quantum chromodynamics lecture')
+        self.assertEqual(self.search_ids('quantum chromodyn'), [item.id])
+
+    def test_search_all_words(self):
+        """All words of the search must match."""
+        self.create_public_item(title='Quantum chromodynamics lecture')
+        self.assertEqual(self.search_ids('quantum electrodynamics'), [])
+
+    def test_search_tags(self):
+        """Searching matches tags."""
+        item = self.create_public_item(title='Lecture', tags=['chromodynamics'])
+        self.assertEqual(self.search_ids('Chromodynamics'), [item.id])
+
+    def test_search_is_ranked(self):
+        """Title matches are listed before description matches."""
+        description_item = self.create_public_item(
+            title='Lecture', description='All about chromodynamics')
+        title_item = self.create_public_item(title='Chromodynamics')
+        self.assertEqual(self.search_ids('chromodynamics'), [title_item.id, description_item.id])
+
+    def test_search_pages(self):
+        """Every ranked search result is listed exactly once when following the next page links."""
+        ids = [
+            self.create_public_item(
+                title='Chromodynamics' if i % 2 else 'Lecture',
+                description=' '.join(['chromodynamics'] * (i % 5 + 1) + ['filler'] * i)).id
+            for i in range(60)
+        ]
+        listed_ids = self.list_all_ids({'search': 'chromodynamics'})
+        self.assertEqual(len(listed_ids), len(set(listed_ids)))
+        self.assertEqual(set(listed_ids), set(ids))
+
+        listed_ids = self.list_all_ids({'search': 'chromodynamic', 'searchMode': 'similar'})
+        self.assertEqual(len(listed_ids), len(set(listed_ids)))
+        self.assertEqual(set(listed_ids), set(ids))
+
+    def test_search_respects_ordering(self):
+        """An explicit ordering overrides the search rank."""
+        description_item = self.create_public_item(
+            title='Lecture', description='All about chromodynamics',
+            published_at=timezone.now())
+        title_item = self.create_public_item(
+            title='Chromodynamics', published_at=timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(
+            self.search_ids('chromodynamics', ordering='-publishedAt'),
+            [description_item.id, title_item.id])
+
+    def test_search_similar(self):
+        """The similar search mode matches misspelled words and ranks closer matches first."""
+        self.create_public_item(title='Organic chemistry')
+        item = self.create_public_item(title='Quantum chromodynamics lecture')
+        self.assertEqual(self.search_ids('cromodynamic', searchMode='similar'), [item.id])
+        other_item = self.create_public_item(title='Chromodynamical')
+        self.assertEqual(
+            self.search_ids('chromodynamics', searchMode='similar'), [item.id, other_item.id])
+
+    def test_search_adds_no_joins(self):
+        """
+        Searching adds a condition to the list query rather than joining or combining it with other
+        queries.
+
+        """
+        list_sql = self.list_sql({})
+        search_sql = self.list_sql({'search': 'chromodynamics'})
+        self.assertEqual(search_sql.count(' JOIN '), list_sql.count(' JOIN '))
+        self.assertEqual(search_sql.count('SELECT '), list_sql.count('SELECT '))
+        self.assertEqual(search_sql.count('"tags" @>'), 1)
+
+    def list_sql(self, params):
+        """Return the SQL of the query which lists media items for the authenticated user."""
+        request = self.factory.get('/', params)
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.view(request).status_code, 200)
+        return next(
+            query['sql'] for query in queries.captured_queries
+            if 'FROM "mediaplatform_mediaitem"' in query['sql']
+        )
+
+    def test_ordering_has_tie_break(self):
+        """Items published at the same time are ordered by id and each is listed once."""
+        published_at = timezone.now() + datetime.timedelta(days=1)
+        ids = [
+            self.create_public_item(title=f'Item {i}', published_at=published_at).id
+            for i in range(60)
+        ]
+        listed_ids = self.list_all_ids({})
+        self.assertEqual(len(listed_ids), len(set(listed_ids)))
+        self.assertEqual(
+            [item_id for item_id in listed_ids if item_id in ids], sorted(ids, reverse=True))
+
+        listed_ids = self.list_all_ids({'ordering': 'publishedAt'})
+        self.assertEqual([item_id for item_id in listed_ids if item_id in ids], sorted(ids))
+
+    def test_deep_pages_use_index(self):
+        """Later pages are found from the ordering index rather than by sorting every item."""
+        # Enough items for six pages. The plan is explained with sequential scans disabled.
+        seed_media_items(
+            300, published_at="NOW() - i * INTERVAL '1 minute'", is_publicly_viewable='TRUE')
+
+        params = {}
+        for _ in range(5):
+            response = self.view(self.factory.get('/', params))
+            params = QueryDict(response.data['next'].split('?', 1)[1])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.view(self.factory.get('/', params))
+        list_sql = next(
+            query['sql'] for query in queries.captured_queries
+            if 'FROM "mediaplatform_mediaitem"' in query['sql']
+        )
+        plan = explain_sql(list_sql)
+        self.assertIn('mediaplatform_mediaitem_published_at_id_not_deleted', plan)
+        self.assertNotIn('Sort', plan)
+
+    def list_all_ids(self, params):
+        """Return the ids of all media items listed by following the next page links."""
+        ids = []
+        while True:
+            response = self.view(self.factory.get('/', params))
+            ids.extend(item['id'] for item in response.data['results'])
+            if response.data['next'] is None:
+                return ids
+            params = QueryDict(response.data['next'].split('?', 1)[1])
+
+    def create_public_item(self, **kwargs):
+        item = mpmodels.MediaItem.objects.create(channel=self.channel, **kwargs)
+        item.view_permission.is_public = True
+        item.view_permission.save()
+        return item
+
+    def search_ids(self, search, **params):
+        request = self.factory.get('/', {'search': search, **params})
+        return [item['id'] for item in self.view(request).data['results']]
+
     def test_create(self):
         """Basic creation of a media item succeeds."""
         request = self.factory.post('/', {'title': 'foo', 'channelId': self.channel.id})
@@ -554,6 +705,9 @@ class MediaItemSourceViewTestCase(ViewTestCase):
         response = self.get()
         self.assertRedirects(response, source['file'], fetch_redirect_response=False)
 
+        # Sources are resolved once per request
+        self.dv_from_key.assert_called_once_with(self.item.jwp.key)
+
     def test_audio_best_source(self):
         """Best source will include audio if that is all there is."""
         sources = [
@@ -720,6 +874,16 @@ class ChannelListViewTestCase(ViewTestCase):
         for item in response_data['results']:
             self.assertIn(item['id'], expected_ids)
 
+    def test_search(self):
+        """Searching matches words in the title and description in rank order."""
+        description_channel = mpmodels.Channel.objects.create(
+            title='Physics', description='Lectures on chromodynamics')
+        title_channel = mpmodels.Channel.objects.create(title='Chromodynamics')
+        request = self.factory.get('/', {'search': 'chromodyn'})
+        self.assertEqual(
+            [channel['id'] for channel in self.view(request).data['results']],
+            [title_channel.id, description_channel.id])
+
 
 class ChannelViewTestCase(ViewTestCase):
     def setUp(self):
@@ -868,6 +1032,20 @@ class PlaylistListViewTestCase(ViewTestCase):
         response = self.view(request)
         self.assertEqual(response.status_code, 400)
 
+    def test_search(self):
+        """Searching matches words in the title and description in rank order."""
+        playlists = []
+        for title, description in [('Physics', 'About chromodynamics'), ('Chromodynamics', '')]:
+            playlist = mpmodels.Playlist.objects.create(
+                channel=self.channel, title=title, description=description)
+            playlist.view_permission.is_public = True
+            playlist.view_permission.save()
+            playlists.append(playlist)
+        request = self.factory.get('/', {'search': 'chromodyn'})
+        self.assertEqual(
+            [playlist['id'] for playlist in self.view(request).data['results']],
+            [playlists[1].id, playlists[0].id])
+
 
 class PlaylistViewTestCase(ViewTestCase):
     def setUp(self):
@@ -81,29 +81,102 @@ class ListMixinBase:
         )
 
 
-class MediaItemListSearchFilter(filters.SearchFilter):
+class FullTextSearchFilter(filters.SearchFilter):
     """
-    Custom filter based on :py:class:`rest_framework.filters.SearchFilter` specialised to search
-    :py:class:`mediaplatform.models.MediaItem` objects. If the "tags" field is specified in the
-    view's ``search_fields`` attribute, then the tags field is searched for any tag matching the
-    lower cased search term.
+    Custom filter based on :py:class:`rest_framework.filters.SearchFilter` which matches the search
+    term against the full-text search vector of the title and description of a resource. See
+    :py:meth:`mediaplatform.models.SearchQuerySetMixin.search`. The last word of the search term is
+    matched as a prefix.
+
+    If the "searchMode" query parameter is "similar", the search term is instead matched against
+    the title and description by trigram word similarity. See
+    :py:meth:`mediaplatform.models.SearchQuerySetMixin.search_similar`. This matches misspelled and
+    partial words anywhere in the title or description.
+
+    This filter should come before :py:class:`~.SearchRankOrderingFilter` in the view's
+    ``filter_backends`` since the latter orders results by their ``search_rank`` annotation.
 
     """
+    #: Query parameter used to select the search mode.
+    search_mode_param = 'searchMode'
+
+    #: Value of the search mode query parameter which selects trigram similarity search.
+    SIMILAR_SEARCH_MODE = 'similar'
 
     def get_search_term(self, request):
         return request.query_params.get(self.search_param, '')
 
-    def get_search_terms(self, request):
-        return [self.get_search_term(request)]
+    def get_search_condition(self, request, view):
+        """
+        Return a condition matching additional resources to include in the search results or
+        ``None`` if there are none.
+
+        """
+        return None
 
     def filter_queryset(self, request, queryset, view):
-        filtered_qs = super().filter_queryset(request, queryset, view)
+        search_term = self.get_search_term(request)
+        if search_term.strip() == '':
+            return queryset
+        condition = self.get_search_condition(request, view)
+        if request.query_params.get(self.search_mode_param) == self.SIMILAR_SEARCH_MODE:
+            return queryset.search_similar(search_term, condition)
+        return queryset.search(search_term, condition)
 
-        if 'tags' in getattr(view, 'search_fields', ()):
-            search_term = self.get_search_term(request)
-            filtered_qs |= queryset.filter(tags__contains=[search_term.lower()])
 
-        return filtered_qs
+class MediaItemListSearchFilter(FullTextSearchFilter):
+    """
+    Custom filter based on :py:class:`~.FullTextSearchFilter` specialised to search
+    :py:class:`mediaplatform.models.MediaItem` objects. If the "tags" field is specified in the
+    view's ``search_fields`` attribute, then the tags field is searched for any tag matching the
+    lower cased search term.
+
+    The tag condition is part of the same filter as the title and description match so that the
+    search adds a single condition to the query. It can be answered from the index on the tags.
+
+    """
+    def get_search_condition(self, request, view):
+        if 'tags' not in getattr(view, 'search_fields', ()):
+            return None
+        return models.Q(tags__contains=[self.get_search_term(request).lower()])
+
+
+class SearchRankOrderingFilter(filters.OrderingFilter):
+    """
+    Custom filter based on :py:class:`rest_framework.filters.OrderingFilter` which, if a search
+    term is given and no ordering is requested, orders results by decreasing search rank followed
+    by the view's default ordering.
+
+    Every ordering ends with the unique ``tie_break_field`` in the same direction as the last
+    field. This makes the order of the list stable between pages and lets the database walk the
+    composite (column, id) indexes which exist for each ordering field instead of sorting.
+
+    """
+    #: Unique field used to order results which are otherwise equal.
+    tie_break_field = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        is_search = request.query_params.get(FullTextSearchFilter.search_param, '').strip() != ''
+        if is_search and not request.query_params.get(self.ordering_param):
+            ordering = ('-search_rank',) + tuple(self.get_default_ordering(view) or ())
+        else:
+            ordering = super().get_ordering(request, queryset, view)
+        return self.add_tie_break(ordering)
+
+    def add_tie_break(self, ordering):
+        """
+        Return *ordering* with the tie break field appended if it is not already present.
+
+        """
+        if not ordering:
+            return ordering
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        ordering = tuple(ordering)
+        if self.tie_break_field in (term.lstrip('-') for term in ordering):
+            return ordering
+        direction = '-' if ordering[-1].startswith('-') else ''
+        return ordering + (direction + self.tie_break_field,)
 
 
 class MediaItemListMixin(ListMixinBase):
@@ -129,6 +202,9 @@ class MediaItemMixin(MediaItemListMixin):
     or RetrieveUpdateAPIView to form a concrete view class.
 
     """
+    def get_queryset(self):
+        # Stored sources are used by MediaItem.get_sources() in place of the Delivery API.
+        return super().get_queryset().prefetch_related('jwp__delivery_sources')
 
 
 def _user_playlists(request):
@@ -165,7 +241,7 @@ class MediaItemListView(MediaItemListMixin, generics.ListCreateAPIView):
     Endpoint to retrieve a list of media.
 
     """
-    filter_backends = (filters.OrderingFilter, MediaItemListSearchFilter,
+    filter_backends = (MediaItemListSearchFilter, SearchRankOrderingFilter,
                        df_filters.DjangoFilterBackend)
     ordering = '-publishedAt'
     ordering_fields = ('publishedAt',)
@@ -286,11 +362,11 @@ class MediaItemSourceView(MediaItemMixin, generics.RetrieveAPIView):
         if mime_type is None and width is None and height is None:
             # If nothing was specified, return the "best" source.
             video_sources = [
-                source for source in item.get_sources()
+                source for source in item.sources
                 if source.mime_type.startswith('video/') and source.height is not None
             ]
             audio_sources = [
-                source for source in item.get_sources()
+                source for source in item.sources
                 if source.mime_type.startswith('audio/')
             ]
 
@@ -301,7 +377,7 @@ class MediaItemSourceView(MediaItemMixin, generics.RetrieveAPIView):
                 # Sort videos by descending height
                 return redirect(sorted(video_sources, key=lambda s: -s.height)[0].url)
         else:
-            for source in item.get_sources():
+            for source in item.sources:
                 if (source.mime_type == mime_type and source.width == width
                         and source.height == height):
                     return redirect(source.url)
@@ -351,7 +427,7 @@ class ChannelListView(ChannelListMixin, generics.ListCreateAPIView):
 
     """
     filter_backends = (
-        filters.OrderingFilter, filters.SearchFilter, df_filters.DjangoFilterBackend)
+        FullTextSearchFilter, SearchRankOrderingFilter, df_filters.DjangoFilterBackend)
     ordering = '-createdAt'
     ordering_fields = ('createdAt', 'title')
     pagination_class = ListPagination
@@ -406,7 +482,7 @@ class PlaylistListView(PlaylistListMixin, generics.ListCreateAPIView):
 
     """
     filter_backends = (
-        filters.OrderingFilter, filters.SearchFilter, df_filters.DjangoFilterBackend)
+        FullTextSearchFilter, SearchRankOrderingFilter, df_filters.DjangoFilterBackend)
     ordering = '-updatedAt'
     ordering_fields = ('updatedAt', 'createdAt', 'title')
     pagination_class = ListPagination
@@ -6,5 +6,6 @@ set -xe
 cd /usr/src/app
 
 python ./manage.py migrate
+python ./manage.py createcachetable
 
 exec python ./manage.py runserver 0.0.0.0:8080
@@ -1,7 +1,11 @@
 from django.contrib import admin
+from django.db.models import Q
 from django.urls import reverse
 from django.utils.html import format_html
 
+from mediaplatform import models as mpmodels
+from mediaplatform.admin import title_and_description_condition
+
 from .models import MediaItem, Collection
 
 
@@ -38,6 +42,19 @@ class MediaItemAdmin(admin.ModelAdmin):
 
     item_link.short_description = 'Media Item'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Match the SMS id and words in the title or description of the item."""
+        search_term = search_term.strip()
+        if search_term == '':
+            return queryset, False
+
+        items = mpmodels.MediaItem.objects_including_deleted.filter(
+            title_and_description_condition(search_term))
+        condition = Q(item__in=items.values('id'))
+        if search_term.isdigit():
+            condition |= Q(id=int(search_term))
+        return queryset.filter(condition), False
+
 
 @admin.register(Collection)
 class CollectionAdmin(admin.ModelAdmin):
@@ -77,3 +94,16 @@ class CollectionAdmin(admin.ModelAdmin):
         )
 
     playlist_link.short_description = 'Shadow Playlist'
+
+    def get_search_results(self, request, queryset, search_term):
+        """Match the SMS id and words in the title or description of the channel."""
+        search_term = search_term.strip()
+        if search_term == '':
+            return queryset, False
+
+        channels = mpmodels.Channel.objects_including_deleted.filter(
+            title_and_description_condition(search_term))
+        condition = Q(channel__in=channels.values('id'))
+        if search_term.isdigit():
+            condition |= Q(id=int(search_term))
+        return queryset.filter(condition), False
@@ -3,16 +3,19 @@ Tests for views.
 
 """
 import copy
+import datetime
 from contextlib import contextmanager
 from unittest import mock
 
 from django.contrib.auth.models import User
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 import requests
 
 import mediaplatform_jwp.api.delivery as api
 from mediaplatform_jwp.models import CachedResource
+from mediaplatform_jwp import models as jwpmodels
 from mediaplatform import models as mpmodels
 from mediaplatform_jwp import sync
 
@@ -103,6 +106,26 @@ class EmbedTest(TestCaseWithFixtures):
             r = self.client.get(reverse('legacysms:rss_media', kwargs={'media_id': 34}))
             self.assertEqual(r.status_code, 403)
 
+    def test_rss_single_lookup(self):
+        """
+        Checking an ACL with several institution and group entries makes one lookup call.
+
+        """
+        with mock.patch('mediaplatform_jwp.api.delivery.Video.from_media_id'
+                        ) as from_media_id:
+            from_media_id.return_value = api.Video({
+                'key': 'video-key',
+                'custom': {
+                    'sms_acl': 'acl:INST_A,INST_B,GROUP_1,GROUP_2:',
+                    'sms_media_id': 'media:34:',
+                }
+            })
+
+            self.client.force_login(User.objects.create(username='spqr1'))
+            r = self.client.get(reverse('legacysms:rss_media', kwargs={'media_id': 34}))
+            self.assertEqual(r.status_code, 403)
+            self.assertEqual(self.get_person.call_count, 1)
+
     def test_rss_media_redirect(self):
         """
         Test RSS media feed redirects if media item not found.
@@ -153,6 +176,52 @@ class DownloadTests(TestCase):
 
         self.assertRedirects(r, 'http://media.invalid/2.mp4', fetch_redirect_response=False)
 
+    def test_stored_sources(self):
+        """Current stored sources are used without calling JWPlatform."""
+        video = jwpmodels.Video.objects.create(
+            key='video-key', updated=1234, sources_updated=1234,
+            sources_fetched_at=timezone.now())
+        for source in MEDIA_INFO['playlist'][0]['sources']:
+            video.delivery_sources.create(
+                mime_type=source['type'], url=source['file'],
+                width=source.get('width'), height=source.get('height'))
+
+        r = self.client.get(reverse('legacysms:download_media',
+                                    kwargs={'media_id': 34, 'clip_id': 56, 'extension': 'mp4'}))
+
+        self.assertRedirects(r, 'http://media.invalid/2.mp4', fetch_redirect_response=False)
+        self.requests_session.get.assert_not_called()
+
+    def test_stale_stored_sources(self):
+        """Stored sources are not used if the video has been updated since they were fetched."""
+        self.requests_session.get.return_value.json.return_value = MEDIA_INFO
+        video = jwpmodels.Video.objects.create(
+            key='video-key', updated=1235, sources_updated=1234,
+            sources_fetched_at=timezone.now())
+        video.delivery_sources.create(mime_type='video/mp4', url='http://media.invalid/old.mp4')
+
+        r = self.client.get(reverse('legacysms:download_media',
+                                    kwargs={'media_id': 34, 'clip_id': 56, 'extension': 'mp4'}))
+
+        self.assertRedirects(r, 'http://media.invalid/2.mp4', fetch_redirect_response=False)
+        self.requests_session.get.assert_called_once()
+
+    @override_settings(JWPLATFORM_STORED_SOURCES_MAX_AGE=600)
+    def test_expired_stored_sources(self):
+        """Stored sources are not used if they are older than their maximum age."""
+        self.requests_session.get.return_value.json.return_value = MEDIA_INFO
+        video = jwpmodels.Video.objects.create(
+            key='video-key', updated=1234, sources_updated=1234,
+            sources_fetched_at=timezone.now() - datetime.timedelta(seconds=601))
+        video.delivery_sources.create(
+            mime_type='video/mp4', url='http://media.invalid/expired.mp4')
+
+        r = self.client.get(reverse('legacysms:download_media',
+                                    kwargs={'media_id': 34, 'clip_id': 56, 'extension': 'mp4'}))
+
+        self.assertRedirects(r, 'http://media.invalid/2.mp4', fetch_redirect_response=False)
+        self.requests_session.get.assert_called_once()
+
     def test_passes_video_key_to_jwp(self):
         """The correct video key used to get video info."""
         with mock.patch('time.time', return_value=12345):
@@ -3,13 +3,15 @@ Django views.
 
 """
 import logging
+from django.conf import settings
 from django.http import Http404, HttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse
 import requests
 
-from mediaplatform_jwp.api import delivery as api
+from mediaplatform_jwp.api import delivery as api, http
 from mediaplatform import models as mpmodels
+from mediaplatform_jwp import models as jwpmodels
 
 from . import redirect as legacyredirect
 
@@ -17,7 +19,7 @@ from . import redirect as legacyredirect
 LOG = logging.getLogger(__name__)
 
 #: Default session used for making HTTP requests.
-DEFAULT_REQUESTS_SESSION = requests.Session()
+DEFAULT_REQUESTS_SESSION = http.SESSION
 
 
 def embed(request, media_id):
@@ -82,13 +84,72 @@ def download_media(request, media_id, clip_id, extension):
 
     video.check_user_access(request.user)
 
+    # Use the sources stored by the jwpfetchsources management command if they are current.
+    # Otherwise, fetch them from JWPlatform.
+    sources = _stored_sources(video.key)
+    if sources is None:
+        sources = _fetch_sources(video)
+    if sources is None:
+        return HttpResponse(status=502)  # Bad gateway
+
+    # We now need to find *which* video/audio source to redirect the user back to. Firstly,
+    # determine which content/type we're looking for based on the extension. If we know of no such
+    # content type, return a 404 response. We don't redirect back to the legacy SMS here because we
+    # want to know earlier rather than later if the list of extensions in
+    # CONTENT_TYPE_FOR_DOWNLOAD_EXTENSION is incomplete and a 404 is a louder signal than a
+    # redirect :).
+    try:
+        desired_content_type = CONTENT_TYPE_FOR_DOWNLOAD_EXTENSION[extension.lower()]
+    except KeyError:
+        LOG.info('Could not match extension "%s" to a known content type', extension)
+        raise Http404('Unknown extension: %s'.format(extension))
+
+    # Filter the sources by this content type and then find the one with the largest height.
+    # We assume that the tallest source is approximately the highest quality version available.
+    sources_with_correct_type = [
+        source for source in sources if source.get('type', '') == desired_content_type
+    ]
+
+    # If the filtered sources list is empty, redirect back to the legacy SMS to try and deal with
+    # it.
+    if len(sources_with_correct_type) == 0:
+        LOG.info('download: failed to find source of content type %s for media id %s',
+                 desired_content_type, media_id)
+        return legacyredirect.media_download(media_id, clip_id, extension)
+
+    # Find best source. I.e. the one with greatest height
+    best_source = sources_with_correct_type[0]
+    for candidate_source in sources_with_correct_type[1:]:
+        if candidate_source.get('height', 0) > best_source.get('height', 0):
+            best_source = candidate_source
+
+    # Get the source URL
+    try:
+        url = best_source['file']
+    except KeyError:
+        LOG.warn('download: source is missing file key: %s', best_source)
+        return legacyredirect.media_download(media_id, clip_id, extension)
+
+    # Redirect to the direct download URL for the media item.
+    return redirect(url)
+
+
+def _fetch_sources(video):
+    """
+    Return the sources of a :py:class:`mediaplatform_jwp.api.delivery.Video` as a list of dicts
+    fetched from the JWPlatform Delivery API or None if they could not be fetched.
+
+    """
     # Fetch the media download information from JWPlatform.
     try:
         r = DEFAULT_REQUESTS_SESSION.get(api.pd_api_url(f'/v2/media/{video.key}', format='json'),
-                                         timeout=5)
+                                         timeout=settings.JWPLATFORM_DELIVERY_TIMEOUT)
     except requests.Timeout:
         LOG.warn('Timed out when retrieving information on video "%s" from JWPlatform', video)
-        return HttpResponse(status=502)  # Bad gateway
+        return None
+    except http.CircuitOpenError:
+        LOG.warn('Not retrieving information on video "%s" since JWPlatform is failing', video)
+        return None
 
     # Check that the call to JWPlatform succeeded.
     try:
@@ -96,7 +157,7 @@ def download_media(request, media_id, clip_id, extension):
     except requests.HTTPError as e:
         LOG.warn('Got HTTP error when retrieving information on video "%s" from JWPlatform', video)
         LOG.warn('Error was: %s', e)
-        return HttpResponse(status=502)  # Bad gateway
+        return None
 
     # Parse response as JSON
     try:
@@ -105,7 +166,7 @@ def download_media(request, media_id, clip_id, extension):
         LOG.warn(('Failed to parse JSON response when retrieving information on video "%s" from '
                   'JWPlatform'), video)
         LOG.warn('Error was: %s', e)
-        return HttpResponse(status=502)  # Bad gateway
+        return None
 
     # The response should be of the following form according to
     # https://developer.jwplayer.com/jw-platform/docs/delivery-api-reference/#!/media/get_v2_media_media_id
@@ -129,48 +190,33 @@ def download_media(request, media_id, clip_id, extension):
         playlist_item = media_info.get('playlist', [])[0]
     except IndexError:
         playlist_item = {}
-    sources = playlist_item.get('sources', [])
-
-    # We now need to find *which* video/audio source to redirect the user back to. Firstly,
-    # determine which content/type we're looking for based on the extension. If we know of no such
-    # content type, return a 404 response. We don't redirect back to the legacy SMS here because we
-    # want to know earlier rather than later if the list of extensions in
-    # CONTENT_TYPE_FOR_DOWNLOAD_EXTENSION is incomplete and a 404 is a louder signal than a
-    # redirect :).
-    try:
-        desired_content_type = CONTENT_TYPE_FOR_DOWNLOAD_EXTENSION[extension.lower()]
-    except KeyError:
-        LOG.info('Could not match extension "%s" to a known content type', extension)
-        raise Http404('Unknown extension: %s'.format(extension))
-
-    # Filter the sources by this content type and then find the one with the largest height.
-    # We assume that the tallest source is approximately the highest quality version available.
-    sources_with_correct_type = [
-        source for source in sources if source.get('type', '') == desired_content_type
-    ]
-
-    # If the filtered sources list is empty, redirect back to the legacy SMS to try and deal with
-    # it.
-    if len(sources_with_correct_type) == 0:
-        LOG.info('download: failed to find source of content type %s for media id %s',
-                 desired_content_type, media_id)
-        return legacyredirect.media_download(media_id, clip_id, extension)
+    return playlist_item.get('sources', [])
 
-    # Find best source. I.e. the one with greatest height
-    best_source = sources_with_correct_type[0]
-    for candidate_source in sources_with_correct_type[1:]:
-        if candidate_source.get('height', 0) > best_source.get('height', 0):
-            best_source = candidate_source
 
-    # Get the source URL
-    try:
-        url = best_source['file']
-    except KeyError:
-        LOG.warn('download: source is missing file key: %s', best_source)
-        return legacyredirect.media_download(media_id, clip_id, extension)
+def _stored_sources(key):
+    """
+    Return the sources stored for the JWP video with the passed key as a list of dicts in the form
+    returned by the Delivery API or None if there are no current stored sources.
 
-    # Redirect to the direct download URL for the media item.
-    return redirect(url)
+    """
+    video = (
+        jwpmodels.Video.objects.filter(key=key)
+        .prefetch_related('delivery_sources')
+        .first()
+    )
+    if video is None or not video.has_current_sources():
+        return None
+
+    return [
+        {
+            field: value for field, value in [
+                ('type', source.mime_type), ('file', source.url),
+                ('width', source.width), ('height', source.height)
+            ]
+            if value is not None
+        }
+        for source in video.delivery_sources.all()
+    ]
 
 
 def media(request, media_id):
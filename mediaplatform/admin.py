@@ -3,6 +3,7 @@ import datetime
 from django import forms
 from django.conf import settings
 from django.contrib import admin
+from django.db.models import Q
 from django.urls import reverse
 from django.utils.formats import localize
 from django.utils.html import format_html
@@ -14,6 +15,29 @@ from legacysms import models as smsmodels
 from . import models
 
 
+def title_and_description_condition(search_term, prefix=''):
+    """
+    Return a condition matching objects whose title or description contains each word of the
+    search term, ignoring case. Case-insensitive "contains" lookups compare upper cased values on
+    Postgres and so the condition can be answered from the trigram indexes on the upper cased title
+    and description columns. Field names are prefixed with *prefix* to allow matching the title and
+    description of related objects.
+
+    Admin search conditions which can be answered from indexes should be built from this rather
+    than by adding other fields to ``search_fields``. The default admin search ORs a
+    case-insensitive "contains" lookup on every one of ``search_fields`` which, for fields without
+    trigram indexes, requires every row to be scanned.
+
+    """
+    condition = Q()
+    for word in search_term.split():
+        condition &= (
+            Q(**{prefix + 'title__icontains': word})
+            | Q(**{prefix + 'description__icontains': word})
+        )
+    return condition
+
+
 class PermissionInline(admin.StackedInline):
     model = models.Permission
     can_delete = False
@@ -158,13 +182,29 @@ class MediaItemAdmin(admin.ModelAdmin):
         )
 
     def get_search_results(self, request, queryset, search_term):
-        """Allow searching by tag in addition to search_fields."""
-        queryset, use_distinct = super().get_search_results(request, queryset, search_term)
+        """
+        Match words in the title or description, the id or JWPlatform key and tags. Each branch of
+        the search condition is on an indexed column of the media item table.
 
-        # Also match on tags
-        queryset |= self.model.objects.filter(tags__contains=[search_term.lower()])
+        """
+        search_term = search_term.strip()
+        if search_term == '':
+            return queryset, False
+
+        # Look up the JWPlatform key separately since a condition on the joined video table would
+        # prevent the indexes on the media item table from being used.
+        jwp_item_ids = list(
+            jwpmodels.Video.objects
+            .filter(key=search_term, item__isnull=False)
+            .values_list('item_id', flat=True)
+        )
 
-        return queryset, use_distinct
+        condition = (
+            title_and_description_condition(search_term)
+            | Q(id=search_term) | Q(id__in=jwp_item_ids)
+            | Q(tags__contains=[search_term.lower()])
+        )
+        return queryset.filter(condition), False
 
     def get_queryset(self, request):
         """Ensure that related items are also fetched by the queryset."""
@@ -216,6 +256,14 @@ class ChannelAdmin(admin.ModelAdmin):
     def item_count(self, obj):
         return obj.items.count()
 
+    def get_search_results(self, request, queryset, search_term):
+        """Match words in the title or description and the id."""
+        search_term = search_term.strip()
+        if search_term == '':
+            return queryset, False
+        condition = title_and_description_condition(search_term) | Q(id=search_term)
+        return queryset.filter(condition), False
+
 
 class PlaylistAdminForm(forms.ModelForm):
     """
@@ -268,6 +316,14 @@ class PlaylistAdmin(admin.ModelAdmin):
 
     autocomplete_fields = ['channel']
 
+    def get_search_results(self, request, queryset, search_term):
+        """Match words in the title or description and the id."""
+        search_term = search_term.strip()
+        if search_term == '':
+            return queryset, False
+        condition = title_and_description_condition(search_term) | Q(id=search_term)
+        return queryset.filter(condition), False
+
     def deleted(self, obj):  # pragma: no cover
         """Whether the channel is marked as deleted."""
         return obj.deleted_at is not None
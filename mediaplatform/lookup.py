@@ -0,0 +1,156 @@
+"""
+A cache of lookup person resources which is shared between worker processes.
+
+:py:func:`automationlookup.get_person` caches its responses within a single process and so, when
+several worker processes serve the application, each warms its own cache. The
+:py:func:`~.get_person` function in this module wraps it with a cache held in one of Django's
+configured caches so that all workers share the same lookup responses.
+
+Entries are held for ``LOOKUP_MEMBERSHIP_CACHE_TIMEOUT`` seconds. Once an entry is older than
+``LOOKUP_MEMBERSHIP_CACHE_SOFT_TIMEOUT`` seconds it is still returned but a refresh is started in a
+background thread so that popular users rarely see a cache miss. Only one caller at a time fetches
+a given person from lookup. Other callers wait for the result to appear in the cache for at most
+``LOOKUP_MEMBERSHIP_CACHE_LOCK_TIMEOUT`` seconds before giving up and fetching it themselves.
+
+The cross-process lock relies on the ``add()`` method of the cache backend being atomic. This is
+the case for the database and memcached backends but not for the file-based backend which should
+not be used for this cache.
+
+Setting ``LOOKUP_MEMBERSHIP_CACHE_TIMEOUT`` to zero disables the shared cache entirely.
+
+"""
+import logging
+import threading
+import time
+import zlib
+
+import automationlookup
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+LOG = logging.getLogger(__name__)
+
+#: Default alias of the Django cache used to hold person resources.
+DEFAULT_CACHE_ALIAS = 'default'
+
+#: Default time in seconds for which a person resource is cached.
+DEFAULT_TIMEOUT = 1800
+
+#: Default age in seconds after which a cached person resource is refreshed in the background.
+DEFAULT_SOFT_TIMEOUT = 900
+
+#: Default time in seconds for which a caller holds the lock to fetch a person from lookup.
+DEFAULT_LOCK_TIMEOUT = 10
+
+#: Time in seconds between checks of the cache when waiting for another caller's lookup.
+_POLL_INTERVAL = 0.05
+
+#: Locks used to serialise lookups of the same person by threads within this process. They are
+#: striped by cache key so that the number of locks is bounded.
+_THREAD_LOCKS = [threading.Lock() for _ in range(64)]
+
+
+def get_person(identifier, scheme, fetch):
+    """
+    Return the same value as :py:func:`automationlookup.get_person` for the given arguments but
+    consult the shared cache first.
+
+    """
+    timeout = getattr(settings, 'LOOKUP_MEMBERSHIP_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    if not timeout:
+        return automationlookup.get_person(identifier=identifier, scheme=scheme, fetch=fetch)
+
+    cache = caches[getattr(settings, 'LOOKUP_MEMBERSHIP_CACHE', DEFAULT_CACHE_ALIAS)]
+    key = _cache_key(identifier, scheme, fetch)
+
+    entry = cache.get(key)
+    if entry is None:
+        return _fetch_single_flight(cache, key, identifier, scheme, fetch)
+
+    person, refresh_at = entry
+    if time.time() >= refresh_at:
+        _refresh_in_background(cache, key, identifier, scheme, fetch)
+
+    return person
+
+
+def _cache_key(identifier, scheme, fetch):
+    """
+    Return the cache key for a person. The order of the fetch list does not affect the key.
+
+    """
+    return 'lookup-person:{}:{}:{}'.format(scheme, identifier, ','.join(sorted(fetch)))
+
+
+def _fetch_and_store(cache, key, identifier, scheme, fetch):
+    """
+    Fetch a person from lookup, store it in the cache and return it.
+
+    """
+    person = automationlookup.get_person(identifier=identifier, scheme=scheme, fetch=fetch)
+
+    timeout = getattr(settings, 'LOOKUP_MEMBERSHIP_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    soft_timeout = getattr(
+        settings, 'LOOKUP_MEMBERSHIP_CACHE_SOFT_TIMEOUT', DEFAULT_SOFT_TIMEOUT)
+    cache.set(key, (person, time.time() + min(soft_timeout, timeout)), timeout)
+
+    return person
+
+
+def _fetch_single_flight(cache, key, identifier, scheme, fetch):
+    """
+    Fetch a person which is not in the cache making sure that only one caller at a time calls
+    lookup. Callers which do not hold the lock wait for the holder's result to be cached.
+
+    """
+    lock_key = key + ':lock'
+    lock_timeout = getattr(
+        settings, 'LOOKUP_MEMBERSHIP_CACHE_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT)
+    deadline = time.time() + lock_timeout
+
+    with _THREAD_LOCKS[zlib.crc32(key.encode('utf8')) % len(_THREAD_LOCKS)]:
+        while True:
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+
+            if cache.add(lock_key, True, lock_timeout):
+                try:
+                    return _fetch_and_store(cache, key, identifier, scheme, fetch)
+                finally:
+                    cache.delete(lock_key)
+
+            # If the lock holder has not produced a result in time, assume that it has gone away
+            # and fetch the person ourselves.
+            if time.time() >= deadline:
+                LOG.warning('Timed out waiting for lookup of %s', key)
+                return _fetch_and_store(cache, key, identifier, scheme, fetch)
+
+            time.sleep(_POLL_INTERVAL)
+
+
+def _refresh_in_background(cache, key, identifier, scheme, fetch):
+    """
+    Start a thread which re-fetches a person from lookup unless a refresh is already underway.
+
+    """
+    lock_key = key + ':lock'
+    lock_timeout = getattr(
+        settings, 'LOOKUP_MEMBERSHIP_CACHE_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT)
+
+    if not cache.add(lock_key, True, lock_timeout):
+        return
+
+    def refresh():
+        try:
+            _fetch_and_store(cache, key, identifier, scheme, fetch)
+        except Exception:
+            LOG.exception('Error refreshing lookup person %s', key)
+        finally:
+            cache.delete(lock_key)
+
+            # A database cache backend may have opened a connection for this thread.
+            connections.close_all()
+
+    threading.Thread(target=refresh, daemon=True).start()
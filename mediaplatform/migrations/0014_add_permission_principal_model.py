@@ -0,0 +1,50 @@
+# Generated by Django 2.1 on 2018-09-03 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Populate the principals for all existing permissions. This mirrors
+# mediaplatform.models.update_permission_principals.
+POPULATE_PRINCIPALS_SQL = '''
+    INSERT INTO mediaplatform_permissionprincipal (permission_id, principal)
+    SELECT DISTINCT permission_id, principal FROM (
+        SELECT id, 'WORLD' FROM mediaplatform_permission WHERE is_public
+        UNION ALL
+        SELECT id, 'CAM' FROM mediaplatform_permission WHERE is_signed_in
+        UNION ALL
+        SELECT id, 'USER_' || crsid FROM mediaplatform_permission, unnest(crsids) AS crsid
+        UNION ALL
+        SELECT id, 'GROUP_' || groupid
+        FROM mediaplatform_permission, unnest(lookup_groups) AS groupid
+        UNION ALL
+        SELECT id, 'INST_' || instid FROM mediaplatform_permission, unnest(lookup_insts) AS instid
+    ) AS principals (permission_id, principal)
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform', '0013_remove_media_item_edit_permission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PermissionPrincipal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('principal', models.TextField(editable=False)),
+                ('permission', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='principals', to='mediaplatform.Permission')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='permissionprincipal',
+            index=models.Index(fields=['principal', 'permission'], name='mediaplatfo_princip_d25554_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='permissionprincipal',
+            unique_together={('permission', 'principal')},
+        ),
+        migrations.RunSQL(POPULATE_PRINCIPALS_SQL, migrations.RunSQL.noop),
+    ]
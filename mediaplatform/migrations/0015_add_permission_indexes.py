@@ -0,0 +1,44 @@
+# Generated by Django 2.1 on 2018-09-04 09:41
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform', '0014_add_permission_principal_model'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='permission',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['crsids'], name='mediaplatfo_crsids_743ae7_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='permission',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['lookup_groups'], name='mediaplatfo_lookup__9a7582_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='permission',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['lookup_insts'], name='mediaplatfo_lookup__2982a0_gin'),
+        ),
+
+        # Partial indexes over the boolean flags. Only a small fraction of permissions have these
+        # set and so the indexes are small and let the planner combine them with the GIN indexes
+        # above in a single bitmap scan.
+        migrations.RunSQL(
+            '''
+            CREATE INDEX mediaplatform_permission_is_public_idx
+                ON mediaplatform_permission (id) WHERE is_public
+            ''',
+            'DROP INDEX mediaplatform_permission_is_public_idx',
+        ),
+        migrations.RunSQL(
+            '''
+            CREATE INDEX mediaplatform_permission_is_signed_in_idx
+                ON mediaplatform_permission (id) WHERE is_signed_in
+            ''',
+            'DROP INDEX mediaplatform_permission_is_signed_in_idx',
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.1 on 2018-09-05 09:41
+
+from django.db import migrations, models
+
+
+# Populate the publicly viewable flag for all existing media items. This mirrors
+# mediaplatform.models.update_publicly_viewable.
+POPULATE_PUBLICLY_VIEWABLE_SQL = '''
+    UPDATE mediaplatform_mediaitem AS item
+    SET is_publicly_viewable = TRUE
+    WHERE
+        EXISTS (
+            SELECT 1 FROM mediaplatform_permission
+            WHERE allows_view_item_id = item.id AND is_public
+        )
+        OR EXISTS (
+            SELECT 1 FROM mediaplatform_permission
+            WHERE allows_edit_channel_id = item.channel_id AND is_public
+        )
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform', '0015_add_permission_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaitem',
+            name='is_publicly_viewable',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunSQL(POPULATE_PUBLICLY_VIEWABLE_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 2.1 on 2018-09-06 10:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Tables which have a search_vector column maintained by the trigger below.
+SEARCH_TABLES = ['mediaplatform_mediaitem', 'mediaplatform_channel', 'mediaplatform_playlist']
+
+# The search vector is built from the title and the description with title matches weighted more
+# heavily. The text search configuration must match mediaplatform.models.SEARCH_CONFIG.
+CREATE_FUNCTION_SQL = '''
+    CREATE FUNCTION mediaplatform_update_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', COALESCE(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('english', COALESCE(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+'''
+
+DROP_FUNCTION_SQL = 'DROP FUNCTION mediaplatform_update_search_vector()'
+
+# The trigger fires for every save() from Django since all columns are included in the update.
+CREATE_TRIGGER_SQL = '''
+    CREATE TRIGGER {table}_search_vector_update
+        BEFORE INSERT OR UPDATE OF title, description ON {table}
+        FOR EACH ROW EXECUTE PROCEDURE mediaplatform_update_search_vector()
+'''
+
+DROP_TRIGGER_SQL = 'DROP TRIGGER {table}_search_vector_update ON {table}'
+
+# Populate the search vector of existing rows by firing the trigger.
+POPULATE_SQL = 'UPDATE {table} SET title = title'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform', '0016_add_media_item_is_publicly_viewable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='channel',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='mediaplatfo_search__546b00_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='mediaplatfo_search__7a40bd_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='playlist',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='mediaplatfo_search__9ed5b3_gin'),
+        ),
+        migrations.RunSQL(CREATE_FUNCTION_SQL, DROP_FUNCTION_SQL),
+    ] + [
+        migrations.RunSQL(
+            [CREATE_TRIGGER_SQL.format(table=table), POPULATE_SQL.format(table=table)],
+            DROP_TRIGGER_SQL.format(table=table),
+        )
+        for table in SEARCH_TABLES
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1 on 2018-09-10 14:31
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# Tables whose title and description columns have trigram indexes.
+TRIGRAM_TABLES = ['mediaplatform_mediaitem', 'mediaplatform_channel', 'mediaplatform_playlist']
+
+# Case-insensitive "icontains" lookups compare UPPER(column) on Postgres and so the indexes are
+# over the upper cased column. See mediaplatform.models.SearchQuerySetMixin.search_similar.
+CREATE_INDEX_SQL = '''
+    CREATE INDEX {table}_{column}_trgm ON {table} USING gin (UPPER({column}) gin_trgm_ops)
+'''
+
+DROP_INDEX_SQL = 'DROP INDEX {table}_{column}_trgm'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform', '0017_add_search_vectors'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+    ] + [
+        migrations.RunSQL(
+            CREATE_INDEX_SQL.format(table=table, column=column),
+            DROP_INDEX_SQL.format(table=table, column=column),
+        )
+        for table in TRIGRAM_TABLES for column in ['title', 'description']
+    ]
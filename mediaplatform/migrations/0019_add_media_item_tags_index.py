@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2018-09-11 09:47
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform', '0018_add_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tags'], name='mediaplatfo_tags_c8e8da_gin'),
+        ),
+    ]
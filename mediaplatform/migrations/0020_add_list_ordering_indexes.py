@@ -0,0 +1,35 @@
+# Generated by Django 2.1 on 2018-09-12 11:05
+
+from django.db import migrations
+
+
+# Columns by which each table is ordered when listed by the API. Lists only contain objects which
+# have not been deleted and are ordered by the column with the id as a tie break. Descending
+# orderings use the same indexes scanned backwards. See api.views.SearchRankOrderingFilter.
+ORDERING_COLUMNS = {
+    'mediaplatform_mediaitem': ['published_at'],
+    'mediaplatform_channel': ['created_at', 'title'],
+    'mediaplatform_playlist': ['updated_at', 'created_at', 'title'],
+}
+
+CREATE_INDEX_SQL = '''
+    CREATE INDEX {table}_{column}_id_not_deleted ON {table} ({column}, id)
+        WHERE deleted_at IS NULL
+'''
+
+DROP_INDEX_SQL = 'DROP INDEX {table}_{column}_id_not_deleted'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform', '0019_add_media_item_tags_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            CREATE_INDEX_SQL.format(table=table, column=column),
+            DROP_INDEX_SQL.format(table=table, column=column),
+        )
+        for table, columns in ORDERING_COLUMNS.items() for column in columns
+    ]
@@ -1,18 +1,25 @@
+import contextlib
 import dataclasses
 import itertools
+import re
 import secrets
+import threading
 import typing
 
-import automationlookup
 from django.conf import settings
 import django.contrib.postgres.fields as pgfields
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db import connection, models
 from django.db.models import Q
-from django.db.models.signals import post_save
+from django.db.models.functions import Cast, Greatest, Upper
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from django.utils.functional import cached_property
 from iso639 import languages
 
+from . import lookup
+
 
 #: The number of bytes of entropy in the tokens returned by _make_token.
 _TOKEN_ENTROPY = 8
@@ -59,35 +66,172 @@ class PermissionQuerySetMixin:
         # If a non-None user was passed and the user is not anonymous, we can add additional ways
         # the item can be viewed
         if user is not None and not user.is_anonymous:
-            groupids, instids = _lookup_groupids_and_instids_for_user(user)
+            groupids, instids = _groupids_and_instids_for_user(user)
 
             # Irrespective of user groups/institutions, any signed in user has the is_signed_in
             # permission
             condition |= models.Q(**{fieldname + '__is_signed_in': True})
 
-            # The user may also be explicitly mentioned in the list of allowed crsids
-            condition |= models.Q(**{fieldname + '__crsids__contains': [user.username]})
+            # The user may also be explicitly mentioned in the list of allowed crsids. We use
+            # overlap ("&&") rather than contains ("@>") since, for a single element, they are
+            # equivalent and overlap matches the form of the other array conditions.
+            condition |= models.Q(**{fieldname + '__crsids__overlap': [user.username]})
 
-            # The user's lookup groups may overlap with the allowed set
-            condition |= models.Q(**{fieldname + '__lookup_groups__overlap': groupids})
+            # The user's lookup groups may overlap with the allowed set. An overlap with the empty
+            # set is never true so we don't add a condition which the database would still need
+            # to evaluate.
+            if len(groupids) > 0:
+                condition |= models.Q(**{fieldname + '__lookup_groups__overlap': groupids})
 
             # The user's lookup institutions may overlap with the allowed set
-            condition |= models.Q(**{fieldname + '__lookup_insts__overlap': instids})
+            if len(instids) > 0:
+                condition |= models.Q(**{fieldname + '__lookup_insts__overlap': instids})
 
         return condition
 
+    def _principal_condition(self, fieldname, user):
+        """
+        Return a queryset expression for the permission field "fieldname" which is True if the
+        passed user has that permission. Unlike :py:meth:`~._permission_condition`, the expression
+        is a single semi-join against the :py:class:`~.PermissionPrincipal` table which can make
+        use of its index.
+
+        """
+        return models.Q(**{
+            fieldname + '__in': (
+                PermissionPrincipal.objects
+                .filter(principal__in=_principals_for_user(user))
+                .values('permission_id')
+            ),
+        })
+
+
+#: Postgres text search configuration used for the ``search_vector`` fields. This must match the
+#: configuration used by the trigger which maintains them. See migration 0017.
+SEARCH_CONFIG = 'english'
+
+
+class PrefixSearchQuery(SearchQuery):
+    """
+    A :py:class:`django.contrib.postgres.search.SearchQuery` which matches documents containing
+    all of the words in the search text. The last word is matched as a prefix so that partially
+    typed words match.
+
+    """
+    def __init__(self, value, **kwargs):
+        # Only word characters are kept so that the query cannot contain tsquery operators.
+        words = re.findall(r'\w+', value)
+        if len(words) > 0:
+            words[-1] += ':*'
+        super().__init__(' & '.join(words), **kwargs)
+
+    #: SearchQuery uses plainto_tsquery() which does not support the prefix operator. The words
+    #: are joined with "&" above and so to_tsquery() is given a valid query.
+    function = 'to_tsquery'
+
+    def as_sql(self, compiler, connection):
+        params = [self.value]
+        template = '{}(%s)'.format(self.function)
+        if self.config:
+            config_sql, config_params = compiler.compile(self.config)
+            template = '{}({}::regconfig, %s)'.format(self.function, config_sql)
+            params = config_params + params
+        if self.invert:
+            template = '!!({})'.format(template)
+        return template, params
+
+
+class WordSimilarity(models.Func):
+    """
+    The pg_trgm ``word_similarity()`` function. Returns a number between zero and one indicating
+    how similar the first argument is to the most similar part of the second argument.
+
+    """
+    function = 'WORD_SIMILARITY'
+    output_field = models.FloatField()
+
+
+class TrigramWordSimilar(models.Func):
+    """
+    The pg_trgm ``%>`` operator. True if the first argument contains a part similar to the second
+    argument. This may be answered by a trigram index on the first argument.
+
+    """
+    arg_joiner = ' %%> '
+    template = '(%(expressions)s)'
+    output_field = models.BooleanField()
+
+
+class SearchQuerySetMixin:
+    def search(self, text, condition=None):
+        """
+        Filter the queryset to only those objects whose title or description match the search
+        text and annotate them with a ``search_rank``. Title matches rank above description
+        matches. If *condition* is not ``None``, objects matching it are also included.
+
+        The rank is cast to double precision so that it survives the round trip through the
+        position encoded in pagination cursors unchanged.
+
+        """
+        query = PrefixSearchQuery(text, config=SEARCH_CONFIG)
+        match = Q(search_vector=query)
+        if condition is not None:
+            match |= condition
+        return (
+            self.filter(match)
+            .annotate(search_rank=Cast(
+                SearchRank(models.F('search_vector'), query), models.FloatField()))
+        )
+
+    def search_similar(self, text, condition=None):
+        """
+        Filter the queryset to only those objects whose title or description contain words similar
+        to the search text and annotate them with a ``search_rank`` which is the greatest trigram
+        word similarity of the search text to the title or the description. Unlike
+        :py:meth:`~.search`, this matches misspelled words and partial words anywhere in the
+        title or description. If *condition* is not ``None``, objects matching it are also
+        included. As with :py:meth:`~.search`, the rank is cast to double precision. Objects are
+        also annotated with ``search_title_similar`` and ``search_description_similar`` flags
+        indicating which of the title and description matched.
 
-class MediaItemQuerySet(PermissionQuerySetMixin, models.QuerySet):
+        """
+        # The upper cased columns are matched so that the trigram indexes used by case-insensitive
+        # "icontains" lookups are also used here. Trigram matching ignores case. The matches are
+        # annotated, rather than registered as lookups on every text field, so that they can be
+        # filtered on.
+        match = Q(search_title_similar=True) | Q(search_description_similar=True)
+        if condition is not None:
+            match |= condition
+        return (
+            self.annotate(
+                search_title_similar=TrigramWordSimilar(Upper('title'), models.Value(text)),
+                search_description_similar=TrigramWordSimilar(
+                    Upper('description'), models.Value(text)),
+            )
+            .filter(match)
+            .annotate(search_rank=Cast(Greatest(
+                WordSimilarity(models.Value(text), 'title'),
+                WordSimilarity(models.Value(text), 'description'),
+            ), models.FloatField()))
+        )
+
+
+class MediaItemQuerySet(SearchQuerySetMixin, PermissionQuerySetMixin, models.QuerySet):
     def annotate_viewable(self, user, name='viewable'):
         """
         Annotate the query set with a boolean indicating if the user can view the item.
 
         """
+        # Anonymous users can view exactly those items which are publicly viewable.
+        if user is None or user.is_anonymous:
+            return self.annotate(**{name: models.F('is_publicly_viewable')})
+
+        # The condition is the same as that used by viewable_by_user() so that the two agree.
         return self.annotate(**{
             name: models.Case(
                 models.When(
-                    Q(self._permission_condition('view_permission', user) |
-                      self._permission_condition('channel__edit_permission', user)),
+                    Q(self._principal_condition('view_permission', user) |
+                      self._principal_condition('channel__edit_permission', user)),
                     then=models.Value(True)
                 ),
                 default=models.Value(False),
@@ -100,8 +244,13 @@ class MediaItemQuerySet(PermissionQuerySetMixin, models.QuerySet):
         Filter the queryset to only those items which can be viewed by the passed Django user.
 
         """
-        return self.filter(Q(self._permission_condition('view_permission', user) |
-                             self._permission_condition('channel__edit_permission', user)))
+        # Most of our traffic is from anonymous users. For them we use the denormalised
+        # is_publicly_viewable flag and so avoid joining the permission tables at all.
+        if user is None or user.is_anonymous:
+            return self.filter(is_publicly_viewable=True)
+
+        return self.filter(Q(self._principal_condition('view_permission', user) |
+                             self._principal_condition('channel__edit_permission', user)))
 
     def _editable_condition(self, user):
         # For the moment, we make sure that *all* SMS-derived objects are immutble to guard against
@@ -279,6 +428,22 @@ class MediaItem(models.Model):
     #: Deletion time. If non-NULL, the item has been "deleted" and should not usually be visible.
     deleted_at = models.DateTimeField(null=True, blank=True)
 
+    #: Can anonymous users view this item? This is a denormalised copy of whether the view
+    #: permission of the item or the edit permission of its channel is public. It is maintained by
+    #: :py:func:`~.update_publicly_viewable` and should not be modified directly.
+    is_publicly_viewable = models.BooleanField(default=False, editable=False)
+
+    #: Full-text search vector over the title and description. This is maintained by a database
+    #: trigger and should not be modified directly. See :py:meth:`~.SearchQuerySetMixin.search`.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            # Used by "contains" lookups on tags when searching.
+            GinIndex(fields=['tags']),
+        ]
+
     def __str__(self):
         return '{} ("{}")'.format(self.id, self.title)
 
@@ -364,6 +529,17 @@ class Permission(models.Model):
     #: Do all signed in (non-anonymous) users have this permission?
     is_signed_in = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # GIN indexes over the array fields allow the overlap conditions used by
+            # PermissionQuerySetMixin to be answered from an index. There are additionally partial
+            # indexes over is_public and is_signed_in which are created in migration 0015 since
+            # Django cannot yet express partial indexes.
+            GinIndex(fields=['crsids']),
+            GinIndex(fields=['lookup_groups']),
+            GinIndex(fields=['lookup_insts']),
+        ]
+
     def __str__(self):
         if self.is_public:
             return 'Public'
@@ -394,6 +570,107 @@ class Permission(models.Model):
         self.is_signed_in = False
 
 
+class PermissionPrincipal(models.Model):
+    """
+    A denormalised form of :py:class:`~.Permission` with one row for each principal which is
+    granted the permission. Principals use the same tokens as SMS-style ACLs: ``WORLD`` if the
+    permission is public, ``CAM`` if it is granted to all signed in users and ``USER_{crsid}``,
+    ``GROUP_{groupid}`` or ``INST_{instid}`` for individual users, lookup groups and lookup
+    institutions.
+
+    Rows are maintained by :py:func:`~.update_permission_principals` and should not be modified
+    directly.
+
+    """
+    #: Permission which is granted to the principal
+    permission = models.ForeignKey(
+        Permission, on_delete=models.CASCADE, related_name='principals', editable=False)
+
+    #: Principal token
+    principal = models.TextField(editable=False)
+
+    class Meta:
+        unique_together = (('permission', 'principal'),)
+        indexes = [
+            # Permission conditions look up the permissions matching a set of principals.
+            # Including the permission allows this to be answered from the index alone.
+            models.Index(fields=['principal', 'permission']),
+        ]
+
+    def __str__(self):
+        return '{} granted to {}'.format(self.permission_id, self.principal)
+
+
+def update_permission_principals(permissions):
+    """
+    Rebuild the :py:class:`~.PermissionPrincipal` rows for all the :py:class:`~.Permission`
+    objects in the passed queryset. This runs a fixed number of statements irrespective of the
+    number of permissions.
+
+    """
+    permission_ids_sql, params = permissions.values('id').query.sql_with_params()
+    principal_table = PermissionPrincipal._meta.db_table
+    permission_table = Permission._meta.db_table
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            DELETE FROM {principal_table} WHERE permission_id IN ({permission_ids_sql})
+        """, params)
+
+        cursor.execute(f"""
+            WITH
+                permission
+            AS (
+                SELECT * FROM {permission_table} WHERE id IN ({permission_ids_sql})
+            )
+            INSERT INTO {principal_table} (permission_id, principal)
+            SELECT DISTINCT permission_id, principal FROM (
+                SELECT id, 'WORLD' FROM permission WHERE is_public
+                UNION ALL
+                SELECT id, 'CAM' FROM permission WHERE is_signed_in
+                UNION ALL
+                SELECT id, 'USER_' || crsid FROM permission, unnest(crsids) AS crsid
+                UNION ALL
+                SELECT id, 'GROUP_' || groupid FROM permission, unnest(lookup_groups) AS groupid
+                UNION ALL
+                SELECT id, 'INST_' || instid FROM permission, unnest(lookup_insts) AS instid
+            ) AS principals (permission_id, principal)
+        """, params)
+
+
+def update_publicly_viewable(items):
+    """
+    Recompute :py:attr:`~.MediaItem.is_publicly_viewable` for all the :py:class:`~.MediaItem`
+    objects in the passed queryset. This runs a single statement irrespective of the number of
+    items and only writes those rows whose flag has changed.
+
+    """
+    item_ids_sql, params = items.values('id').query.sql_with_params()
+    item_table = MediaItem._meta.db_table
+    permission_table = Permission._meta.db_table
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {item_table} AS item
+            SET is_publicly_viewable = viewable.is_publicly_viewable
+            FROM (
+                SELECT
+                    item.id,
+                    COALESCE(view_permission.is_public, FALSE)
+                    OR COALESCE(edit_permission.is_public, FALSE)
+                FROM {item_table} AS item
+                LEFT OUTER JOIN {permission_table} AS view_permission
+                    ON view_permission.allows_view_item_id = item.id
+                LEFT OUTER JOIN {permission_table} AS edit_permission
+                    ON edit_permission.allows_edit_channel_id = item.channel_id
+                WHERE item.id IN ({item_ids_sql})
+            ) AS viewable (id, is_publicly_viewable)
+            WHERE
+                item.id = viewable.id
+                AND item.is_publicly_viewable <> viewable.is_publicly_viewable
+        """, params)
+
+
 class UploadEndpoint(models.Model):
     """
     An endpoint which can be used to upload a media item.
@@ -415,7 +692,7 @@ class UploadEndpoint(models.Model):
     expires_at = models.DateTimeField(editable=False, help_text='Expiry time of URL')
 
 
-class ChannelQuerySet(PermissionQuerySetMixin, models.QuerySet):
+class ChannelQuerySet(SearchQuerySetMixin, PermissionQuerySetMixin, models.QuerySet):
     def annotate_viewable(self, user, name='viewable'):
         """
         Annotate the query set with a boolean indicating if the user can view the channel.
@@ -546,21 +823,31 @@ class Channel(models.Model):
     #: visible.
     deleted_at = models.DateTimeField(null=True, blank=True)
 
+    #: Full-text search vector over the title and description. This is maintained by a database
+    #: trigger and should not be modified directly. See :py:meth:`~.SearchQuerySetMixin.search`.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
+
     def __str__(self):
         return '{} ("{}")'.format(self.id, self.title)
 
 
-class PlaylistQuerySet(PermissionQuerySetMixin, models.QuerySet):
+class PlaylistQuerySet(SearchQuerySetMixin, PermissionQuerySetMixin, models.QuerySet):
     def annotate_viewable(self, user, name='viewable'):
         """
         Annotate the query set with a boolean indicating if the user can view the item.
 
         """
+        # The condition is the same as that used by viewable_by_user() so that the two agree.
         return self.annotate(**{
             name: models.Case(
                 models.When(
-                    Q(self._permission_condition('view_permission', user) |
-                      self._permission_condition('channel__edit_permission', user)),
+                    Q(self._principal_condition('view_permission', user) |
+                      self._principal_condition('channel__edit_permission', user)),
                     then=models.Value(True)
                 ),
                 default=models.Value(False),
@@ -573,8 +860,8 @@ class PlaylistQuerySet(PermissionQuerySetMixin, models.QuerySet):
         Filter the queryset to only those items which can be viewed by the passed Django user.
 
         """
-        return self.filter(Q(self._permission_condition('view_permission', user) |
-                             self._permission_condition('channel__edit_permission', user)))
+        return self.filter(Q(self._principal_condition('view_permission', user) |
+                             self._principal_condition('channel__edit_permission', user)))
 
     def annotate_editable(self, user, name='editable'):
         """
@@ -662,6 +949,15 @@ class Playlist(models.Model):
     #: visible.
     deleted_at = models.DateTimeField(null=True, blank=True)
 
+    #: Full-text search vector over the title and description. This is maintained by a database
+    #: trigger and should not be modified directly. See :py:meth:`~.SearchQuerySetMixin.search`.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
+
     @cached_property
     def fetched_media_items_in_order(self):
         """Helper method that fetch the playlist's :py:class:`~.MediaItem` objects
@@ -677,6 +973,17 @@ class Playlist(models.Model):
         return '{} ("{}")'.format(self.id, self.title)
 
 
+@receiver(post_init, sender=MediaItem)
+def _media_item_post_init_handler(*args, sender, instance, **kwargs):
+    """
+    A post_init handler for :py:class:`~.MediaItem` which records the channel the item was loaded
+    with so that :py:func:`~._media_item_post_save_handler` can tell if it has moved channel. If
+    the channel was deferred when loading, it is recorded as ``DEFERRED``.
+
+    """
+    instance._saved_channel_id = instance.__dict__.get('channel_id', models.DEFERRED)
+
+
 @receiver(post_save, sender=MediaItem)
 def _media_item_post_save_handler(*args, sender, instance, created, raw, **kwargs):
     """
@@ -684,9 +991,16 @@ def _media_item_post_save_handler(*args, sender, instance, created, raw, **kwarg
     if they don't exist.
 
     """
+    channel_changed = instance._saved_channel_id != instance.channel_id
+    instance._saved_channel_id = instance.channel_id
+
     # If this is a "raw" update (e.g. from a test fixture) or was not the creation of the item,
-    # don't try to create objects.
+    # don't try to create objects. For a "raw" update, the item may have been saved after its
+    # permissions and otherwise the item may have moved channel. In either case, recompute its
+    # publicly viewable flag. Changes to the view permission itself are handled when it is saved.
     if raw or not created:
+        if (raw or channel_changed) and not getattr(_CONTEXT, 'defer_permission_updates', False):
+            update_publicly_viewable(MediaItem.objects_including_deleted.filter(id=instance.id))
         return
 
     if not hasattr(instance, 'view_permission'):
@@ -709,6 +1023,21 @@ def _channel_post_save_handler(*args, sender, instance, created, raw, **kwargs):
         Permission.objects.create(allows_edit_channel=instance)
 
 
+@receiver(post_delete, sender=Channel)
+def _channel_post_delete_handler(*args, sender, instance, **kwargs):
+    """
+    A post_delete handler for :py:class:`~.Channel` which recomputes the publicly viewable flag of
+    the media items which were in the channel. By this point those items have had their channel
+    set to NULL and so the flag is recomputed for all publicly viewable items with no channel.
+
+    """
+    if getattr(_CONTEXT, 'defer_permission_updates', False):
+        return
+
+    update_publicly_viewable(MediaItem.objects_including_deleted.filter(
+        channel__isnull=True, is_publicly_viewable=True))
+
+
 @receiver(post_save, sender=Playlist)
 def _playlist_post_save_handler(*args, sender, instance, created, raw, **kwargs):
     """
@@ -724,6 +1053,63 @@ def _playlist_post_save_handler(*args, sender, instance, created, raw, **kwargs)
     Permission.objects.get_or_create(allows_view_playlist=instance, is_public=True)
 
 
+@receiver(post_save, sender=Permission)
+def _permission_post_save_handler(*args, sender, instance, **kwargs):
+    """
+    A post_save handler for :py:class:`~.Permission` which keeps the corresponding
+    :py:class:`~.PermissionPrincipal` rows and the publicly viewable flag of the affected
+    :py:class:`~.MediaItem` objects up to date.
+
+    """
+    # Unlike the handlers above, this is run for "raw" saves as well since permissions loaded from
+    # fixtures need principals in order to be respected by viewable_by_user().
+    if getattr(_CONTEXT, 'defer_permission_updates', False):
+        return
+
+    update_permission_principals(Permission.objects.filter(id=instance.id))
+
+    if instance.allows_view_item_id is not None:
+        update_publicly_viewable(
+            MediaItem.objects_including_deleted.filter(id=instance.allows_view_item_id))
+    elif instance.allows_edit_channel_id is not None:
+        update_publicly_viewable(
+            MediaItem.objects_including_deleted.filter(channel_id=instance.allows_edit_channel_id))
+
+
+@contextlib.contextmanager
+def deferring_permission_updates():
+    """
+    Context manager within which saving a :py:class:`~.Permission` or :py:class:`~.MediaItem` does
+    not update :py:class:`~.PermissionPrincipal` rows or publicly viewable flags. Use this when
+    saving many objects and call :py:func:`~.update_permission_principals` and
+    :py:func:`~.update_publicly_viewable` once for all of them afterwards.
+
+    """
+    previous_value = getattr(_CONTEXT, 'defer_permission_updates', False)
+    _CONTEXT.defer_permission_updates = True
+    try:
+        yield
+    finally:
+        _CONTEXT.defer_permission_updates = previous_value
+
+
+def _principals_for_user(user):
+    """
+    Return a list of the :py:class:`~.PermissionPrincipal` principal tokens which match the passed
+    user. The anonymous user (or ``None``) only matches the ``WORLD`` principal.
+
+    """
+    principals = ['WORLD']
+
+    if user is not None and not user.is_anonymous:
+        groupids, instids = _groupids_and_instids_for_user(user)
+        principals.extend(['CAM', 'USER_' + user.username])
+        principals.extend(['GROUP_' + groupid for groupid in groupids])
+        principals.extend(['INST_' + instid for instid in instids])
+
+    return principals
+
+
 def _lookup_groupids_and_instids_for_user(user):
     """
     Return a tuple containing the list of group groupids and institution instids which the
@@ -731,8 +1117,8 @@ def _lookup_groupids_and_instids_for_user(user):
     multiple times.
 
     """
-    # automationlookup.get_person return values are cached
-    person = automationlookup.get_person(
+    # lookup.get_person return values are cached and shared between processes
+    person = lookup.get_person(
         identifier=user.username, scheme=getattr(settings, 'LOOKUP_SCHEME', 'crsid'),
         fetch=['all_groups', 'all_insts']
     )
@@ -748,3 +1134,71 @@ def _lookup_groupids_and_instids_for_user(user):
             if inst.get('instid') is not None
         ]
     )
+
+
+#: Thread-local state holding the currently active :py:class:`~.MembershipResolver` (if any) and
+#: whether permission updates are being deferred.
+_CONTEXT = threading.local()
+
+
+class MembershipResolver:
+    """
+    Memoises the lookup groups and institutions which users are members of. A resolver is intended
+    to live for the duration of a single request so that every queryset and serializer which needs
+    to build a permission condition shares one lookup call per user. See
+    :py:func:`~.resolving_memberships`.
+
+    """
+    def __init__(self):
+        self._memberships = {}
+
+        #: Number of calls made to lookup by this resolver.
+        self.lookup_count = 0
+
+        #: Number of calls to lookup which were avoided because the result was already known.
+        self.saved_lookup_count = 0
+
+    def groupids_and_instids_for_user(self, user):
+        """
+        Return the same value as :py:func:`~._lookup_groupids_and_instids_for_user` but only call
+        it once for each distinct user.
+
+        """
+        try:
+            memberships = self._memberships[user.username]
+        except KeyError:
+            self.lookup_count += 1
+            memberships = _lookup_groupids_and_instids_for_user(user)
+            self._memberships[user.username] = memberships
+        else:
+            self.saved_lookup_count += 1
+        return memberships
+
+
+@contextlib.contextmanager
+def resolving_memberships():
+    """
+    Context manager which activates a new :py:class:`~.MembershipResolver` for the current thread.
+    Within the context, permission conditions resolve each user's lookup memberships at most once.
+    The resolver is returned as the value of the context. The previously active resolver (if any)
+    is restored on exit.
+
+    """
+    previous_resolver = getattr(_CONTEXT, 'resolver', None)
+    _CONTEXT.resolver = resolver = MembershipResolver()
+    try:
+        yield resolver
+    finally:
+        _CONTEXT.resolver = previous_resolver
+
+
+def _groupids_and_instids_for_user(user):
+    """
+    Return the lookup groupids and instids for a user via the active
+    :py:class:`~.MembershipResolver` if there is one or directly from lookup if there is not.
+
+    """
+    resolver = getattr(_CONTEXT, 'resolver', None)
+    if resolver is None:
+        return _lookup_groupids_and_instids_for_user(user)
+    return resolver.groupids_and_instids_for_user(user)
@@ -0,0 +1,58 @@
+from django.db import connection
+
+#: SQL expressions for each column set by :py:func:`~.seed_media_items`. The expressions may refer
+#: to the 1-based index of the item as "i".
+MEDIA_ITEM_SEED_COLUMNS = {
+    'id': "'item' || i",
+    'title': "'Lecture ' || i",
+    'description': "'Description of lecture ' || i",
+    'duration': '0',
+    'type': "'unknown'",
+    'downloadable': 'FALSE',
+    'language': "''",
+    'copyright': "''",
+    'tags': "'{}'",
+    'created_at': 'NOW()',
+    'updated_at': 'NOW()',
+    'is_publicly_viewable': 'FALSE',
+}
+
+
+def seed_media_items(count, **column_overrides):
+    """
+    Add *count* media items to the database and update the table statistics used by the query
+    planner. The items are inserted directly in SQL since creating many objects via the ORM is
+    slow. Keyword arguments override or add to the SQL expressions in
+    :py:data:`~.MEDIA_ITEM_SEED_COLUMNS`. For example::
+
+        seed_media_items(300, published_at="NOW() - i * INTERVAL '1 minute'")
+
+    """
+    columns = {**MEDIA_ITEM_SEED_COLUMNS, **column_overrides}
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO mediaplatform_mediaitem ({', '.join(columns.keys())})
+            SELECT {', '.join(columns.values())}
+            FROM generate_series(1, %(count)s) AS i
+        ''', {'count': count})
+        cursor.execute('ANALYZE mediaplatform_mediaitem')
+
+
+def explain(queryset):
+    """Return the query plan for a queryset as a string. See :py:func:`~.explain_sql`."""
+    return explain_sql(*queryset.query.sql_with_params())
+
+
+def explain_sql(sql, params=None):
+    """
+    Return the query plan for an SQL statement as a string. Sequential scans are disabled while
+    planning. On the small tables seeded by tests, a sequential scan is usually cheapest and so
+    this is needed for the plan to show whether an index can be used.
+
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SET enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + sql, params)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+        cursor.execute('RESET enable_seqscan')
+    return plan
@@ -0,0 +1,76 @@
+from django.contrib import admin
+from django.test import TestCase
+
+from legacysms import models as legacymodels
+from mediaplatform_jwp import models as jwpmodels
+
+from .. import admin as mpadmin
+from .. import models
+from . import explain, seed_media_items
+
+
+class AdminSearchTest(TestCase):
+    def setUp(self):
+        self.item = models.MediaItem.objects.create(
+            title='Quantum chromodynamics', description='A lecture on the strong interaction',
+            tags=['physics'])
+        self.other_item = models.MediaItem.objects.create(title='Organic chemistry')
+
+    def test_media_item_title_and_description(self):
+        """Every word must appear in the title or description."""
+        self.assertEqual(self.search_ids(models.MediaItem, 'CHROMO strong'), [self.item.id])
+        self.assertEqual(self.search_ids(models.MediaItem, 'chromo weak'), [])
+
+    def test_media_item_id_key_and_tags(self):
+        """Media items are matched by id, JWPlatform key and tag."""
+        jwpmodels.Video.objects.create(key='abc123', item=self.item, updated=0)
+        self.assertEqual(self.search_ids(models.MediaItem, self.item.id), [self.item.id])
+        self.assertEqual(self.search_ids(models.MediaItem, 'abc123'), [self.item.id])
+        self.assertEqual(self.search_ids(models.MediaItem, 'Physics'), [self.item.id])
+
+    def test_channel(self):
+        channel = models.Channel.objects.create(title='Physics lectures')
+        self.assertEqual(self.search_ids(models.Channel, 'physic'), [channel.id])
+        self.assertEqual(self.search_ids(models.Channel, channel.id), [channel.id])
+
+    def test_video(self):
+        video = jwpmodels.Video.objects.create(key='abc123', item=self.item, updated=0)
+        self.assertEqual(self.search_ids(jwpmodels.Video, 'chromo'), [video.key])
+        self.assertEqual(self.search_ids(jwpmodels.Video, 'abc123'), [video.key])
+        self.assertEqual(self.search_ids(jwpmodels.Video, 'physics'), [video.key])
+
+    def test_legacy_sms_media_item(self):
+        sms_item = legacymodels.MediaItem.objects.create(id=1234, item=self.item)
+        self.assertEqual(self.search_ids(legacymodels.MediaItem, 'chromo'), [sms_item.id])
+        self.assertEqual(self.search_ids(legacymodels.MediaItem, '1234'), [sms_item.id])
+
+    def test_title_and_description_condition_uses_indexes(self):
+        queryset = models.MediaItem.objects_including_deleted.filter(
+            mpadmin.title_and_description_condition('quantum chromodynamics'))
+        plan = self.seed_and_explain(queryset)
+        self.assertIn('mediaplatform_mediaitem_title_trgm', plan)
+        self.assertIn('mediaplatform_mediaitem_description_trgm', plan)
+
+    def test_media_item_search_uses_indexes(self):
+        """Every branch of the media item search condition, including tags, is indexed."""
+        model_admin = admin.site._registry[models.MediaItem]
+        queryset, _ = model_admin.get_search_results(
+            None, models.MediaItem.objects_including_deleted.all(), 'chromodynamics')
+        self.assertIn('mediaplatfo_tags_c8e8da_gin', self.seed_and_explain(queryset))
+
+    def seed_and_explain(self, queryset):
+        """
+        Return the query plan for a queryset after adding many media items. Assert that the plan
+        does not scan the entire media item table.
+
+        """
+        seed_media_items(100, tags="ARRAY['lecture', 'tag' || i]")
+        plan = explain(queryset)
+        self.assertNotIn('Seq Scan on mediaplatform_mediaitem', plan)
+        return plan
+
+    def search_ids(self, model, search_term):
+        model_admin = admin.site._registry[model]
+        queryset, _ = model_admin.get_search_results(
+            None, model_admin.get_queryset(None), search_term)
+        return [obj.pk for obj in queryset]
@@ -0,0 +1,170 @@
+import contextlib
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from .. import lookup
+
+
+PERSON_FIXTURE = {
+    'groups': [{'groupid': '0123'}],
+    'institutions': [{'instid': 'DEPTA'}],
+}
+
+
+@override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'lookup': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'lookup-tests',
+        },
+    },
+    LOOKUP_MEMBERSHIP_CACHE='lookup',
+    LOOKUP_MEMBERSHIP_CACHE_TIMEOUT=60,
+    LOOKUP_MEMBERSHIP_CACHE_SOFT_TIMEOUT=30,
+    LOOKUP_MEMBERSHIP_CACHE_LOCK_TIMEOUT=1,
+)
+class GetPersonTest(TestCase):
+    def setUp(self):
+        self.get_person_patcher = mock.patch('automationlookup.get_person')
+        self.get_person = self.get_person_patcher.start()
+        self.get_person.return_value = PERSON_FIXTURE
+        self.addCleanup(self.get_person_patcher.stop)
+
+        self.cache = caches['lookup']
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+    def test_result_is_cached(self):
+        """Repeated calls for the same person result in one lookup call."""
+        for _ in range(3):
+            person = lookup.get_person(identifier='spqr1', scheme='crsid', fetch=['all_groups'])
+            self.assertEqual(person, PERSON_FIXTURE)
+        self.get_person.assert_called_once_with(
+            identifier='spqr1', scheme='crsid', fetch=['all_groups'])
+
+    def test_fetch_order_does_not_matter(self):
+        """The fetch list is treated as a set when caching."""
+        lookup.get_person('spqr1', 'crsid', fetch=['all_groups', 'all_insts'])
+        lookup.get_person('spqr1', 'crsid', fetch=['all_insts', 'all_groups'])
+        self.assertEqual(self.get_person.call_count, 1)
+
+    def test_distinct_fetch_sets_are_cached_separately(self):
+        """Different fetch sets are different cache entries."""
+        lookup.get_person('spqr1', 'crsid', fetch=['all_groups'])
+        lookup.get_person('spqr1', 'crsid', fetch=['all_insts'])
+        self.assertEqual(self.get_person.call_count, 2)
+
+    @override_settings(LOOKUP_MEMBERSHIP_CACHE_TIMEOUT=0)
+    def test_zero_timeout_disables_cache(self):
+        """A zero timeout passes every call through to lookup."""
+        lookup.get_person('spqr1', 'crsid', fetch=['all_groups'])
+        lookup.get_person('spqr1', 'crsid', fetch=['all_groups'])
+        self.assertEqual(self.get_person.call_count, 2)
+
+    def test_soft_expiry_refreshes_in_background(self):
+        """A stale entry is returned immediately and refreshed in the background."""
+        lookup.get_person('spqr1', 'crsid', fetch=['all_groups'])
+
+        new_person = {'groups': [], 'institutions': []}
+        self.get_person.return_value = new_person
+
+        with mock.patch('time.time', return_value=lookup.time.time() + 45), \
+                mock.patch('threading.Thread') as thread_class:
+            person = lookup.get_person('spqr1', 'crsid', fetch=['all_groups'])
+            self.assertEqual(person, PERSON_FIXTURE)
+
+            # Run the refresh synchronously
+            thread_class.assert_called_once()
+            thread_class.call_args[1]['target']()
+
+        self.assertEqual(lookup.get_person('spqr1', 'crsid', fetch=['all_groups']), new_person)
+        self.assertEqual(self.get_person.call_count, 2)
+
+    def test_refresh_is_single_flight(self):
+        """Only one background refresh is started while one is in progress."""
+        lookup.get_person('spqr1', 'crsid', fetch=['all_groups'])
+
+        with mock.patch('time.time', return_value=lookup.time.time() + 45), \
+                mock.patch('threading.Thread') as thread_class:
+            lookup.get_person('spqr1', 'crsid', fetch=['all_groups'])
+            lookup.get_person('spqr1', 'crsid', fetch=['all_groups'])
+
+        thread_class.assert_called_once()
+
+    def test_waits_for_lock_holder(self):
+        """A caller which cannot take the lock waits for the holder's result."""
+        key = lookup._cache_key('spqr1', 'crsid', ['all_groups'])
+        self.cache.add(key + ':lock', True, 1)
+
+        def sleep(interval):
+            # Simulate the lock holder storing its result
+            self.cache.set(key, (PERSON_FIXTURE, lookup.time.time() + 30), 60)
+
+        with mock.patch('time.sleep', side_effect=sleep):
+            person = lookup.get_person('spqr1', 'crsid', fetch=['all_groups'])
+
+        self.assertEqual(person, PERSON_FIXTURE)
+        self.get_person.assert_not_called()
+
+
+@override_settings(
+    LOOKUP_MEMBERSHIP_CACHE='lookup',
+    LOOKUP_MEMBERSHIP_CACHE_TIMEOUT=60,
+    LOOKUP_MEMBERSHIP_CACHE_LOCK_TIMEOUT=10,
+)
+class SharedCacheContentionTest(TransactionTestCase):
+    """
+    Check that concurrent workers using the configured "lookup" cache make a single lookup call
+    between them. Each worker is a thread which, to simulate separate processes, does not share the
+    in-process locks and so relies on the cache backend alone.
+
+    """
+    #: Number of workers looking up the same person at once
+    WORKER_COUNT = 4
+
+    def setUp(self):
+        self.cache = caches['lookup']
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+        def get_person(**kwargs):
+            # Hold on to the lock for long enough that the other workers contend for it.
+            time.sleep(0.2)
+            return PERSON_FIXTURE
+
+        self.get_person_patcher = mock.patch('automationlookup.get_person', side_effect=get_person)
+        self.get_person = self.get_person_patcher.start()
+        self.addCleanup(self.get_person_patcher.stop)
+
+        # A no-op context manager in place of the per-process thread locks.
+        self.thread_locks_patcher = mock.patch.object(
+            lookup, '_THREAD_LOCKS', [contextlib.suppress()])
+        self.thread_locks_patcher.start()
+        self.addCleanup(self.thread_locks_patcher.stop)
+
+    def test_concurrent_workers_make_one_lookup(self):
+        barrier = threading.Barrier(self.WORKER_COUNT)
+        results = []
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(lookup.get_person('spqr1', 'crsid', fetch=['all_groups']))
+            finally:
+                # A database cache backend opens a connection for each thread.
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.WORKER_COUNT)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [PERSON_FIXTURE] * self.WORKER_COUNT)
+        self.get_person.assert_called_once()
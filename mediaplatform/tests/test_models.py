@@ -1,18 +1,26 @@
+import os
 from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.db.models import Q, TextField
 from django.test import TestCase, override_settings
 
 from legacysms import models as legacymodels
 from .. import models
+from . import explain, seed_media_items
 
 
 User = get_user_model()
 
+#: Number of media items seeded by :py:class:`~.PermissionQueryPlanTest`. This may be increased
+#: via the DJANGO_PERMISSION_PLAN_TEST_ITEMS environment variable to check the plan on a
+#: realistically sized database. E.g. "100000".
+PERMISSION_PLAN_TEST_ITEMS = int(os.environ.get('DJANGO_PERMISSION_PLAN_TEST_ITEMS', '1000'))
+
 
 class ModelTestCase(TestCase):
     fixtures = ['mediaplatform/tests/fixtures/test_data.yaml']
@@ -129,6 +137,18 @@ class MediaItemTest(ModelTestCase):
         self.assert_user_cannot_view(AnonymousUser(), 'emptyperm')
         self.assert_user_cannot_view(self.user, 'emptyperm')
 
+    def test_viewable_annotation_agrees_with_filter(self):
+        """The viewable annotation and filter agree even if principals have not been updated."""
+        item = models.MediaItem.objects.get(id='emptyperm')
+        with models.deferring_permission_updates():
+            item.view_permission.crsids.append(self.user.username)
+            item.view_permission.save()
+        self.assert_user_cannot_view(self.user, item)
+
+        models.update_permission_principals(
+            models.Permission.objects.filter(id=item.view_permission.id))
+        self.assert_user_can_view(self.user, item)
+
     def test_item_with_matching_crsid_viewable(self):
         item = models.MediaItem.objects.get(id='emptyperm')
         self.assert_user_cannot_view(self.user, item)
@@ -237,6 +257,70 @@ class MediaItemTest(ModelTestCase):
         permission_id_2 = models.MediaItem.objects.get(id=item.id).view_permission.id
         self.assertEquals(permission_id_1, permission_id_2)
 
+    def test_publicly_viewable_follows_view_permission(self):
+        """Changing an item's view permission updates is_publicly_viewable."""
+        item = models.MediaItem.objects.get(id='emptyperm')
+        self.assertFalse(item.is_publicly_viewable)
+        item.view_permission.is_public = True
+        item.view_permission.save()
+        self.assertTrue(models.MediaItem.objects.get(id=item.id).is_publicly_viewable)
+        self.assert_user_can_view(AnonymousUser(), item)
+
+    def test_publicly_viewable_follows_channel_permission(self):
+        """Changing a channel's edit permission updates is_publicly_viewable of its items."""
+        channel = models.Channel.objects.get(id='channel1')
+        channel.edit_permission.is_public = True
+        channel.edit_permission.save()
+        self.assertFalse(
+            models.MediaItem.objects_including_deleted.filter(
+                channel=channel, is_publicly_viewable=False).exists())
+
+        channel.edit_permission.is_public = False
+        channel.edit_permission.save()
+        self.assert_user_cannot_view(AnonymousUser(), 'emptyperm')
+
+    def test_publicly_viewable_follows_channel_change(self):
+        """Moving an item out of a public channel updates is_publicly_viewable."""
+        channel = models.Channel.objects.get(id='channel1')
+        channel.edit_permission.is_public = True
+        channel.edit_permission.save()
+        self.assert_user_can_view(AnonymousUser(), 'emptyperm')
+
+        item = models.MediaItem.objects.get(id='emptyperm')
+        item.channel = None
+        item.save()
+        self.assert_user_cannot_view(AnonymousUser(), item)
+
+    def test_publicly_viewable_not_recomputed_if_channel_unchanged(self):
+        """Saving an item which has not moved channel does not recompute is_publicly_viewable."""
+        item = models.MediaItem.objects.get(id='emptyperm')
+        with mock.patch('mediaplatform.models.update_publicly_viewable') as update:
+            item.title = 'New title'
+            item.save()
+            update.assert_not_called()
+
+            item.channel = None
+            item.save()
+            update.assert_called_once()
+
+    def test_publicly_viewable_on_channel_delete(self):
+        """Deleting a public channel updates is_publicly_viewable of its items."""
+        channel = models.Channel.objects.get(id='channel1')
+        channel.edit_permission.is_public = True
+        channel.edit_permission.save()
+        self.assert_user_can_view(AnonymousUser(), 'emptyperm')
+
+        channel.delete()
+        self.assert_user_cannot_view(AnonymousUser(), 'emptyperm')
+        self.assert_user_can_view(AnonymousUser(), 'public')
+
+    def test_anonymous_viewable_does_not_join_permissions(self):
+        """Filtering for the anonymous user does not involve the permission tables."""
+        qs = models.MediaItem.objects.all().viewable_by_user(AnonymousUser())
+        self.assertNotIn(models.Permission._meta.db_table, str(qs.query))
+        qs = models.MediaItem.objects.all().annotate_viewable(None)
+        self.assertNotIn(models.Permission._meta.db_table, str(qs.query))
+
     def test_sms_item_not_editable(self):
         """An item with associated SMS media item or channel is not editable."""
         item = models.MediaItem.objects.get(id='emptyperm')
@@ -320,6 +404,187 @@ class PermissionTest(TestCase):
         """A Permission object should be creatable with no field values."""
         models.Permission.objects.create()
 
+    def test_principals_on_save(self):
+        """Saving a permission updates its principals."""
+        permission = models.Permission.objects.create()
+        self.assertEqual(permission.principals.count(), 0)
+
+        permission.is_public = True
+        permission.is_signed_in = True
+        permission.crsids.extend(['spqr1', 'spqr1'])
+        permission.lookup_groups.append('0123')
+        permission.lookup_insts.append('DEPTA')
+        permission.save()
+        self.assertEqual(
+            set(permission.principals.values_list('principal', flat=True)),
+            {'WORLD', 'CAM', 'USER_spqr1', 'GROUP_0123', 'INST_DEPTA'})
+
+        permission.reset()
+        permission.save()
+        self.assertEqual(permission.principals.count(), 0)
+
+    def test_deferring_permission_updates(self):
+        """Principals are not updated on save when updates are deferred."""
+        permission = models.Permission.objects.create()
+        with models.deferring_permission_updates():
+            permission.is_public = True
+            permission.save()
+        self.assertEqual(permission.principals.count(), 0)
+
+        models.update_permission_principals(models.Permission.objects.filter(id=permission.id))
+        self.assertEqual(list(permission.principals.values_list('principal', flat=True)),
+                         ['WORLD'])
+
+
+class PermissionQueryPlanTest(TestCase):
+    """
+    Check that :py:meth:`mediaplatform.models.MediaItemQuerySet.viewable_by_user` is answered from
+    the permission principal index rather than by scanning the permission tables.
+
+    """
+    #: Name of the permission principal index created by migration 0014
+    PRINCIPAL_INDEX = 'mediaplatfo_princip_d25554_idx'
+
+    #: Number of media items to seed the database with
+    ITEM_COUNT = PERMISSION_PLAN_TEST_ITEMS
+
+    @classmethod
+    def setUpTestData(cls):
+        # Seed the database directly in SQL since creating this many objects via the ORM is slow.
+        # Around 1% of items are public, 1% are visible to signed in users and the remainder are
+        # restricted to a user, lookup group or lookup institution which is rarely matched.
+        seed_media_items(
+            cls.ITEM_COUNT, title="''", description="''", is_publicly_viewable='i % 100 = 0')
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO mediaplatform_permission (
+                    id, allows_view_item_id, crsids, lookup_groups, lookup_insts, is_public,
+                    is_signed_in
+                )
+                SELECT
+                    'perm' || i, 'item' || i,
+                    ARRAY['user' || (i % 5000)], ARRAY['group' || (i % 5000)],
+                    ARRAY['inst' || (i % 5000)], i % 100 = 0, i % 100 = 1
+                FROM generate_series(1, %(count)s) AS i
+            ''', {'count': cls.ITEM_COUNT})
+        models.update_permission_principals(models.Permission.objects.all())
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE mediaplatform_permission')
+            cursor.execute('ANALYZE mediaplatform_permissionprincipal')
+
+    def setUp(self):
+        self.user = User.objects.create(username='user1')
+
+        self.lookup_groupids_and_instids_for_user_patcher = mock.patch(
+                'mediaplatform.models._lookup_groupids_and_instids_for_user')
+        self.lookup_groupids_and_instids_for_user = (
+            self.lookup_groupids_and_instids_for_user_patcher.start())
+        self.lookup_groupids_and_instids_for_user.return_value = (['group1'], ['inst1'])
+        self.addCleanup(self.lookup_groupids_and_instids_for_user_patcher.stop)
+
+    def test_anonymous_does_not_use_permissions(self):
+        plan = explain(models.MediaItem.objects.viewable_by_user(AnonymousUser()))
+        self.assertNotIn('mediaplatform_permission', plan)
+
+    def test_signed_in_uses_index(self):
+        plan = explain(models.MediaItem.objects.viewable_by_user(self.user))
+        self.assertNotIn('Seq Scan on mediaplatform_permission', plan)
+        self.assertIn(self.PRINCIPAL_INDEX, plan)
+
+
+class SearchTest(TestCase):
+    """
+    Check that the search vectors are maintained and used by
+    :py:meth:`mediaplatform.models.SearchQuerySetMixin.search`.
+
+    """
+    def test_vector_set_on_create(self):
+        item = models.MediaItem.objects.create(title='Quantum chromodynamics')
+        self.assertEqual(self.search_ids(models.MediaItem, 'chromodynamics'), [item.id])
+
+    def test_vector_updated_on_save(self):
+        item = models.MediaItem.objects.create(title='Quantum chromodynamics')
+        item.title = 'Quantum electrodynamics'
+        item.save()
+        self.assertEqual(self.search_ids(models.MediaItem, 'chromodynamics'), [])
+        self.assertEqual(self.search_ids(models.MediaItem, 'electrodynamics'), [item.id])
+
+    def test_vector_updated_on_queryset_update(self):
+        item = models.MediaItem.objects.create(title='Lecture')
+        models.MediaItem.objects.filter(id=item.id).update(description='About chromodynamics')
+        self.assertEqual(self.search_ids(models.MediaItem, 'chromodynamics'), [item.id])
+
+    def test_channels_and_playlists(self):
+        channel = models.Channel.objects.create(title='Chromodynamics')
+        playlist = models.Playlist.objects.create(
+            channel=channel, title='Lectures', description='About chromodynamics')
+        self.assertEqual(self.search_ids(models.Channel, 'chromodynamics'), [channel.id])
+        self.assertEqual(self.search_ids(models.Playlist, 'chromodynamics'), [playlist.id])
+
+    def test_search_text_is_not_parsed_as_query(self):
+        """Characters with a special meaning in tsquery are ignored."""
+        item = models.MediaItem.objects.create(title='Quantum chromodynamics')
+        self.assertEqual(self.search_ids(models.MediaItem, "quantum & !'(chromo:*"), [item.id])
+
+    def test_combined_prefix_queries(self):
+        """Prefix queries may be combined and each matches its last word as a prefix."""
+        item = models.MediaItem.objects.create(title='Quantum chromodynamics')
+        other_item = models.MediaItem.objects.create(title='Organic chemistry')
+        query = (
+            models.PrefixSearchQuery('chromo', config=models.SEARCH_CONFIG)
+            | models.PrefixSearchQuery('organ', config=models.SEARCH_CONFIG)
+        )
+        self.assertEqual(
+            set(models.MediaItem.objects.filter(search_vector=query).values_list('id', flat=True)),
+            {item.id, other_item.id})
+
+    def test_condition(self):
+        """Objects matching the passed condition are included."""
+        item = models.MediaItem.objects.create(title='Lecture', tags=['chromodynamics'])
+        results = models.MediaItem.objects.search(
+            'chromodynamics', Q(tags__contains=['chromodynamics']))
+        self.assertEqual([result.id for result in results], [item.id])
+
+    def test_search_uses_index(self):
+        seed_media_items(100)
+        plan = explain(models.MediaItem.objects.search('chromodynamics'))
+        self.assertNotIn('Seq Scan on mediaplatform_mediaitem', plan)
+        self.assertIn('mediaplatfo_search__7a40bd_gin', plan)
+
+    def test_similar_matches_misspelled_and_partial_words(self):
+        item = models.MediaItem.objects.create(
+            title='Quantum chromodynamics', description='Lecture on the strong interaction')
+        models.MediaItem.objects.create(title='Organic chemistry')
+        self.assertEqual(self.search_similar_ids(models.MediaItem, 'cromodynamic'), [item.id])
+        self.assertEqual(self.search_similar_ids(models.MediaItem, 'INTERACT'), [item.id])
+
+    def test_similar_ranking(self):
+        """Closer matches rank above less close ones."""
+        close = models.MediaItem.objects.create(title='Chromodynamics')
+        other = models.MediaItem.objects.create(title='Chromodynamical')
+        results = (
+            models.MediaItem.objects.search_similar('chromodynamics').order_by('-search_rank'))
+        self.assertEqual([obj.id for obj in results], [close.id, other.id])
+
+    def test_similar_does_not_register_lookups(self):
+        """Similar search does not add lookups to every text field."""
+        lookups = TextField.get_lookups()
+        self.assertNotIn('upper', lookups)
+        self.assertNotIn('trigram_word_similar', lookups)
+
+    def test_similar_uses_index(self):
+        seed_media_items(100)
+        plan = explain(models.MediaItem.objects.search_similar('chromodynamics'))
+        self.assertNotIn('Seq Scan on mediaplatform_mediaitem', plan)
+        self.assertIn('mediaplatform_mediaitem_title_trgm', plan)
+        self.assertIn('mediaplatform_mediaitem_description_trgm', plan)
+
+    def search_ids(self, model, text):
+        return [obj.id for obj in model.objects.search(text)]
+
+    def search_similar_ids(self, model, text):
+        return [obj.id for obj in model.objects.search_similar(text)]
+
 
 class LookupTest(TestCase):
     PERSON_FIXTURE = {
@@ -367,6 +632,47 @@ class LookupTest(TestCase):
             fetch=['all_groups', 'all_insts'])
 
 
+class MembershipResolverTest(ModelTestCase):
+    model = models.MediaItem
+
+    def test_lookup_called_once_per_user(self):
+        """Within a resolving context, lookup is called once however many conditions are built."""
+        with models.resolving_memberships() as resolver:
+            list(
+                models.MediaItem.objects.all()
+                .viewable_by_user(self.user)
+                .annotate_viewable(self.user)
+                .annotate_editable(self.user)
+            )
+            list(models.Channel.objects.all().editable_by_user(self.user))
+
+        self.lookup_groupids_and_instids_for_user.assert_called_once_with(self.user)
+        self.assertEqual(resolver.lookup_count, 1)
+        self.assertGreater(resolver.saved_lookup_count, 0)
+
+    def test_lookup_not_memoised_outside_context(self):
+        """Outside of a resolving context, every condition calls lookup."""
+        models.MediaItem.objects.all().viewable_by_user(self.user)
+        models.MediaItem.objects.all().viewable_by_user(self.user)
+        self.assertEqual(self.lookup_groupids_and_instids_for_user.call_count, 4)
+
+    def test_anonymous_user_does_not_call_lookup(self):
+        """The anonymous user never needs a lookup call."""
+        with models.resolving_memberships() as resolver:
+            models.MediaItem.objects.all().viewable_by_user(AnonymousUser())
+        self.lookup_groupids_and_instids_for_user.assert_not_called()
+        self.assertEqual(resolver.lookup_count, 0)
+
+    def test_contexts_nest(self):
+        """The outer resolver is restored when an inner context exits."""
+        with models.resolving_memberships() as outer:
+            with models.resolving_memberships() as inner:
+                models.MediaItem.objects.all().viewable_by_user(self.user)
+            models.MediaItem.objects.all().viewable_by_user(self.user)
+        self.assertEqual(inner.lookup_count, 1)
+        self.assertEqual(outer.lookup_count, 1)
+
+
 class ChannelTest(ModelTestCase):
 
     model = models.Channel
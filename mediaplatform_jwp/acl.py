@@ -2,14 +2,18 @@
 Module providing functionality for handling ACL's stored in the JWPlayer custom property - sms_acl.
 
 """
+import functools
 import logging
 
 from django.conf import settings
 
-import automationlookup
+from mediaplatform import lookup
 
 LOG = logging.getLogger(__name__)
 
+#: Maximum number of distinct compiled ACLs held by :py:func:`~.compile_acl`.
+COMPILED_ACL_CACHE_SIZE = 1024
+
 
 class AceWorld:
     """This class encapsulates an ACE of the form WORLD"""
@@ -59,7 +63,7 @@ class AceInst:
         if user.is_anonymous:
             return False
 
-        lookup_response = automationlookup.get_person(
+        lookup_response = lookup.get_person(
             user.username, settings.LOOKUP_SCHEME, fetch=['all_insts'])
 
         for institution in lookup_response.get('institutions', []):
@@ -87,7 +91,7 @@ class AceGroup:
         if user.is_anonymous:
             return False
 
-        lookup_response = automationlookup.get_person(
+        lookup_response = lookup.get_person(
             user.username, settings.LOOKUP_SCHEME, fetch=['all_groups'])
 
         for institution in lookup_response.get('groups', []):
@@ -123,8 +127,7 @@ def build_acl(acl):
     """
     Iterates over the acl and encapsulates each ACE with the corresponding Ace* Class.
 
-    TODO there are performance enhancements that can be made
-    (Eg only returning AceWorld, if it exists) but I have kept thing simple for now.
+    See :py:func:`~.compile_acl` for a form of the ACL which is quicker to evaluate.
 
     :param acl: access control list
     :return: list of Ace* objects
@@ -140,3 +143,76 @@ def build_acl(acl):
                 break
         assert found, f"'{ace}' not recognised"
     return built_acl
+
+
+class CompiledAcl:
+    """
+    An ACL compiled into a form which can be evaluated against a user quickly. The ``WORLD`` and
+    ``CAM`` entries are checked first and all ``INST_`` and ``GROUP_`` entries are evaluated
+    against a single lookup call for the user. Use :py:func:`~.compile_acl` to construct
+    instances.
+
+    """
+    def __init__(self, acl):
+        built_acl = build_acl(acl)
+
+        #: Does the ACL contain a WORLD entry?
+        self.is_world = any(isinstance(ace, AceWorld) for ace in built_acl)
+
+        #: Does the ACL contain a CAM entry?
+        self.is_cam = any(isinstance(ace, AceCam) for ace in built_acl)
+
+        #: The crsids from USER_ entries
+        self.crsids = frozenset(ace.crsid for ace in built_acl if isinstance(ace, AceUser))
+
+        #: The instids from INST_ entries
+        self.instids = frozenset(ace.instid for ace in built_acl if isinstance(ace, AceInst))
+
+        #: The groupids (or group names) from GROUP_ entries
+        self.groupids = frozenset(ace.groupid for ace in built_acl if isinstance(ace, AceGroup))
+
+    def has_permission(self, user):
+        """Return True if the user matches any entry in the ACL."""
+        if self.is_world:
+            return True
+
+        if user.is_anonymous:
+            return False
+
+        if self.is_cam or user.username in self.crsids:
+            return True
+
+        if len(self.instids) == 0 and len(self.groupids) == 0:
+            return False
+
+        # Fetch groups and institutions together so that there is at most one lookup call no
+        # matter how many INST_ and GROUP_ entries there are. This matches the fetch used for
+        # mediaplatform permissions and so shares its cache entries.
+        lookup_response = lookup.get_person(
+            user.username, settings.LOOKUP_SCHEME, fetch=['all_groups', 'all_insts'])
+
+        for institution in lookup_response.get('institutions', []):
+            if institution.get('instid') in self.instids:
+                return True
+
+        for group in lookup_response.get('groups', []):
+            if group.get('groupid') in self.groupids or group.get('name') in self.groupids:
+                return True
+
+        return False
+
+
+def compile_acl(acl):
+    """
+    Return a :py:class:`~.CompiledAcl` for the passed access control list. Compiled ACLs are cached
+    so each distinct ACL is only parsed once.
+
+    :param acl: access control list
+    :return: :py:class:`~.CompiledAcl` instance
+    """
+    return _compile_acl(tuple(acl))
+
+
+@functools.lru_cache(maxsize=COMPILED_ACL_CACHE_SIZE)
+def _compile_acl(acl):
+    return CompiledAcl(acl)
@@ -2,11 +2,14 @@ import datetime
 
 from django.conf import settings
 from django.contrib import admin
+from django.db.models import Q
 from django.urls import reverse
 from django.utils.formats import localize
 from django.utils.html import format_html
 
 from automationlookup.models import UserLookup
+from mediaplatform import models as mpmodels
+from mediaplatform.admin import title_and_description_condition
 
 from mediaplatform_jwp.api import delivery as api
 from .models import Video, CachedResource
@@ -61,13 +64,22 @@ class VideoAdmin(admin.ModelAdmin):
         )
 
     def get_search_results(self, request, queryset, search_term):
-        """Allow searching by item tag in addition to the fields in search_fields."""
-        queryset, use_distinct = super().get_search_results(request, queryset, search_term)
-
-        # Also match on item tags
-        queryset |= self.model.objects.filter(item__tags__contains=[search_term.lower()])
-
-        return queryset, use_distinct
+        """
+        Match the key and words in the title or description or tags of the item. Matching items
+        are found from the indexes on the media item table in a subquery rather than by matching
+        every joined item.
+
+        """
+        search_term = search_term.strip()
+        if search_term == '':
+            return queryset, False
+
+        items = mpmodels.MediaItem.objects_including_deleted.filter(
+            title_and_description_condition(search_term)
+            | Q(tags__contains=[search_term.lower()])
+        )
+        condition = Q(key=search_term) | Q(item__in=items.values('id'))
+        return queryset.filter(condition), False
 
     def get_queryset(self, request):
         """Ensure that related items are also fetched by the queryset."""
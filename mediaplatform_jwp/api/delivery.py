@@ -2,26 +2,40 @@
 Interaction with the JWPlatform API.
 
 """
+import contextlib
+import functools
 import hashlib
 import logging
 import math
 import re
+import threading
 import time
 import urllib.parse
 
-import requests
 from django.conf import settings
+from django.core.cache import caches
 import django.core.exceptions
 import jwplatform
 import jwt
 
 from mediaplatform_jwp import acl
 from mediaplatform_jwp import models
+from mediaplatform_jwp.api import http
 
 LOG = logging.getLogger(__name__)
 
 # Default session used for making HTTP requests.
-DEFAULT_REQUESTS_SESSION = requests.Session()
+DEFAULT_REQUESTS_SESSION = http.SESSION
+
+#: Expiry times of signed URLs are rounded up to a multiple of this many seconds so that URLs
+#: signed for a resource within the same interval are identical and may be cached by the CDN.
+SIGNATURE_EXPIRY_INTERVAL = 180
+
+#: Maximum number of signed URLs and tokens held by each of the memoised signing functions.
+SIGNED_URL_CACHE_SIZE = 4096
+
+#: Thread-local state holding the currently active :py:class:`~.DeliveryCallCounter` (if any).
+_CONTEXT = threading.local()
 
 
 class VideoNotFoundError(RuntimeError):
@@ -62,14 +76,37 @@ def player_embed_url(key, player, format='js', base=None):
 
 def get_jwplatform_client():
     """
-    Examine the settings and return an authenticated :py:class:`jwplatform.Client` instance.
+    Examine the settings and return an authenticated :py:class:`jwplatform.Client` instance. The
+    same instance is returned while the credentials are unchanged.
 
     .. seealso::
 
         The `jwplatform module on GitHub <https://github.com/jwplayer/jwplatform-py>`_.
 
     """
-    return jwplatform.Client(settings.JWPLATFORM_API_KEY, settings.JWPLATFORM_API_SECRET)
+    return _jwplatform_client(settings.JWPLATFORM_API_KEY, settings.JWPLATFORM_API_SECRET)
+
+
+@functools.lru_cache(maxsize=1)
+def _jwplatform_client(api_key, api_secret):
+    """
+    Return a :py:class:`jwplatform.Client` for the passed credentials. The client is shared and
+    makes its requests with the shared outbound HTTP session, :py:data:`.http.SESSION`.
+
+    """
+    client = jwplatform.Client(api_key, api_secret)
+
+    # The jwplatform module has no public way to pass a session so replace the one it created.
+    # This relies on a private attribute of the 1.x client. Should it go away, requests would
+    # silently bypass the shared session's pooling, retries and circuit breaker so say so loudly.
+    if hasattr(client, '_connection'):
+        client._connection = http.SESSION
+    else:
+        LOG.warning(
+            'jwplatform.Client has no _connection attribute. Management API requests will not '
+            'use the shared HTTP session.')
+
+    return client
 
 
 class ResourceACLPermissionDenied(django.core.exceptions.PermissionDenied):
@@ -97,23 +134,16 @@ class Resource(dict):
         The parsed ACL custom prop on the resource. If no ACL is present, the WORLD ACL is assumed.
 
         """
-        field = parse_custom_field('acl', self.get('custom', {}).get('sms_acl', 'acl:WORLD:'))
-
-        # Work around odd ACL entries. See uisautomation/sms2jwplayer#30.
-        if field == "['']":
-            return []
-
-        return [acl.strip() for acl in field.split(',') if acl.strip() != '']
+        return list(_parse_acl_field(self.get('custom', {}).get('sms_acl', 'acl:WORLD:')))
 
     def check_user_access(self, user):
         """
         Check whether the specified Django user has permission to access this resource.
         Raises :py:exc:`~.ResourceACLPermissionDenied` if the user does not match the ACL.
         """
-        for ace in acl.build_acl(self.acl):
-            if ace.has_permission(user):
-                return True
-        raise ResourceACLPermissionDenied()
+        if not acl.compile_acl(self.acl).has_permission(user):
+            raise ResourceACLPermissionDenied()
+        return True
 
     def get_poster_url(self, width=720):
         return settings.JWPLATFORM_API_BASE_URL + 'thumbs/{key}-{width}.jpg'.format(
@@ -237,13 +267,7 @@ class DeliveryVideo(Resource):
         The parsed ACL custom prop on the resource. If no ACL is present, the WORLD ACL is assumed.
 
         """
-        field = parse_custom_field('acl', self.get('sms_acl', 'acl:WORLD:'))
-
-        # Work around odd ACL entries. See uisautomation/sms2jwplayer#30.
-        if field == "['']":
-            return []
-
-        return [acl.strip() for acl in field.split(',') if acl.strip() != '']
+        return list(_parse_acl_field(self.get('sms_acl', 'acl:WORLD:')))
 
     @classmethod
     def from_key(cls, key, session=None):
@@ -259,8 +283,10 @@ class DeliveryVideo(Resource):
         session = session if session is not None else DEFAULT_REQUESTS_SESSION
 
         # Fetch the media download information from JWPlatform.
+        _record_delivery_call()
         response = session.get(
-            pd_api_url(f'/v2/media/{key}', format='json'), timeout=5
+            pd_api_url(f'/v2/media/{key}', format='json'),
+            timeout=settings.JWPLATFORM_DELIVERY_TIMEOUT
         )
 
         if response.status_code == 404:
@@ -286,6 +312,87 @@ class DeliveryVideo(Resource):
         return cls(item)
 
 
+class DeliveryCallCounter:
+    """
+    Counts the HTTP requests made to the Delivery API by the current thread. A counter is intended
+    to live for the duration of a single request so that the number of outbound calls made to
+    render a page can be logged and tested. See :py:func:`~.counting_delivery_calls`.
+
+    """
+    def __init__(self):
+        #: Number of HTTP requests made to the Delivery API.
+        self.count = 0
+
+
+@contextlib.contextmanager
+def counting_delivery_calls():
+    """
+    Context manager which activates a new :py:class:`~.DeliveryCallCounter` for the current
+    thread. The counter is returned as the value of the context. The previously active counter (if
+    any) is restored on exit.
+
+    """
+    previous_counter = getattr(_CONTEXT, 'counter', None)
+    _CONTEXT.counter = counter = DeliveryCallCounter()
+    try:
+        yield counter
+    finally:
+        _CONTEXT.counter = previous_counter
+
+
+def _record_delivery_call():
+    """
+    Record a HTTP request to the Delivery API with the active :py:class:`~.DeliveryCallCounter`
+    if there is one.
+
+    """
+    counter = getattr(_CONTEXT, 'counter', None)
+    if counter is not None:
+        counter.count += 1
+
+
+def get_video_sources(key, updated):
+    """
+    Return the list of source dicts for the video with the passed JWPlatform key as returned by
+    the Delivery API.
+
+    Source lists are held in a cache shared between worker processes. The cache key includes the
+    video's JWPlatform *updated* timestamp so that a new source list is fetched once a change to
+    the video has been synchronised. Entries are held for ``JWPLATFORM_SOURCES_CACHE_TIMEOUT``
+    seconds which should be less than the lifetime of any signed URLs in the source list. A video
+    which is not found, usually because it is still being transcoded, is remembered for
+    ``JWPLATFORM_SOURCES_CACHE_NEGATIVE_TIMEOUT`` seconds. Setting the former to zero disables the
+    cache.
+
+    :param key: JWPlatform key for the media.
+    :param updated: JWPlatform updated timestamp for the media.
+
+    :raises: :py:exc:`VideoNotFoundError` if the video is not found.
+    """
+    timeout = settings.JWPLATFORM_SOURCES_CACHE_TIMEOUT
+    if not timeout:
+        return DeliveryVideo.from_key(key).get('sources', [])
+
+    cache = caches[settings.JWPLATFORM_SOURCES_CACHE]
+    cache_key = f'jwp-sources:{key}:{updated}'
+
+    # Entries are a tuple of a flag indicating if the video was found and its sources.
+    entry = cache.get(cache_key)
+    if entry is None:
+        try:
+            entry = (True, DeliveryVideo.from_key(key).get('sources', []))
+            cache.set(cache_key, entry, timeout)
+        except VideoNotFoundError:
+            entry = (False, [])
+            cache.set(cache_key, entry, settings.JWPLATFORM_SOURCES_CACHE_NEGATIVE_TIMEOUT)
+
+    found, sources = entry
+    if not found:
+        raise VideoNotFoundError
+
+    return sources
+
+
 class Channel(Resource):
     """
     A dict subclass representing a channel resource object as returned by the JWPlatform API.
@@ -365,6 +472,22 @@ def parse_custom_field(expected_type, field):
     return match.group('value')
 
 
+@functools.lru_cache(maxsize=acl.COMPILED_ACL_CACHE_SIZE)
+def _parse_acl_field(field):
+    """
+    Parse the content of a sms_acl custom field into a tuple of ACEs. The result is cached since
+    the same few ACLs are shared by most resources.
+
+    """
+    field = parse_custom_field('acl', field)
+
+    # Work around odd ACL entries. See uisautomation/sms2jwplayer#30.
+    if field == "['']":
+        return ()
+
+    return tuple(ace.strip() for ace in field.split(',') if ace.strip() != '')
+
+
 def signed_url(url):
     """
     Augment a JWPlatform URL with an expiration time and a signature as outlined in `the jwplatform
@@ -372,19 +495,25 @@ def signed_url(url):
     <https://developer.jwplayer.com/jw-platform/docs/developer-guide/delivery-api/legacy-url-token-signing/>`_.
 
     The signature timeout is specified by the
-    :py:data:`~mediaplatform_jwp.defaultsettings.JWPLATFORM_SIGNATURE_TIMEOUT` setting.
+    :py:data:`~mediaplatform_jwp.defaultsettings.JWPLATFORM_SIGNATURE_TIMEOUT` setting. The
+    expiration time is rounded up to a multiple of :py:data:`~.SIGNATURE_EXPIRY_INTERVAL` seconds
+    so that signing the same URL within an interval gives an identical result. Signed URLs are
+    memoised.
 
     :param url: The JWPlatform API URL to add a query string to.
 
     :returns: the API URL with "exp" and "sig" query parameters appended.
 
     """
+    expiry_timestamp = _round_expiry(time.time() + settings.JWPLATFORM_SIGNATURE_TIMEOUT)
+    return _signed_url(url, expiry_timestamp, settings.JWPLATFORM_API_SECRET)
+
+
+@functools.lru_cache(maxsize=SIGNED_URL_CACHE_SIZE)
+def _signed_url(url, expiry_timestamp, secret):
     # Implementation based on
     # https://support-static.jwplayer.com/API/python-example.txt
-    secret = settings.JWPLATFORM_API_SECRET
-    timeout = settings.JWPLATFORM_SIGNATURE_TIMEOUT
     path = urllib.parse.urlsplit(url).path
-    expiry_timestamp = int(time.time()) + timeout
     sign_data = '%s:%d:%s' % (path.lstrip('/'), expiry_timestamp, secret)
     signature = hashlib.md5(sign_data.encode('ascii')).hexdigest()
     return urllib.parse.urljoin(url, '?' + urllib.parse.urlencode({
@@ -392,21 +521,29 @@ def signed_url(url):
     }))
 
 
-def _generate_token(resource, now_timestamp):
+def _round_expiry(timestamp):
+    """
+    Round an expiry timestamp up to the next multiple of :py:data:`~.SIGNATURE_EXPIRY_INTERVAL`
+    seconds.
+
+    """
+    return math.ceil(timestamp / SIGNATURE_EXPIRY_INTERVAL) * SIGNATURE_EXPIRY_INTERVAL
+
+
+@functools.lru_cache(maxsize=SIGNED_URL_CACHE_SIZE)
+def _generate_token(resource, exp, secret):
     """
     Generate a signed JWT for the specified resource using the
     `procedure
     <https://developer.jwplayer.com/jw-platform/docs/developer-guide/delivery-api/url-token-signing/>`_
-    outlined in the JWPlatform documentation.
+    outlined in the JWPlatform documentation. The result is cached since the token depends only on
+    the resource and the expiry time which is rounded by :py:func:`~._round_expiry`.
 
     """
     # The following is lifted almost verbatim from JWPlatform's documentation.
-
-    # Link is valid for 1hr but normalized to 3 minutes to promote better caching
-    exp = math.ceil((now_timestamp + 3600)/180) * 180
     token_body = {"resource": resource, "exp": exp}
 
-    return jwt.encode(token_body, settings.JWPLATFORM_API_SECRET, algorithm='HS256')
+    return jwt.encode(token_body, secret, algorithm='HS256')
 
 
 def pd_api_url(resource, now_timestamp=None, **parameters):
@@ -422,6 +559,9 @@ def pd_api_url(resource, now_timestamp=None, **parameters):
 
     If *now_timestamp* is ``None``, the value returned by :py:func:`time.time` is used.
 
+    URLs are memoised for each resource, set of parameters and expiry interval and so parameter
+    values must be hashable. See :py:data:`~.SIGNATURE_EXPIRY_INTERVAL`.
+
     :raises ValueError: if the resource name does not start with a slash.
 
     .. seealso::
@@ -435,14 +575,19 @@ def pd_api_url(resource, now_timestamp=None, **parameters):
 
     now_timestamp = now_timestamp if now_timestamp is not None else time.time()
 
+    # Link is valid for 1hr but normalized to 3 minutes to promote better caching
+    exp = _round_expiry(now_timestamp + 3600)
+
+    return _pd_api_url(
+        resource, exp, tuple(parameters.items()),
+        settings.JWPLATFORM_API_BASE_URL, settings.JWPLATFORM_API_SECRET)
+
+
+@functools.lru_cache(maxsize=SIGNED_URL_CACHE_SIZE)
+def _pd_api_url(resource, exp, parameters, base_url, secret):
     # Construct parameters for URL including JWT
-    url_params = {'token': _generate_token(resource, now_timestamp=now_timestamp)}
+    url_params = {'token': _generate_token(resource, exp, secret)}
     url_params.update(parameters)
 
     # Construct GET URL
-    url = urllib.parse.urljoin(
-        settings.JWPLATFORM_API_BASE_URL,
-        resource + '?' + urllib.parse.urlencode(url_params)
-    )
-
-    return url
+    return urllib.parse.urljoin(base_url, resource + '?' + urllib.parse.urlencode(url_params))
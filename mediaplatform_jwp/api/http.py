@@ -0,0 +1,268 @@
+"""
+A shared HTTP session for all outbound requests to JWPlatform.
+
+The Delivery API helpers, the legacy SMS views and the JWPlatform management API client all make
+their requests through :py:data:`~.SESSION`. Sharing one session means that connections to each
+JWPlatform host are pooled and kept alive between requests. The session is configured by the
+following settings:
+
+* :py:data:`~mediaplatform_jwp.defaultsettings.JWPLATFORM_HTTP_POOL_SIZE`
+* :py:data:`~mediaplatform_jwp.defaultsettings.JWPLATFORM_HTTP_MAX_RETRIES`
+* :py:data:`~mediaplatform_jwp.defaultsettings.JWPLATFORM_HTTP_RETRY_BACKOFF`
+* :py:data:`~mediaplatform_jwp.defaultsettings.JWPLATFORM_HTTP_CONNECT_TIMEOUT`
+* :py:data:`~mediaplatform_jwp.defaultsettings.JWPLATFORM_HTTP_READ_TIMEOUT`
+* :py:data:`~mediaplatform_jwp.defaultsettings.JWPLATFORM_HTTP_CIRCUIT_BREAKER_THRESHOLD`
+* :py:data:`~mediaplatform_jwp.defaultsettings.JWPLATFORM_HTTP_CIRCUIT_BREAKER_RESET`
+
+Each host has a circuit breaker. Once a host has failed a number of consecutive requests, further
+requests to it fail immediately with :py:exc:`~.CircuitOpenError` rather than waiting to time out.
+After a while, a single request is let through to find out if the host has recovered.
+
+Request counts, failures and latencies are recorded for each host along with the number of
+connections opened and reused. See :py:meth:`~.OutboundSession.get_metrics`.
+
+"""
+import collections
+import logging
+import threading
+import time
+import urllib.parse
+
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LOG = logging.getLogger(__name__)
+
+#: HTTP status codes from JWPlatform which are retried and which count as failures for the circuit
+#: breaker.
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    A request was not made because the circuit breaker for the host is open.
+
+    """
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failed requests to a single host. The breaker opens once *threshold*
+    consecutive requests have failed. While open, requests are refused until *reset_timeout*
+    seconds have passed after which one request is allowed through. If it succeeds the breaker
+    closes, otherwise it stays open for another *reset_timeout* seconds. A *threshold* of zero
+    disables the breaker.
+
+    """
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        #: Number of consecutive failed requests.
+        self.failure_count = 0
+
+        #: Value of :py:func:`time.monotonic` when the breaker was last opened or ``None`` if the
+        #: breaker is closed.
+        self.opened_at = None
+
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """
+        Return ``True`` if a request should be made.
+
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+
+            # Let this request through to find out if the host has recovered. Further requests
+            # are refused until it completes.
+            self.opened_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failure_count = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """
+        Record a failed request. Return ``True`` if the breaker opened as a result.
+
+        """
+        with self._lock:
+            self.failure_count += 1
+            if self.threshold > 0 and self.failure_count >= self.threshold:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+#: Request metrics for a single host.
+HostMetrics = collections.namedtuple(
+    'HostMetrics', 'requests failures refused total_latency max_latency')
+
+
+class OutboundSession(requests.Session):
+    """
+    A :py:class:`requests.Session` which pools connections, retries failed requests with backoff,
+    applies a default timeout and has a circuit breaker for each host. Adapters are configured from
+    the settings when the first request is made.
+
+    """
+    def __init__(self):
+        super().__init__()
+        self._configured = False
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._metrics = {}
+
+    def get_adapter(self, url):
+        self._configure()
+        return super().get_adapter(url)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = (
+                settings.JWPLATFORM_HTTP_CONNECT_TIMEOUT, settings.JWPLATFORM_HTTP_READ_TIMEOUT)
+
+        host = urllib.parse.urlsplit(url).hostname
+        breaker = self._get_breaker(host)
+        if not breaker.allow_request():
+            self._record(host, refused=True)
+            raise CircuitOpenError(f'Circuit breaker for {host} is open')
+
+        start = time.monotonic()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.RequestException:
+            self._record_failure(host, breaker, time.monotonic() - start)
+            raise
+
+        if response.status_code in RETRY_STATUS_CODES:
+            self._record_failure(host, breaker, time.monotonic() - start)
+        else:
+            breaker.record_success()
+            self._record(host, latency=time.monotonic() - start)
+
+        return response
+
+    def get_metrics(self):
+        """
+        Return a dictionary keyed by host name of dictionaries describing the requests made to
+        that host. Each has the following keys:
+
+        * ``requests``: number of requests made.
+        * ``failures``: number of requests which failed or returned a server error.
+        * ``refused``: number of requests refused because the circuit breaker was open.
+        * ``mean_latency`` and ``max_latency``: request latency in seconds, including retries.
+        * ``connections``: number of connections opened.
+        * ``reused_connections``: number of HTTP requests made over an existing connection.
+
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+
+        pool_stats = self._get_pool_stats()
+
+        result = {}
+        for host in set(metrics) | set(pool_stats):
+            host_metrics = metrics.get(host, HostMetrics(0, 0, 0, 0., 0.))
+            connections, pool_requests = pool_stats.get(host, (0, 0))
+            result[host] = {
+                'requests': host_metrics.requests,
+                'failures': host_metrics.failures,
+                'refused': host_metrics.refused,
+                'mean_latency': (
+                    host_metrics.total_latency / host_metrics.requests
+                    if host_metrics.requests > 0 else None),
+                'max_latency': host_metrics.max_latency,
+                'connections': connections,
+                'reused_connections': max(0, pool_requests - connections),
+            }
+
+        return result
+
+    def _configure(self):
+        """
+        Mount adapters configured from the settings if this has not already been done.
+
+        """
+        with self._lock:
+            if self._configured:
+                return
+
+            retries = Retry(
+                total=settings.JWPLATFORM_HTTP_MAX_RETRIES,
+                backoff_factor=settings.JWPLATFORM_HTTP_RETRY_BACKOFF,
+                status_forcelist=RETRY_STATUS_CODES, raise_on_status=False)
+            adapter = HTTPAdapter(
+                pool_maxsize=settings.JWPLATFORM_HTTP_POOL_SIZE, max_retries=retries)
+            self.mount('https://', adapter)
+            self.mount('http://', adapter)
+
+            self._configured = True
+
+    def _get_breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    settings.JWPLATFORM_HTTP_CIRCUIT_BREAKER_THRESHOLD,
+                    settings.JWPLATFORM_HTTP_CIRCUIT_BREAKER_RESET)
+                self._breakers[host] = breaker
+            return breaker
+
+    def _record_failure(self, host, breaker, latency):
+        if breaker.record_failure():
+            LOG.warning(
+                'Circuit breaker for %s is open after %s consecutive failures',
+                host, breaker.failure_count)
+        self._record(host, latency=latency, failed=True)
+
+    def _record(self, host, latency=None, failed=False, refused=False):
+        with self._lock:
+            metrics = self._metrics.get(host, HostMetrics(0, 0, 0, 0., 0.))
+            if refused:
+                metrics = metrics._replace(refused=metrics.refused + 1)
+            else:
+                metrics = metrics._replace(
+                    requests=metrics.requests + 1,
+                    failures=metrics.failures + (1 if failed else 0),
+                    total_latency=metrics.total_latency + latency,
+                    max_latency=max(metrics.max_latency, latency))
+            self._metrics[host] = metrics
+
+        if latency is not None:
+            LOG.debug('Request to %s took %.3fs', host, latency)
+
+    def _get_pool_stats(self):
+        """
+        Return a dictionary keyed by host name of the number of connections opened and requests
+        made by the urllib3 connection pools of the mounted adapters.
+
+        """
+        stats = {}
+        for adapter in set(self.adapters.values()):
+            pools = getattr(getattr(adapter, 'poolmanager', None), 'pools', None)
+            if pools is None:
+                continue
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections, pool_requests = stats.get(pool.host, (0, 0))
+                stats[pool.host] = (
+                    connections + pool.num_connections, pool_requests + pool.num_requests)
+        return stats
+
+
+#: The session used for all outbound requests to JWPlatform.
+SESSION = OutboundSession()
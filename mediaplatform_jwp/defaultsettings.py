@@ -50,6 +50,89 @@ Base URL for the JWPlatform Content. This can usually be left at its default val
 
 """
 
+JWPLATFORM_SOURCES_CACHE = 'default'
+"""
+Alias of the Django cache used to hold video source lists from the Delivery API. See
+:py:func:`mediaplatform_jwp.api.delivery.get_video_sources`.
+
+"""
+
+JWPLATFORM_SOURCES_CACHE_TIMEOUT = 1800
+"""
+Time in seconds for which video source lists are cached. This should be less than the lifetime of
+any signed source URLs. Set to zero to disable caching.
+
+"""
+
+JWPLATFORM_STORED_SOURCES_MAX_AGE = 1800
+"""
+Time in seconds after which video sources stored by the jwpfetchsources management command are
+no longer used. This should be less than the lifetime of signed source URLs less the interval at
+which jwpfetchsources is run. See :py:func:`mediaplatform_jwp.sync.update_video_sources`.
+
+"""
+
+JWPLATFORM_SOURCES_CACHE_NEGATIVE_TIMEOUT = 60
+"""
+Time in seconds for which the cache remembers that a video could not be found by the Delivery API.
+Videos which are being transcoded are not found and so this should be short.
+
+"""
+
+JWPLATFORM_HTTP_POOL_SIZE = 10
+"""
+Maximum number of connections to each JWPlatform host kept open by the shared outbound HTTP
+session. This should be at least the number of threads making requests at once. See
+:py:mod:`mediaplatform_jwp.api.http`.
+
+"""
+
+JWPLATFORM_HTTP_MAX_RETRIES = 2
+"""
+Maximum number of times a request to JWPlatform is retried if it fails to connect or receives a
+server error. Requests which are not idempotent are only retried if they failed to connect.
+
+"""
+
+JWPLATFORM_HTTP_RETRY_BACKOFF = 0.5
+"""
+Backoff factor in seconds for retried requests to JWPlatform. The delay doubles after each retry.
+
+"""
+
+JWPLATFORM_HTTP_CONNECT_TIMEOUT = 5
+"""
+Time in seconds to wait for a connection to JWPlatform if the caller does not specify a timeout.
+
+"""
+
+JWPLATFORM_HTTP_READ_TIMEOUT = 30
+"""
+Time in seconds to wait for a response from JWPlatform if the caller does not specify a timeout.
+Listing resources with the management API can be slow and so this is generous.
+
+"""
+
+JWPLATFORM_DELIVERY_TIMEOUT = 5
+"""
+Timeout in seconds for requests to the Delivery API which are made while rendering a response.
+
+"""
+
+JWPLATFORM_HTTP_CIRCUIT_BREAKER_THRESHOLD = 5
+"""
+Number of consecutive failed requests to a JWPlatform host after which further requests fail
+immediately. Set to zero to disable the circuit breaker.
+
+"""
+
+JWPLATFORM_HTTP_CIRCUIT_BREAKER_RESET = 30
+"""
+Time in seconds after the circuit breaker for a host opens before a request is again allowed
+through to test whether the host has recovered.
+
+"""
+
 JWPLATFORM_EMBED_PLAYER_KEY = None
 """
 Player key for the embedded player used by the :py:mod:`~.views.embed` view.
@@ -22,19 +22,73 @@ perform the database metadata synchronisation. This can be useful in combination
 only video or channel resources is controlled via the ``--skip-video-fetch`` and
 ``--skip-channel-fetch`` flags.
 
+The command as a whole is not atomic. Videos and channels are each fetched and cached in their own
+transaction since resources are streamed from JWPlatform into the cache. If fetching a list fails,
+the cached resources of that type are left as they were but those of a list cached earlier in the
+run are kept and the database synchronisation is not run. Media items and channels are
+synchronised in transactions of at most ``--batch-size`` objects so that the synchronisation does
+not hold locks on them for its whole duration. If the command is interrupted, re-running it
+resumes the synchronisation from where it left off.
+
+Resources are listed from JWPlatform a page at a time. The first page tells us how many resources
+there are in total and the remaining pages are then fetched concurrently by at most
+``--fetch-concurrency`` threads. Pages are still passed on to the cache in order. A page which
+fails to be fetched is retried with exponential backoff before the command gives up.
+
+The ``--incremental`` flag may be given to fetch only those videos whose JWPlatform ``updated``
+timestamp is no earlier than the latest one already in the cache. Videos are listed newest first
+and fetching stops at the first older video. Since a deleted video does not appear in the listing,
+the total number of videos reported by JWPlatform is compared to the number in the cache. Only if
+they differ are all videos listed again to find the deleted ones and then only their keys are
+passed to the database. If the cache is empty a full fetch is performed. Channels have no
+``updated`` timestamp and so are always fetched in full.
+
+The ``--profile-memory`` flag may be given to report the peak resident set size of the process
+after each stage. Resources are streamed from JWPlatform into the database and so the peak should
+not grow with the size of the catalogue.
+
 """
+import collections
+import concurrent.futures
+import logging
+import resource
+import time
+
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from jwplatform.errors import JWPlatformError
+import requests
 
 from mediaplatform_jwp import models
 from mediaplatform_jwp import sync
 from mediaplatform_jwp.api import delivery as jwplatform
 import mediaplatform.models
 
+LOG = logging.getLogger(__name__)
+
+#: Number of resources requested from JWPlatform in each page.
+FETCH_PAGE_SIZE = 1000
+
+#: Default number of pages fetched concurrently from JWPlatform.
+DEFAULT_FETCH_CONCURRENCY = 4
+
+#: Number of times fetching a page is attempted before giving up.
+FETCH_MAX_ATTEMPTS = 5
+
+#: Delay in seconds before the first retry of a failed page fetch. The delay doubles with each
+#: subsequent attempt.
+FETCH_RETRY_BACKOFF = 1.0
+
 
 class Command(BaseCommand):
     help = 'Fetch metadata from JWPlayer using the management API and cache it in the database.'
 
+    #: Number of pages fetched concurrently. Overridden by the ``--fetch-concurrency`` option.
+    fetch_concurrency = DEFAULT_FETCH_CONCURRENCY
+
+    #: Whether to report peak memory usage. Overridden by the ``--profile-memory`` option.
+    profile_memory = False
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--sync-all', action='store_true', dest='sync_all',
@@ -49,25 +103,50 @@ class Command(BaseCommand):
         parser.add_argument(
             '--skip-channel-fetch', action='store_true', dest='skip_channel_fetch',
             help='Do not re-fetch channels from JWP and synchronise with channels')
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=sync.SYNC_BATCH_SIZE,
+            help='Number of media items or channels to synchronise in each transaction')
+        parser.add_argument(
+            '--fetch-concurrency', type=int, dest='fetch_concurrency',
+            default=DEFAULT_FETCH_CONCURRENCY,
+            help='Maximum number of pages of resources to fetch from JWP concurrently')
+        parser.add_argument(
+            '--incremental', action='store_true', dest='incremental',
+            help='Only fetch resources which have been updated since the last fetch')
+        parser.add_argument(
+            '--profile-memory', action='store_true', dest='profile_memory',
+            help='Report the peak memory usage after each stage')
 
-    @transaction.atomic
     def handle(self, *args, **options):
+        self.fetch_concurrency = options['fetch_concurrency']
+        self.profile_memory = options['profile_memory']
+
         # Create the JWPlatform client
         self.client = jwplatform.get_jwplatform_client()
 
         # Fetch and cache the video resources
         if not options['skip_video_fetch'] and not options['skip_fetch']:
             self.stdout.write('Caching video resources...')
-            models.set_resources(self.fetch_videos(), 'video')
+            if options['incremental']:
+                counts = self.update_resources_incrementally(
+                    self.client.videos.list, 'videos', models.CachedResource.VIDEO)
+            else:
+                counts = models.set_resources(self.fetch_videos(), 'video')
+            self.write_resource_counts(counts)
+            self.write_peak_memory_usage('caching video resources')
 
         # Print out the total number of videos cached
         self.stdout.write(self.style.SUCCESS('Number of cached video resources: {}'.format(
             models.CachedResource.videos.count()
         )))
 
+        # Channels have no updated timestamp and so are fetched in full even if --incremental is
+        # given.
         if not options['skip_channel_fetch'] and not options['skip_fetch']:
             self.stdout.write('Fetching channels...')
-            models.set_resources(self.fetch_channels(), 'channel')
+            counts = models.set_resources(self.fetch_channels(), 'channel')
+            self.write_resource_counts(counts)
+            self.write_peak_memory_usage('caching channel resources')
 
         # Print out the total number of channels cached
         self.stdout.write(self.style.SUCCESS('Number of cached channel resources: {}'.format(
@@ -75,7 +154,9 @@ class Command(BaseCommand):
         )))
 
         # Synchronise cached resources into main application state
-        sync.update_related_models_from_cache(update_all_videos=options['sync_all'])
+        sync.update_related_models_from_cache(
+            update_all_videos=options['sync_all'], batch_size=options['batch_size'])
+        self.write_peak_memory_usage('synchronisation')
 
         # Print out the total number of media items
         self.stdout.write(self.style.SUCCESS('Number of media items: {}'.format(
@@ -101,27 +182,181 @@ class Command(BaseCommand):
         """
         return self._fetch_list(self.client.channels.list, 'channels')
 
+    @transaction.atomic
+    def update_resources_incrementally(self, list_callable, results_key, resource_type):
+        """
+        Update the cached resources of a given type with those resources returned by a given
+        callable which have been updated since the last fetch and mark deleted resources as
+        such. Returns a :py:class:`mediaplatform_jwp.models.ResourceCounts` instance.
+
+        The resources must have an ``updated`` timestamp and so this is used only for videos.
+
+        This is all run inside an atomic block so that, if fetching fails, the cache is left as
+        it was.
+
+        """
+        since = models.get_updated_high_water_mark(resource_type)
+        if since is None:
+            return models.set_resources(
+                self._fetch_list(list_callable, results_key), resource_type)
+
+        total, updated_resources = self._fetch_list_updated_since(
+            list_callable, results_key, since)
+        counts = models.set_resources(updated_resources, resource_type, delete_missing=False)
+
+        # Any resource added since the last fetch is now cached and so, if the number of cached
+        # resources differs from the number JWPlatform has, some cached resources have been
+        # deleted.
+        if total == models.CachedResource.objects.filter(
+                type=resource_type, deleted_at=None).count():
+            return counts
+
+        self.stdout.write('Checking for deleted resources...')
+        deleted_count = models.mark_missing_resources_deleted(
+            (resource['key'] for resource in self._fetch_list(list_callable, results_key)),
+            resource_type)
+
+        return counts._replace(deleted=deleted_count)
+
+    def write_resource_counts(self, counts):
+        """
+        Write a :py:class:`mediaplatform_jwp.models.ResourceCounts` instance to stdout.
+
+        """
+        self.stdout.write(
+            f'... {counts.inserted} inserted, {counts.changed} changed, '
+            f'{counts.unchanged} unchanged, {counts.deleted} deleted')
+
+    def write_peak_memory_usage(self, stage):
+        """
+        If memory profiling is enabled, write the peak resident set size of the process so far to
+        stdout and the log.
+
+        """
+        if not self.profile_memory:
+            return
+
+        # ru_maxrss is in kilobytes on Linux
+        peak_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        LOG.info('Peak memory usage after %s: %.1f MiB', stage, peak_mib)
+        self.stdout.write(f'Peak memory usage after {stage}: {peak_mib:.1f} MiB')
+
+    def _fetch_list_updated_since(self, list_callable, results_key, since):
+        """
+        Returns a tuple of the total number of resources in the JWPlatform database returned by a
+        given callable and an iterable of dicts representing those resources whose ``updated``
+        timestamp is no earlier than *since*.
+
+        """
+        def fetch_page(offset):
+            # We fetch only manual channels since those are the ones we sync via sms2jwplayer.
+            return _call_with_retries(
+                list_callable, types_filter='manual', order_by='updated:desc',
+                result_offset=offset, result_limit=FETCH_PAGE_SIZE)
+
+        # The first page is fetched immediately so that we know the total
+        first_response = fetch_page(0)
+
+        def updated_resources():
+            response, offset = first_response, 0
+            while True:
+                results = response.get(results_key, [])
+                for result in results:
+                    # Resources are newest first and so we can stop at the first older one
+                    if result.get('updated', 0) < since:
+                        return
+                    yield result
+
+                # Stop when we get no results
+                if len(results) == 0:
+                    return
+
+                offset += len(results)
+                self.stdout.write(f'... updated resources fetched so far: {offset}')
+                response = fetch_page(offset)
+
+        return first_response.get('total'), updated_resources()
+
     def _fetch_list(self, list_callable, results_key):
         """
         Returns an iterable of dicts representing all resources in the JWPlatform database returned
         by a given callable.
 
+        The total number of resources is read from the first page and the remaining pages are
+        fetched concurrently. Results are yielded in the order JWPlatform lists them.
+
         """
-        current_offset = 0
-        while True:
+        def fetch_page(offset):
             # We fetch only manual channels since those are the ones we sync via sms2jwplayer.
-            results = list_callable(
-                types_filter='manual',
-                result_offset=current_offset, result_limit=1000).get(results_key, [])
-            current_offset += len(results)
+            return _call_with_retries(
+                list_callable, types_filter='manual',
+                result_offset=offset, result_limit=FETCH_PAGE_SIZE)
+
+        response = fetch_page(0)
+        results = response.get(results_key, [])
+        page_size = len(results)
+
+        # Stop if there are no resources at all
+        if page_size == 0:
+            return
+
+        fetched_count = page_size
+        self.stdout.write(f'... resources fetched so far: {fetched_count}')
+        yield from results
+
+        # Fetch the pages which the first page told us about concurrently. To bound memory usage,
+        # only a few pages more than there are threads are requested ahead of the one being
+        # yielded.
+        offsets = iter(range(page_size, response.get('total', 0), page_size))
+        next_offset = page_size
+        concurrency = max(1, self.fetch_concurrency)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = collections.deque()
 
-            # Stop when we get no results
+            def submit_next():
+                nonlocal next_offset
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(executor.submit(fetch_page, offset))
+                    next_offset = offset + page_size
+
+            for _ in range(2 * concurrency):
+                submit_next()
+
+            while pending:
+                results = pending.popleft().result().get(results_key, [])
+                submit_next()
+
+                fetched_count += len(results)
+                self.stdout.write(f'... resources fetched so far: {fetched_count}')
+                yield from results
+
+        # Resources may have been added since the first page was fetched and so carry on fetching
+        # pages one at a time until we get no results.
+        while True:
+            results = fetch_page(next_offset).get(results_key, [])
             if len(results) == 0:
                 break
 
-            # Otherwise, print our out progress
-            self.stdout.write(f'... resources fetched so far: {current_offset}')
+            next_offset += len(results)
+            fetched_count += len(results)
+            self.stdout.write(f'... resources fetched so far: {fetched_count}')
+            yield from results
+
+
+def _call_with_retries(callable_, **kwargs):
+    """
+    Call *callable_* with the passed keyword arguments and return the result. If the call fails
+    with a JWPlatform or HTTP error it is retried with exponential backoff. The last error is
+    re-raised if all :py:data:`~.FETCH_MAX_ATTEMPTS` attempts fail.
 
-            # Yield each dict in turn to the caller
-            for result in results:
-                yield result
+    """
+    for attempt in range(FETCH_MAX_ATTEMPTS):
+        try:
+            return callable_(**kwargs)
+        except (JWPlatformError, requests.RequestException) as e:
+            if attempt + 1 >= FETCH_MAX_ATTEMPTS:
+                raise
+            delay = FETCH_RETRY_BACKOFF * (2 ** attempt)
+            LOG.warning('Error fetching from JWP: %s. Retrying in %s seconds.', e, delay)
+            time.sleep(delay)
@@ -0,0 +1,42 @@
+"""
+The ``jwpfetchsources`` management command fetches the source lists of JWPlayer videos from the
+JWPlatform Delivery API and stores them in the database as a series of
+:py:class:`~mediaplatform_jwp.models.VideoSource` objects. Media item sources are then served from
+the database rather than by calling the Delivery API on each request.
+
+It is designed to be called periodically without arguments after ``jwpfetch``. Only the videos
+whose sources have never been fetched or whose JWPlatform metadata has been updated since their
+sources were fetched are fetched. The ``--refresh-all`` flag may be given to re-fetch the sources
+of all videos.
+
+Up to ``--concurrency`` videos are fetched at once and their sources are stored in transactions of
+at most ``--batch-size`` videos.
+
+"""
+from django.core.management.base import BaseCommand
+
+from mediaplatform_jwp import sync
+
+
+class Command(BaseCommand):
+    help = 'Fetch video sources from the JWPlayer Delivery API and store them in the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--refresh-all', action='store_true', dest='refresh_all',
+            help='Fetch the sources of all videos, not only those which have been updated')
+        parser.add_argument(
+            '--concurrency', type=int, dest='concurrency',
+            default=sync.DEFAULT_SOURCE_FETCH_CONCURRENCY,
+            help='Maximum number of videos whose sources are fetched concurrently')
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=sync.SYNC_BATCH_SIZE,
+            help='Number of videos whose sources are stored in each transaction')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Fetching video sources...')
+        count = sync.update_video_sources(
+            refresh_all=options['refresh_all'], concurrency=options['concurrency'],
+            batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Number of videos with updated sources: {count}'))
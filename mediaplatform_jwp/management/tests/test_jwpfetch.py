@@ -1,8 +1,13 @@
+import io
+import threading
 from unittest import mock
 
 from django.core.management import call_command
 from django.test import TestCase
+from jwplatform.errors import JWPlatformError
 
+from mediaplatform_jwp import models
+from mediaplatform_jwp.management.commands import jwpfetch
 from mediaplatform_jwp.models import CachedResource
 
 
@@ -61,3 +66,265 @@ class JWPFetchTest(TestCase):
         self.jwp_client.videos.list.side_effect = videos2
         call_command('jwpfetch')
         self.assertEqual(CachedResource.videos.count(), len(self.VIDEOS_FIXTURE) - 1)
+
+    def test_profile_memory(self):
+        """
+        Command reports peak memory usage after each stage if asked
+
+        """
+        def videos(result_offset=0, **kwargs):
+            return {'videos': self.VIDEOS_FIXTURE[result_offset:]}
+
+        self.jwp_client.videos.list.side_effect = videos
+        out = io.StringIO()
+        call_command('jwpfetch', '--profile-memory', stdout=out)
+        for stage in ['caching video resources', 'caching channel resources', 'synchronisation']:
+            self.assertIn(f'Peak memory usage after {stage}:', out.getvalue())
+
+    @mock.patch('mediaplatform_jwp.management.commands.jwpfetch.FETCH_RETRY_BACKOFF', 0)
+    def test_failed_fetch_leaves_cache_intact(self):
+        """
+        If fetching a list fails part way through, the previously cached resources are kept
+
+        """
+        def videos(result_offset=0, **kwargs):
+            return {'videos': self.VIDEOS_FIXTURE[result_offset:]}
+
+        self.jwp_client.videos.list.side_effect = videos
+        call_command('jwpfetch')
+
+        def failing_videos(result_offset=0, **kwargs):
+            if result_offset > 0:
+                raise JWPlatformError('simulated failure')
+            return {'videos': [{'title': 'new video', 'key': 'C'}], 'total': 2}
+
+        self.jwp_client.videos.list.side_effect = failing_videos
+        with self.assertRaises(JWPlatformError):
+            call_command('jwpfetch', stdout=io.StringIO())
+
+        self.assertEqual(
+            sorted(r.key for r in CachedResource.videos.all()),
+            sorted(video['key'] for video in self.VIDEOS_FIXTURE))
+
+    def test_incremental_fetches_all_channels(self):
+        """
+        Channels, which have no updated timestamp, are fetched in full in incremental mode
+
+        """
+        models.set_resources([{'key': 'A', 'title': 'channel A', 'updated': 10}], 'channel')
+
+        def channels(result_offset=0, **kwargs):
+            return {'channels': [
+                {'key': 'A', 'title': 'new title'}, {'key': 'B', 'title': 'channel B'},
+            ][result_offset:]}
+
+        self.jwp_client.videos.list.side_effect = lambda **kwargs: {'videos': []}
+        self.jwp_client.channels.list.side_effect = channels
+        call_command('jwpfetch', '--incremental', stdout=io.StringIO())
+
+        self.assertEqual(CachedResource.channels.get(key='A').data.get('title'), 'new title')
+        self.assertTrue(CachedResource.channels.filter(key='B').exists())
+        for call in self.jwp_client.channels.list.call_args_list:
+            self.assertNotIn('order_by', call[1])
+
+
+class StubListEndpoint:
+    """
+    A stand-in for a JWPlatform client ``list`` method which serves *count* resources. Offsets in
+    *fail_offsets* fail on their first request. The ``updated`` timestamp of each resource is
+    initially its index.
+
+    The greatest number of requests in flight at once is recorded in ``max_in_flight``. If
+    *expected_concurrency* is given, each request waits for up to a second until that many
+    requests have been in flight at once so that concurrent requests reliably overlap.
+
+    """
+    def __init__(self, results_key, count, fail_offsets=(), expected_concurrency=None):
+        self.results_key = results_key
+        self.resources = [{'key': f'key{i}', 'updated': i} for i in range(count)]
+        self.fail_offsets = set(fail_offsets)
+        self.expected_concurrency = expected_concurrency
+        self.offsets = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.condition = threading.Condition()
+
+    def __call__(self, types_filter, result_offset, result_limit, order_by=None):
+        with self.condition:
+            self.offsets.append(result_offset)
+            if result_offset in self.fail_offsets:
+                self.fail_offsets.remove(result_offset)
+                raise JWPlatformError('simulated failure')
+
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.condition.notify_all()
+            if self.expected_concurrency is not None:
+                self.condition.wait_for(
+                    lambda: self.max_in_flight >= self.expected_concurrency, timeout=1)
+            self.in_flight -= 1
+
+        resources = self.resources
+        if order_by == 'updated:desc':
+            resources = sorted(resources, key=lambda r: r['updated'], reverse=True)
+
+        return {
+            'status': 'ok',
+            'offset': result_offset,
+            'limit': result_limit,
+            'total': len(self.resources),
+            self.results_key: resources[result_offset:result_offset+result_limit],
+        }
+
+
+@mock.patch('mediaplatform_jwp.management.commands.jwpfetch.FETCH_PAGE_SIZE', 10)
+@mock.patch('mediaplatform_jwp.management.commands.jwpfetch.FETCH_RETRY_BACKOFF', 0)
+class FetchListTest(TestCase):
+    def setUp(self):
+        self.command = jwpfetch.Command(stdout=io.StringIO())
+
+    def fetch(self, endpoint, concurrency=4):
+        self.command.fetch_concurrency = concurrency
+        return list(self.command._fetch_list(endpoint, 'videos'))
+
+    def test_results_are_in_order(self):
+        """All resources are returned in the order they are listed."""
+        endpoint = StubListEndpoint('videos', 95)
+        self.assertEqual(self.fetch(endpoint), endpoint.resources)
+
+    def test_pages_fetched_once(self):
+        """Each page is fetched once plus a final empty page."""
+        endpoint = StubListEndpoint('videos', 95)
+        self.fetch(endpoint)
+        self.assertEqual(sorted(endpoint.offsets), list(range(0, 110, 10)))
+
+    def test_no_resources(self):
+        """An empty listing results in a single request."""
+        endpoint = StubListEndpoint('videos', 0)
+        self.assertEqual(self.fetch(endpoint), [])
+        self.assertEqual(endpoint.offsets, [0])
+
+    def test_missing_total(self):
+        """If the first page has no total, pages are fetched until an empty page is returned."""
+        endpoint = StubListEndpoint('videos', 25)
+
+        def list_without_total(**kwargs):
+            response = endpoint(**kwargs)
+            del response['total']
+            return response
+
+        self.assertEqual(self.fetch(list_without_total), endpoint.resources)
+
+    def test_resources_added_during_fetch(self):
+        """Resources beyond the total given in the first page are still fetched."""
+        endpoint = StubListEndpoint('videos', 25)
+
+        def growing_list(**kwargs):
+            response = endpoint(**kwargs)
+            if kwargs['result_offset'] == 0:
+                response['total'] = 15
+            return response
+
+        self.assertEqual(self.fetch(growing_list), endpoint.resources)
+
+    def test_failed_pages_are_retried(self):
+        """A page which fails to be fetched is retried."""
+        endpoint = StubListEndpoint('videos', 95, fail_offsets=[0, 50])
+        self.assertEqual(self.fetch(endpoint), endpoint.resources)
+        self.assertEqual(endpoint.offsets.count(50), 2)
+
+    def test_persistent_failure_is_raised(self):
+        """A page which always fails raises the last error."""
+        def failing_list(**kwargs):
+            raise JWPlatformError('simulated failure')
+
+        with self.assertRaises(JWPlatformError):
+            self.fetch(failing_list)
+
+    def test_pages_fetched_concurrently(self):
+        """Up to the fetch concurrency pages are requested at once."""
+        endpoint = StubListEndpoint('videos', 200, expected_concurrency=8)
+        self.assertEqual(self.fetch(endpoint, 8), endpoint.resources)
+        self.assertEqual(endpoint.max_in_flight, 8)
+
+    def test_serial_fetch(self):
+        """With a fetch concurrency of one, pages are requested one at a time."""
+        endpoint = StubListEndpoint('videos', 200)
+        self.assertEqual(self.fetch(endpoint, 1), endpoint.resources)
+        self.assertEqual(endpoint.max_in_flight, 1)
+
+
+@mock.patch('mediaplatform_jwp.management.commands.jwpfetch.FETCH_PAGE_SIZE', 10)
+class IncrementalFetchTest(TestCase):
+    def setUp(self):
+        self.command = jwpfetch.Command(stdout=io.StringIO())
+        self.endpoint = StubListEndpoint('videos', 95)
+
+    def update_incrementally(self):
+        self.endpoint.offsets = []
+        self.command.update_resources_incrementally(
+            self.endpoint, 'videos', models.CachedResource.VIDEO)
+
+    def cached_data(self):
+        return sorted(
+            (r.data for r in models.CachedResource.videos.all()), key=lambda d: d['updated'])
+
+    def test_empty_cache_fetches_everything(self):
+        """With nothing cached, all resources are fetched."""
+        self.update_incrementally()
+        self.assertEqual(self.cached_data(), self.endpoint.resources)
+
+    def test_only_updated_resources_fetched(self):
+        """Only the pages containing updated resources are fetched."""
+        self.update_incrementally()
+
+        self.endpoint.resources[3]['updated'] = 100
+        self.endpoint.resources[3]['title'] = 'new title'
+        self.endpoint.resources.append({'key': 'new', 'updated': 101})
+        self.update_incrementally()
+
+        self.assertEqual(self.endpoint.offsets, [0])
+        self.assertEqual(
+            models.CachedResource.videos.get(key='key3').data['title'], 'new title')
+        self.assertTrue(models.CachedResource.videos.filter(key='new').exists())
+        self.assertEqual(models.CachedResource.videos.count(), 96)
+
+    def test_unchanged_resources_not_rewritten(self):
+        """Resources older than the high-water mark are not re-written."""
+        self.update_incrementally()
+        old = models.CachedResource.videos.get(key='key10')
+        self.update_incrementally()
+        self.assertEqual(models.CachedResource.videos.get(key='key10').updated_at, old.updated_at)
+
+    def test_deleted_resources(self):
+        """Resources removed from JWP are marked as deleted."""
+        self.update_incrementally()
+
+        del self.endpoint.resources[50]
+        self.update_incrementally()
+
+        self.assertFalse(models.CachedResource.videos.filter(key='key50').exists())
+        self.assertIsNotNone(models.CachedResource.objects.get(key='key50').deleted_at)
+        self.assertEqual(models.CachedResource.videos.count(), 94)
+
+    def test_no_deletion_pass_if_totals_match(self):
+        """If the totals match, JWP is not listed again to find deleted resources."""
+        self.update_incrementally()
+        self.update_incrementally()
+        self.assertEqual(self.endpoint.offsets, [0])
+
+    @mock.patch('mediaplatform_jwp.management.commands.jwpfetch.FETCH_MAX_ATTEMPTS', 1)
+    def test_failed_fetch_leaves_cache_intact(self):
+        """If listing resources to find deleted ones fails, no updates are cached."""
+        self.update_incrementally()
+
+        self.endpoint.resources[3]['title'] = 'new title'
+        self.endpoint.resources[3]['updated'] = 100
+        del self.endpoint.resources[50]
+        self.endpoint.fail_offsets = {10}
+        with self.assertRaises(JWPlatformError):
+            self.update_incrementally()
+
+        self.assertNotIn('title', models.CachedResource.videos.get(key='key3').data)
+        self.assertTrue(models.CachedResource.videos.filter(key='key50').exists())
+        self.assertEqual(models.CachedResource.videos.count(), 95)
@@ -0,0 +1,39 @@
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+
+class JWPFetchSourcesTest(TestCase):
+    """
+    Tests for the jwpfetchsources management command.
+
+    """
+    def setUp(self):
+        update_video_sources_patcher = mock.patch(
+            'mediaplatform_jwp.sync.update_video_sources', return_value=3)
+        self.update_video_sources = update_video_sources_patcher.start()
+        self.addCleanup(update_video_sources_patcher.stop)
+
+    def test_basic_functionality(self):
+        """
+        Command updates video sources and reports how many were updated.
+
+        """
+        out = io.StringIO()
+        call_command('jwpfetchsources', stdout=out)
+        self.update_video_sources.assert_called_once_with(
+            refresh_all=False, concurrency=8, batch_size=1000)
+        self.assertIn('Number of videos with updated sources: 3', out.getvalue())
+
+    def test_options(self):
+        """
+        Command passes options through.
+
+        """
+        call_command(
+            'jwpfetchsources', '--refresh-all', '--concurrency', '2', '--batch-size', '10',
+            stdout=io.StringIO())
+        self.update_video_sources.assert_called_once_with(
+            refresh_all=True, concurrency=2, batch_size=10)
@@ -0,0 +1,21 @@
+# Generated by Django 2.1 on 2018-09-06 14:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform_jwp', '0003_auto_20180828_1559'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingVideoUpdate',
+            fields=[
+                ('video', models.OneToOneField(editable=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pending_update', serialize=False, to='mediaplatform_jwp.Video')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
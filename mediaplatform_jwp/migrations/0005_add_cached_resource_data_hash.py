@@ -0,0 +1,23 @@
+# Generated by Django 2.1 on 2018-09-07 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform_jwp', '0004_add_pending_video_update'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedresource',
+            name='data_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='MD5 hash of the text representation of the resource data. Used by set_resources() to skip updates which would not change the data', max_length=32),
+        ),
+        # Populate the hash for existing resources so that the next fetch does not rewrite them.
+        migrations.RunSQL(
+            'UPDATE mediaplatform_jwp_cachedresource SET data_hash = MD5(data::text)',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.1 on 2018-09-10 11:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform_jwp', '0005_add_cached_resource_data_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='sources_updated',
+            field=models.BigIntegerField(editable=False, help_text='Updated timestamp when sources were fetched', null=True),
+        ),
+        migrations.CreateModel(
+            name='VideoSource',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mime_type', models.CharField(blank=True, editable=False, max_length=255)),
+                ('url', models.TextField(editable=False)),
+                ('width', models.IntegerField(editable=False, null=True)),
+                ('height', models.IntegerField(editable=False, null=True)),
+                ('video', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='delivery_sources', to='mediaplatform_jwp.Video')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2018-09-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaplatform_jwp', '0006_add_video_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='sources_fetched_at',
+            field=models.DateTimeField(editable=False, help_text='Time when sources were fetched', null=True),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import collections
+import datetime
 import json
 import logging
 
@@ -5,12 +7,20 @@ from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.contrib.postgres.indexes import GinIndex
 from django.db import models, transaction, connection
+from django.db.models import expressions, functions
+from django.utils import timezone
 from django.utils.functional import cached_property
-from psycopg2.extras import execute_batch
 
 import mediaplatform.models as mpmodels
 from mediaplatform_jwp.api import delivery as jwplatform
 
+# A faster JSON encoder is used for cached resources if one is installed
+try:
+    import ujson
+    HAVE_UJSON = True
+except ImportError:
+    HAVE_UJSON = False
+
 LOG = logging.getLogger(__name__)
 
 
@@ -71,6 +81,12 @@ class CachedResource(models.Model):
         help_text='The resource data itself',
     )
 
+    data_hash = models.CharField(
+        max_length=32, blank=True, default='', editable=False,
+        help_text=('MD5 hash of the text representation of the resource data. Used by '
+                   'set_resources() to skip updates which would not change the data'),
+    )
+
     type = models.CharField(
         max_length=20, choices=TYPE_CHOICES,
         help_text='The JWPlatform resource type cached in this model',
@@ -112,8 +128,14 @@ class CachedResource(models.Model):
         ]
 
 
+#: The numbers of resources inserted, changed, left unchanged and deleted by
+#: :py:func:`~.set_resources`.
+ResourceCounts = collections.namedtuple(
+    'ResourceCounts', 'inserted changed unchanged deleted')
+
+
 @transaction.atomic
-def set_resources(resources, resource_type):
+def set_resources(resources, resource_type, delete_missing=True):
     """
     Helper function which updates the cached resources and marks resources as deleted if no
     longer present.
@@ -122,11 +144,20 @@ def set_resources(resources, resource_type):
     :type resources: iterable
     :param resource_type: type of JWPlatform resource (e.g. "video")
     :type resource_type: str
+    :param delete_missing: if False, do not mark resources missing from *resources* as deleted
+    :type delete_missing: bool
 
     Iterates over all of the dicts in *resources* adding or updating corresponding
     :py:class:`~.CachedResource` models as it goes. After all resources have been added, any
     resources of the specified type which have not been created or updated are deleted from the
-    cache.
+    cache unless *delete_missing* is False. The latter is useful if *resources* is only those
+    resources which have changed.
+
+    Existing resources whose data is unchanged are not written to so that their ``updated_at``
+    timestamp is left as is.
+
+    Returns a :py:class:`~.ResourceCounts` instance giving the number of resources of each
+    outcome.
 
     This is all run inside an atomic block. Note that these blocks can be nested so calls to
     this function can themselves be within an atomic block.
@@ -138,19 +169,21 @@ def set_resources(resources, resource_type):
     # determine a clean way to do this with the stock Django ORM. We bypass the ORM entirely
     # and roll our own SQL. The general idea is to, atomically,
     #
-    # 1. Create a temporary table to hold all the keys for the resources we inserted/updated in
-    #    the cache.
+    # 1. Create a temporary "staging" table and stream all of the resources into it using
+    #    PostgreSQL's COPY support[1]. This is the fastest way to get a large number of rows into
+    #    the database since there is no per-row statement to parse, plan and execute.
     #
-    # 2. Insert/update ("upsert") the resources using PostgreSQL's INSERT ... ON CONFLICT
-    #    support. If we insert a new row, created_at and updated_at are set to the statement
-    #    timestamp but if an existing row is updated, only the updated_at timestamp is
-    #    modified. Along the way, we record the keys of the resources which have been
-    #    "upserted" in the temporary table.
+    # 2. Insert/update ("upsert") the resources from the staging table with a single INSERT ...
+    #    SELECT ... ON CONFLICT statement. If we insert a new row, created_at and updated_at are
+    #    set to the statement timestamp but if an existing row is updated, only the updated_at
+    #    timestamp is modified. An existing row is only updated if the hash of its data differs
+    #    or it was previously deleted so that unchanged rows do not generate dead tuples, index
+    #    updates or WAL.
     #
     # 3. Mark all the resources of the appropriate type as "deleted" if their key is not in the
-    #    temporary table.
+    #    staging table.
     #
-    # 4. Drop the temporary table.
+    # 4. Drop the staging table.
     #
     # This approach lets us send the list of new resources to the database *once* and then lets
     # the database sort out evicting/deleting resources from the cache if they weren't inserted
@@ -159,71 +192,237 @@ def set_resources(resources, resource_type):
     # quickly adds up if there are 10,000 of them.
     #
     # Django currently does not support upsert natively in the ORM. A "better" alternative to
-    # rolling our own SQL is to use the .on_conflict() support in django-postgres-extra[1] but
+    # rolling our own SQL is to use the .on_conflict() support in django-postgres-extra[2] but
     # that requires using an entirely different Postgres backend. Using django-postgres-extra
     # also introduces another dependency as a very low-level component which it'd be hard to
     # migrate from if it becomes abandoned.
     #
-    # [1] http://django-postgres-extra.readthedocs.io/manager/#conflict-handling
+    # [1] https://www.postgresql.org/docs/current/static/sql-copy.html
+    # [2] http://django-postgres-extra.readthedocs.io/manager/#conflict-handling
 
     with connection.cursor() as cursor:
-        # A table to hold the list of inserted or updated keys
+        # A table to hold the resources. The seq column records the order in which resources were
+        # passed so that, if a key appears more than once, the last one wins.
         cursor.execute('''
-            CREATE TEMPORARY TABLE inserted_or_updated_keys (key TEXT)
+            CREATE TEMPORARY TABLE resource_staging (seq BIGSERIAL, key TEXT, data JSONB)
         ''')
 
-        # Using execute_batch is many times faster than executemany
-        # http://initd.org/psycopg/docs/extras.html#fast-exec
-        #
+        _copy_rows(
+            cursor, 'resource_staging (key, data)',
+            ((data['key'], data) for data in iter(resources)),
+            (_copy_escape, _encode_json_for_copy))
+
+        # Temporary tables are not analysed automatically and so the planner would otherwise
+        # have no idea how many rows there are.
+        cursor.execute('''ANALYZE resource_staging''')
+
         # There is an argument as to what "now" function we should use here, especially as the
         # test suite runs everything within one transaction so using TRANSACTION_TIMESTAMP()
         # won't actually give any different values when we run testes.
         #
         # We use STATEMENT_TIMESTAMP() as a compromise.
         #
-        # The downside of STATEMENT_TIMESTAMP() is that execute_batch() will batch calls so the
-        # various ..._at timestamps may differ slightly for a given cache update. OTOH, I don't
-        # think anyone will really care about the ..._at timestamps down to that sort of
-        # resolution. Given that assumption, I will no doubt be proved wrong when a future data
-        # analyst berates us when they analyse our database dumps and find out that the
-        # timestamps have a little bit of non-deterministic noise.
-        #
         # [1] https://www.postgresql.org/docs/9.1/static/functions-datetime.html#FUNCTIONS-DATETIME-CURRENT  # noqa: E501
-        execute_batch(cursor, '''
+        #
+        # The data hash is computed by the database from the text representation of the JSONB
+        # value which is normalised (e.g. keys are sorted) and so does not depend on how the data
+        # was serialised.
+        #
+        # ON CONFLICT may not affect the same row twice in one statement and so only the last
+        # resource for each key is selected.
+        #
+        # A row which was inserted rather than updated has an xmax of zero. Rows for which the
+        # ON CONFLICT clause's WHERE condition is false are not returned by RETURNING.
+        #
+        # [2] https://www.postgresql.org/docs/current/static/sql-insert.html#SQL-ON-CONFLICT
+        cursor.execute('''
             WITH
                 insert_result
             AS (
                 INSERT INTO mediaplatform_jwp_cachedresource (
-                    key, data, type, updated_at, created_at, deleted_at
-                ) VALUES (
-                    %(key)s, %(data)s, %(type)s,
-                    STATEMENT_TIMESTAMP(), STATEMENT_TIMESTAMP(), NULL
+                    key, data, data_hash, type, updated_at, created_at, deleted_at
                 )
+                SELECT DISTINCT ON (key)
+                    key, data, MD5(data::text), %(type)s,
+                    STATEMENT_TIMESTAMP(), STATEMENT_TIMESTAMP(), NULL
+                FROM resource_staging
+                ORDER BY key, seq DESC
                 ON CONFLICT (key) DO
                     UPDATE SET
-                        data = %(data)s, type = %(type)s,
-                        updated_at = STATEMENT_TIMESTAMP(), deleted_at = NULL
-                    WHERE mediaplatform_jwp_cachedresource.key = %(key)s
+                        data = EXCLUDED.data, data_hash = EXCLUDED.data_hash,
+                        type = EXCLUDED.type, updated_at = STATEMENT_TIMESTAMP(),
+                        deleted_at = NULL
+                    WHERE
+                        mediaplatform_jwp_cachedresource.data_hash <> EXCLUDED.data_hash
+                        OR mediaplatform_jwp_cachedresource.type <> EXCLUDED.type
+                        OR mediaplatform_jwp_cachedresource.deleted_at IS NOT NULL
                 RETURNING
-                    mediaplatform_jwp_cachedresource.key AS key
+                    mediaplatform_jwp_cachedresource.xmax = 0 AS inserted
             )
-            INSERT INTO inserted_or_updated_keys (key) SELECT key FROM insert_result
-        ''', (
-            {'key': data['key'], 'data': json.dumps(data), 'type': resource_type}
-            for data in iter(resources)
-        ))
+            SELECT
+                (SELECT COUNT(DISTINCT key) FROM resource_staging),
+                COUNT(*) FILTER (WHERE inserted),
+                COUNT(*) FILTER (WHERE NOT inserted)
+            FROM insert_result
+        ''', {'type': resource_type})
+        resource_count, inserted_count, changed_count = cursor.fetchone()
+
+        deleted_count = 0
+        if delete_missing:
+            deleted_count = _mark_unstaged_resources_deleted(
+                cursor, 'resource_staging', resource_type)
+
+        cursor.execute('''DROP TABLE resource_staging''')
+
+    return ResourceCounts(
+        inserted=inserted_count, changed=changed_count,
+        unchanged=resource_count - inserted_count - changed_count, deleted=deleted_count)
+
+
+@transaction.atomic
+def mark_missing_resources_deleted(keys, resource_type):
+    """
+    Mark any non-deleted cached resources of the specified type whose key does not appear in
+    *keys* as deleted. This is the deletion half of :py:func:`~.set_resources` for when only the
+    keys of the current resources are to hand.
+
+    :param keys: iterable of keys of the resources which still exist
+    :type keys: iterable
+    :param resource_type: type of JWPlatform resource (e.g. "video")
+    :type resource_type: str
+
+    Returns the number of resources marked as deleted.
 
+    """
+    with connection.cursor() as cursor:
         cursor.execute('''
-            UPDATE
-                mediaplatform_jwp_cachedresource
-            SET
-                deleted_at = STATEMENT_TIMESTAMP()
-            WHERE
-                key NOT IN (SELECT key from inserted_or_updated_keys)
-                AND type = %(type)s
-        ''', {'type': resource_type})
+            CREATE TEMPORARY TABLE key_staging (key TEXT)
+        ''')
+
+        _copy_rows(cursor, 'key_staging (key)', ((key,) for key in keys), (_copy_escape,))
+        cursor.execute('''ANALYZE key_staging''')
+
+        deleted_count = _mark_unstaged_resources_deleted(cursor, 'key_staging', resource_type)
+
+        cursor.execute('''DROP TABLE key_staging''')
+
+    return deleted_count
+
+
+def _mark_unstaged_resources_deleted(cursor, staging_table, resource_type):
+    """
+    Mark the non-deleted cached resources of the specified type whose key does not appear in the
+    key column of *staging_table* as deleted. Returns the number of resources marked.
+
+    """
+    cursor.execute(f'''
+        UPDATE
+            mediaplatform_jwp_cachedresource
+        SET
+            deleted_at = STATEMENT_TIMESTAMP()
+        WHERE
+            type = %(type)s
+            AND deleted_at IS NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM {staging_table}
+                WHERE {staging_table}.key = mediaplatform_jwp_cachedresource.key
+            )
+    ''', {'type': resource_type})
+    return cursor.rowcount
+
+
+def _copy_rows(cursor, table, rows, encoders):
+    """
+    Stream an iterable of tuples into *table* using COPY FROM STDIN. The table may be followed by
+    a list of column names as in the COPY statement. Each value in a row is converted to text
+    escaped for COPY by the function at the corresponding position in *encoders*.
+
+    """
+    cursor.copy_expert(f'COPY {table} FROM STDIN', _CopyReader(rows, encoders))
+
+
+#: Translation table for the characters which are special in COPY's text format.
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_escape(value):
+    """
+    Escape a string for use as a column value in COPY's text format.
+
+    """
+    return value.translate(_COPY_ESCAPES)
+
+
+if HAVE_UJSON:
+    def _encode_json(data):
+        """
+        Encode *data* as compact JSON with all non-ASCII characters escaped.
+
+        """
+        return ujson.dumps(data, ensure_ascii=True)
+else:
+    _encode_json = json.JSONEncoder(
+        ensure_ascii=True, check_circular=False, separators=(',', ':')).encode
+
+
+def _encode_json_for_copy(data):
+    """
+    Encode *data* as JSON escaped for use as a column value in COPY's text format. Since all
+    control and non-ASCII characters are escaped by the JSON encoder, only the backslashes which
+    it introduces need escaping for COPY.
+
+    """
+    return _encode_json(data).replace('\\', '\\\\')
+
+
+class _CopyReader:
+    """
+    A minimal read-only file-like object which encodes rows in COPY's text format as they are
+    read. Rows are encoded straight into the chunk returned by :py:meth:`~.read` rather than
+    building each line and the whole input is never held in memory.
+
+    """
+    def __init__(self, rows, encoders):
+        self._rows = iter(rows)
+        self._encoders = encoders
+
+    def read(self, size=-1):
+        """
+        Return the next chunk of input. The chunk is at least *size* characters long unless the
+        rows are exhausted. In order to avoid splitting a row, it may be longer. This is fine for
+        psycopg2's copy_expert() which sends whatever it is given.
+
+        """
+        parts, length = [], 0
+        for row in self._rows:
+            for index, (value, encode) in enumerate(zip(row, self._encoders)):
+                text = encode(value)
+                parts.append(text)
+                parts.append('\t' if index < len(self._encoders) - 1 else '\n')
+                length += len(text) + 1
 
-        cursor.execute('''DROP TABLE inserted_or_updated_keys''')
+            if 0 <= size <= length:
+                break
+
+        return ''.join(parts)
+
+
+def get_updated_high_water_mark(resource_type):
+    """
+    Return the largest JWPlatform ``updated`` timestamp of the non-deleted cached resources of
+    the specified type or ``None`` if there are no such resources. Any resource updated in
+    JWPlatform after the last fetch will have an ``updated`` timestamp no smaller than this.
+
+    """
+    # See the comment in mediaplatform_jwp.sync on why RawSQL is used in place of
+    # "data__updated".
+    return (
+        CachedResource.objects
+        .filter(type=resource_type, deleted_at=None)
+        .aggregate(high_water_mark=models.Max(functions.Cast(
+            expressions.RawSQL("data ->> 'updated'", []), models.BigIntegerField()
+        )))
+    )['high_water_mark']
 
 
 class Video(models.Model):
@@ -246,15 +445,55 @@ class Video(models.Model):
     #: store the same value to make sure we compare apples to apples.
     updated = models.BigIntegerField(help_text='Last updated timestamp', editable=False)
 
+    #: The updated timestamp of this video when its :py:class:`~.VideoSource` objects were last
+    #: fetched from the Delivery API or NULL if they have never been fetched. If this is equal to
+    #: ``updated``, the stored sources are current.
+    sources_updated = models.BigIntegerField(
+        null=True, editable=False, help_text='Updated timestamp when sources were fetched')
+
+    #: Time at which the :py:class:`~.VideoSource` objects were last fetched from the Delivery API
+    #: or NULL if they have never been fetched. Source URLs are signed and expire and so stored
+    #: sources are not used once they are older than ``JWPLATFORM_STORED_SOURCES_MAX_AGE``.
+    sources_fetched_at = models.DateTimeField(
+        null=True, editable=False, help_text='Time when sources were fetched')
+
+    def has_current_sources(self):
+        """
+        Return ``True`` if the stored :py:class:`~.VideoSource` objects may be used. They must
+        have been fetched since the video was last updated and recently enough that their signed
+        URLs have not expired.
+
+        """
+        return (
+            self.sources_updated is not None and self.sources_updated == self.updated
+            and self.sources_fetched_at is not None
+            and self.sources_fetched_at > stored_sources_fetched_after()
+        )
+
     def get_sources(self):
         """
         Uses the JWP fetch API to retrieve a list of :py:class:`mediaplatform.MediaItem.Source`
         instances for each source associated with the media item. Ignores the ``downloadable``
         attribute of the item.
 
+        If the sources stored as :py:class:`~.VideoSource` objects are current, they are used.
+        Use ``prefetch_related('delivery_sources')`` to fetch them along with the video. Otherwise
+        the Delivery API is used via a cache. See
+        :py:func:`mediaplatform_jwp.api.delivery.get_video_sources`.
+
         """
+        if self.has_current_sources():
+            return [
+                mpmodels.MediaItem.Source(
+                    mime_type=source.mime_type, url=source.url,
+                    width=source.width, height=source.height,
+                    item=self.item,
+                )
+                for source in self.delivery_sources.all()
+            ]
+
         try:
-            video = jwplatform.DeliveryVideo.from_key(self.key)
+            sources = jwplatform.get_video_sources(self.key, self.updated)
         except jwplatform.VideoNotFoundError as e:
             # this can occur if the video is still transcoding - better to set the sources to none
             # than fail completely
@@ -267,7 +506,7 @@ class Video(models.Model):
                 width=source.get('width'), height=source.get('height'),
                 item=self.item,
             )
-            for source in video.get('sources', [])
+            for source in sources
         ]
 
     #: A property which calls get_sources and caches the result.
@@ -284,6 +523,43 @@ class Video(models.Model):
         )
 
 
+def stored_sources_fetched_after():
+    """
+    Return the earliest fetch time for which stored :py:class:`~.VideoSource` objects are used.
+    Sources fetched before this time may have expired signed URLs.
+
+    """
+    return timezone.now() - datetime.timedelta(
+        seconds=settings.JWPLATFORM_STORED_SOURCES_MAX_AGE)
+
+
+class VideoSource(models.Model):
+    """
+    A source for a JWPlatform video as returned by the Delivery API. These objects are created by
+    :py:func:`mediaplatform_jwp.sync.update_video_sources` so that sources may be served without
+    calling the Delivery API.
+
+    """
+    #: Video which this is a source for
+    video = models.ForeignKey(
+        Video, on_delete=models.CASCADE, related_name='delivery_sources', editable=False)
+
+    #: MIME type of the source
+    mime_type = models.CharField(max_length=255, blank=True, editable=False)
+
+    #: URL of the source
+    url = models.TextField(editable=False)
+
+    #: Width of the source in pixels if it is a video
+    width = models.IntegerField(null=True, editable=False)
+
+    #: Height of the source in pixels if it is a video
+    height = models.IntegerField(null=True, editable=False)
+
+    def __str__(self):
+        return 'Source {} of video {}'.format(self.mime_type, self.video_id)
+
+
 class Channel(models.Model):
     """
     A JWPlatform channel resource.
@@ -303,3 +579,40 @@ class Channel(models.Model):
     #: an integer field rather than a datetime field because JWP uses timestamps and we should
     #: store the same value to make sure we compare apples to apples.
     updated = models.BigIntegerField(help_text='Last updated timestamp', editable=False)
+
+
+class PendingVideoUpdate(models.Model):
+    """
+    A JWPlatform video whose metadata has yet to be synchronised to the corresponding
+    :py:class:`mediaplatform.MediaItem`. These objects are the checkpoint for a batched
+    :py:func:`mediaplatform_jwp.sync.update_related_models_from_cache`. They are created by
+    :py:func:`~.add_pending_video_updates` and deleted once the media item has been updated.
+
+    """
+    #: Video whose media item needs updating
+    video = models.OneToOneField(
+        Video, primary_key=True, on_delete=models.CASCADE, related_name='pending_update',
+        editable=False)
+
+    #: The date and time at which the update was first recorded
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return 'Pending update of video {}'.format(self.video_id)
+
+
+def add_pending_video_updates(videos):
+    """
+    Record a :py:class:`~.PendingVideoUpdate` for each :py:class:`~.Video` in the passed queryset
+    which does not already have one. This is a single statement irrespective of the number of
+    videos.
+
+    """
+    video_keys_sql, params = videos.values('key').query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO {PendingVideoUpdate._meta.db_table} (video_id, created_at)
+            SELECT key, STATEMENT_TIMESTAMP() FROM ({video_keys_sql}) AS videos
+            ON CONFLICT DO NOTHING
+        ''', params)
@@ -1,10 +1,15 @@
+import concurrent.futures
 import datetime
+import itertools
+import logging
 import dateutil.parser
 
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.db.models import expressions, functions
 from django.utils import timezone
+from psycopg2.extras import execute_values
 import pytz
+import requests
 
 import mediaplatform.models as mpmodels
 import mediaplatform_jwp.models as jwpmodels
@@ -12,16 +17,28 @@ import legacysms.models as legacymodels
 import mediaplatform_jwp.models as mediajwpmodels
 from mediaplatform_jwp.api import delivery as jwp
 
-from .signalhandlers import setting_sync_items
+LOG = logging.getLogger(__name__)
 
+#: Number of objects which are updated by each statement when synchronising metadata.
+SYNC_BATCH_SIZE = 1000
 
-@transaction.atomic
-def update_related_models_from_cache(update_all_videos=False):
+#: Default number of videos whose sources are fetched from the Delivery API concurrently.
+DEFAULT_SOURCE_FETCH_CONCURRENCY = 8
+
+#: Map from JWP media types to :py:class:`mediaplatform.models.MediaItem` types.
+_MEDIA_TYPE_MAP = {
+    'video': mpmodels.MediaItem.VIDEO,
+    'audio': mpmodels.MediaItem.AUDIO,
+    'unknown': mpmodels.MediaItem.UNKNOWN,
+}
+
+
+def update_related_models_from_cache(update_all_videos=False, batch_size=None):
     """
-    Atomically update the database to reflect the current state of the CachedResource table. If a
-    video is deleted from JWP, the corresponding MediaItem is marked as deleted. Similarly, if it
-    is deleted from the SMS (but is still in JWP for some reason), the legacysms.MediaItem model
-    associated with the MediaItem is deleted.
+    Update the database to reflect the current state of the CachedResource table. If a video is
+    deleted from JWP, the corresponding MediaItem is marked as deleted. Similarly, if it is deleted
+    from the SMS (but is still in JWP for some reason), the legacysms.MediaItem model associated
+    with the MediaItem is deleted.
 
     For video resources whose updated timestamp has increased, the JWP and SMS metadata is
     synchronised to mediaplatform.MediaItem or an associated legacysms.MediaItem as appropriate.
@@ -31,10 +48,56 @@ def update_related_models_from_cache(update_all_videos=False):
     updated_at timestamp. Come what may, all channels are synchronised since there is no equivalent
     of the updated timestamp for JWP channels.
 
+    If batch_size is None, the update is performed atomically. Otherwise the media items and
+    channels are updated in separate transactions of at most batch_size objects so that locks
+    are not held on them for the duration of the whole synchronisation. The videos whose media
+    items are yet to be updated are recorded as
+    :py:class:`mediaplatform_jwp.models.PendingVideoUpdate` objects as a checkpoint. If a batched
+    synchronisation is interrupted, the next synchronisation resumes from the checkpoint.
+    Synchronisation is idempotent and so an interrupted synchronisation can simply be re-run.
+
+    Permission principals and the publicly viewable flags of media items are not updated as each
+    object is saved. Instead, they are rebuilt at once for each batch of media items and channels.
+
     TODO: no attempt is yet made to synchronise the edit permission with that of the containing
     collection for media items. This needs a bit more thought about how the SMS permission model
     maps into the new world.
 
+    """
+    if batch_size is None:
+        # Each batch is run within a savepoint of the outer transaction.
+        with transaction.atomic():
+            _update_related_models_in_batches(update_all_videos, SYNC_BATCH_SIZE)
+    else:
+        _update_related_models_in_batches(update_all_videos, batch_size)
+
+
+def _update_related_models_in_batches(update_all_videos, batch_size):
+    """
+    Implementation of :py:func:`~.update_related_models_from_cache` which updates media items and
+    channels in batches of at most batch_size objects, each in its own transaction.
+
+    """
+    _update_jwp_resources(update_all_videos)
+
+    while _update_pending_media_items(batch_size) > 0:
+        pass
+
+    # Channels have no equivalent of the updated timestamp and so they are all updated.
+    # Synchronising a channel twice is harmless and so there is no need to checkpoint them.
+    channel_ids = mpmodels.Channel.objects.filter(jwp__isnull=False).values_list('id', flat=True)
+    for batch in _batched(list(channel_ids), batch_size):
+        _update_channels(batch)
+
+
+@transaction.atomic
+@mpmodels.deferring_permission_updates()
+def _update_jwp_resources(update_all_videos):
+    """
+    Atomically perform stages 1 to 3 of :py:func:`~.update_related_models_from_cache`. These stages
+    are set-based and so this transaction is short. Records the videos whose media items need
+    updating as :py:class:`mediaplatform_jwp.models.PendingVideoUpdate` objects.
+
     """
     # 1) Delete mediaplatform_jwp.{Video,Channel} objects which are no-longer hosted by JWP and
     # mark the corresponding media items/channels as "deleted".
@@ -83,12 +146,18 @@ def update_related_models_from_cache(update_all_videos=False):
     deleted_jwp_videos.delete()
 
     # Move media items which are in deleted channels to have no channel, mark the original
-    # channel as deleted and delete SMS/JWP objects
-    mpmodels.MediaItem.objects.filter(channel__in=deleted_channels).update(channel=None)
+    # channel as deleted and delete SMS/JWP objects. The moved items are remembered so that their
+    # publicly viewable flag can be recomputed below.
+    items_in_deleted_channels = mpmodels.MediaItem.objects.filter(channel__in=deleted_channels)
+    moved_item_ids = list(items_in_deleted_channels.values_list('id', flat=True))
+    items_in_deleted_channels.update(channel=None)
     deleted_sms_collections.delete()
     deleted_channels.update(deleted_at=timezone.now())
     deleted_jwp_channels.delete()
 
+    mpmodels.update_publicly_viewable(
+        mpmodels.MediaItem.objects_including_deleted.filter(id__in=moved_item_ids))
+
     # 2) Update/create JWP video resources
     #
     # After this stage all mediaplatform_jwp.Video objects in the database should have the same
@@ -108,25 +177,21 @@ def update_related_models_from_cache(update_all_videos=False):
     # newly created mediaplatform.MediaItem objects will be blank but have an updated_at timestamp
     # well before the corresponding mediaplatform_jwp.Video object.
 
-    # A queryset of all JWP Video objects which lack a mediaplatform.MediaItem annotated with the
-    # data from the corresponding CachedResource
+    # A queryset of the keys of all JWP Video objects which lack a mediaplatform.MediaItem. The
+    # new media items are blank and so we don't need the data from the CachedResource.
     videos_needing_items = (
         jwpmodels.Video.objects
         .filter(item__isnull=True)
-        .annotate(data=models.Subquery(
-            mediajwpmodels.CachedResource.videos
-            .filter(key=models.OuterRef('key'))
-            .values_list('data')[:1]
-        ))
+        .values_list('key', flat=True)
     )
 
     # For all videos needing a mediaplatform.MediaItem, create a blank one.
     jwp_keys_and_items = [
         (
-            video.key,
+            key,
             mpmodels.MediaItem(),
         )
-        for video in videos_needing_items
+        for key in videos_needing_items
     ]
 
     # Insert all the media items in an efficient manner.
@@ -141,28 +206,22 @@ def update_related_models_from_cache(update_all_videos=False):
     ])
 
     # Add the corresponding media item link to the JWP videos.
-    for key, item in jwp_keys_and_items:
-        jwpmodels.Video.objects.filter(key=key).update(item=item)
+    _set_jwp_links(jwpmodels.Video, 'item', jwp_keys_and_items)
 
-    # A queryset of all JWP Channel objects which lack a mediaplatform.Channel annotated with the
-    # data from the corresponding CachedResource
+    # A queryset of the keys of all JWP Channel objects which lack a mediaplatform.Channel.
     jw_channels_needing_channels = (
         jwpmodels.Channel.objects
         .filter(channel__isnull=True)
-        .annotate(data=models.Subquery(
-            mediajwpmodels.CachedResource.channels
-            .filter(key=models.OuterRef('key'))
-            .values_list('data')[:1]
-        ))
+        .values_list('key', flat=True)
     )
 
     # For all channels needing a mediaplatform.Channel, create a blank one.
     jwp_keys_and_channels = [
         (
-            jw_channel.key,
+            key,
             mpmodels.Channel(),
         )
-        for jw_channel in jw_channels_needing_channels
+        for key in jw_channels_needing_channels
     ]
 
     # Insert all the channels in an efficient manner.
@@ -177,24 +236,45 @@ def update_related_models_from_cache(update_all_videos=False):
     ])
 
     # Add the corresponding media item link to the JWP channels.
-    for key, channel in jwp_keys_and_channels:
-        jwpmodels.Channel.objects.filter(key=key).update(channel=channel)
+    _set_jwp_links(jwpmodels.Channel, 'channel', jwp_keys_and_channels)
+
+    # Record the videos whose media items need their metadata updating in stage 4. Unless we were
+    # asked to update the metadata in all objects, only update those whose JWP video was created or
+    # updated above. Any videos still pending from an interrupted synchronisation remain pending.
+    pending_videos = jwpmodels.Video.objects.all()
+    if not update_all_videos:
+        pending_videos = pending_videos.filter(key__in=updated_jwp_video_keys)
+    jwpmodels.add_pending_video_updates(pending_videos)
+
+
+@transaction.atomic
+@mpmodels.deferring_permission_updates()
+def _update_pending_media_items(batch_size):
+    """
+    Atomically perform stage 4 of :py:func:`~.update_related_models_from_cache` for at most
+    batch_size pending video updates. Returns the number of pending video updates processed.
 
+    """
     # 4) Update metadata for changed videos
     #
     # After this stage, all mediaplatform.MediaItem objects whose associated JWP video is one of
-    # those in updated_jwp_video_keys will have their metadata updated from the JWP video's custom
+    # those in pending_video_keys will have their metadata updated from the JWP video's custom
     # props. Note that legacysms.MediaItem objects associated with updated mediaplatform.MediaItem
     # objects will also be updated/created/deleted as necessary.
 
-    # The media items which need update. We defer fetching all the metdata since we're going to
-    # reset it anyway.
+    pending_video_keys = list(
+        jwpmodels.PendingVideoUpdate.objects.order_by('video_id')
+        .values_list('video_id', flat=True)[:batch_size]
+    )
+    if len(pending_video_keys) == 0:
+        return 0
+
+    # The media items which need update along with the data from the corresponding JWP video
+    # resource and the id of the associated SMS media item (if any). We don't fetch any of the
+    # existing metadata since we're going to reset it anyway.
     updated_media_items = (
         mpmodels.MediaItem.objects.all()
-        .select_related('view_permission')
-        # updated_at is included because, without it, the field does not get updated on save() for
-        # some reason
-        .only('view_permission', 'jwp', 'sms', 'updated_at')
+        .filter(jwp__key__in=pending_video_keys)
         .annotate(data=models.Subquery(
             mediajwpmodels.CachedResource.videos
             .filter(key=models.OuterRef('jwp__key'))
@@ -202,106 +282,30 @@ def update_related_models_from_cache(update_all_videos=False):
         ))
     )
 
-    # Unless we were asked to update the metadata in all objects, only update those which were last
-    # updated before the corresponding JWP video resource. We use MEDIA_ITEM_FRESHNESS_THRESHOLD as
-    # a "fudge factor" to make sure that we err on the side of updating too many objects rather
-    # than relying on the JWP clock and our clock to be perfectly synchronised.
-    if not update_all_videos:
-        updated_media_items = (
-            updated_media_items
-            .filter(jwp__key__in=updated_jwp_video_keys)
-        )
+    # Update the media items, their view permissions and SMS media items. This is done with a fixed
+    # number of statements irrespective of the batch size. No signal handlers are run and so, in
+    # particular, the changes are not propagated back to JWP.
+    _update_media_items_from_videos(updated_media_items.values_list('id', 'data', 'sms__id'))
 
-    # Iterate over all updated media items and set the metadata
-    max_tag_length = mpmodels.MediaItem._meta.get_field('tags').base_field.max_length
-    type_map = {
-        'video': mpmodels.MediaItem.VIDEO,
-        'audio': mpmodels.MediaItem.AUDIO,
-        'unknown': mpmodels.MediaItem.UNKNOWN,
-    }
-
-    # We'll be modifying the MediaItem objects to be consistent with the JWP videos. We *don't*
-    # want the signal handlers then trying to modify the JWPlatform videos again so disable
-    # MediaItem -> JWP syncing if it is enabled.
-    with setting_sync_items(False):
-        for item in updated_media_items:
-            # Skip items with no associated JWP video
-            if item.data is None:
-                continue
-
-            video = jwp.Video(item.data)
-            custom = video.get('custom', {})
-
-            item.title = _default_if_none(video.get('title'), '')
-            item.description = _default_if_none(video.get('description'), '')
-            item.type = type_map[_default_if_none(video.get('mediatype'), 'unknown')]
-
-            item.downloadable = 'True' == jwp.parse_custom_field(
-                    'downloadable', custom.get('sms_downloadable', 'downloadable:False:'))
-
-            published_timestamp = video.get('date')
-            if published_timestamp is not None:
-                item.published_at = datetime.datetime.fromtimestamp(
-                    published_timestamp, pytz.utc)
-            else:
-                item.published_at = None
+    mpmodels.update_permission_principals(
+        mpmodels.Permission.objects.filter(allows_view_item__jwp__key__in=pending_video_keys))
+    mpmodels.update_publicly_viewable(
+        mpmodels.MediaItem.objects_including_deleted.filter(jwp__key__in=pending_video_keys))
 
-            item.duration = _default_if_none(video.get('duration'), 0.)
+    # Remove the processed videos from the checkpoint
+    jwpmodels.PendingVideoUpdate.objects.filter(video_id__in=pending_video_keys).delete()
 
-            # The language should be a three letter code. Use [:3] to make sure that it always is
-            # even if the JWP custom prop is somehow messed up.
-            item.language = jwp.parse_custom_field(
-                    'language', custom.get('sms_language', 'language::'))[:3]
-
-            item.copyright = jwp.parse_custom_field(
-                    'copyright', custom.get('sms_copyright', 'copyright::'))
-
-            # Since tags have database enforced maximum lengths, make sure to truncate them if
-            # they're too long. We also strip leading or trailing whitespace.
-            item.tags = [
-                tag.strip().lower()[:max_tag_length]
-                for tag in jwp.parse_custom_field(
-                    'keywords', custom.get('sms_keywords', 'keywords::')
-                ).split('|')
-                if tag.strip() != ''
-            ]
+    return len(pending_video_keys)
 
-            # Update view permission
-            item.view_permission.reset()
-            _set_permission_from_acl(item.view_permission, video.acl)
-            item.view_permission.save()
-
-            # Update associated SMS media item (if any)
-            sms_media_id = video.media_id
-            if sms_media_id is not None:
-                # Get or create associated SMS media item. Note that hasattr is recommended in the
-                # Django docs as a way to determine isf a related objects exists.
-                # https://docs.djangoproject.com/en/dev/topics/db/examples/one_to_one/
-                if hasattr(item, 'sms') and item.sms is not None:
-                    sms_media_item = item.sms
-                else:
-                    sms_media_item = legacymodels.MediaItem(id=sms_media_id)
-
-                # Extract last updated timestamp. It should be an ISO 8601 date string.
-                last_updated = jwp.parse_custom_field(
-                    'last_updated_at', custom.get('sms_last_updated_at', 'last_updated_at::'))
-
-                # Update SMS media item
-                sms_media_item.item = item
-                if last_updated == '':
-                    sms_media_item.last_updated_at = None
-                else:
-                    sms_media_item.last_updated_at = dateutil.parser.parse(last_updated)
-
-                sms_media_item.save()
-            else:
-                # If there is no associated SMS media item, make sure that this item doesn't have
-                # one pointing to it.
-                if hasattr(item, 'sms') and item.sms is not None:
-                    item.sms.delete()
 
-            item.save()
+@transaction.atomic
+@mpmodels.deferring_permission_updates()
+def _update_channels(channel_ids):
+    """
+    Atomically perform stage 5 of :py:func:`~.update_related_models_from_cache` for the channels
+    with the passed ids.
 
+    """
     # 5) Update metadata for changed channels
     #
     # After this stage, all mediaplatform.Channel objects whose associated JWP channel is one of
@@ -309,10 +313,17 @@ def update_related_models_from_cache(update_all_videos=False):
     # custom props. Note that legacysms.Channel objects associated with updated
     # mediaplatform.Channel objects will also be updated/created/deleted as necessary.
 
+    # Items may be removed from the channels below. Remember which items are in the channels now
+    # so that the publicly viewable flag of removed items is also recomputed.
+    previous_item_ids = list(
+        mpmodels.MediaItem.objects_including_deleted.filter(channel_id__in=channel_ids)
+        .values_list('id', flat=True)
+    )
+
     # The channels which need update. We defer fetching all the metdata since we're going to
     # reset it anyway.
     updated_channels = (
-        mpmodels.Channel.objects.all()
+        mpmodels.Channel.objects.filter(id__in=channel_ids)
         .select_related('edit_permission')
         # updated_at is included because, without it, the field does not get updated on save() for
         # some reason
@@ -411,11 +422,285 @@ def update_related_models_from_cache(update_all_videos=False):
 
         channel.save()
 
+    # Rebuild the principals of the edit permissions of the channels synchronised above and of the
+    # view permissions of their playlists, which include any shadow playlists created above.
+    mpmodels.update_permission_principals(mpmodels.Permission.objects.filter(
+        models.Q(allows_edit_channel__in=channel_ids)
+        | models.Q(allows_view_playlist__channel_id__in=channel_ids)
+    ))
+
+    # Recompute the publicly viewable flag of items which are or were in the channels.
+    mpmodels.update_publicly_viewable(mpmodels.MediaItem.objects_including_deleted.filter(
+        models.Q(id__in=previous_item_ids) | models.Q(channel_id__in=channel_ids)))
+
+
+def update_video_sources(refresh_all=False, concurrency=None, batch_size=None):
+    """
+    Fetch the sources of JWP videos associated with media items from the Delivery API and store
+    them as :py:class:`mediaplatform_jwp.models.VideoSource` objects. By default, only videos
+    whose sources have never been fetched, have been updated since or were fetched longer ago
+    than ``JWPLATFORM_STORED_SOURCES_MAX_AGE`` are fetched. If *refresh_all* is True, the sources
+    of all videos are re-fetched.
+
+    Up to *concurrency* videos are fetched at once. The sources are stored in transactions of at
+    most *batch_size* videos. Videos which the Delivery API cannot find, usually because they are
+    still being transcoded, are skipped and fetched again next time.
+
+    Returns the number of videos whose sources were stored.
+
+    """
+    concurrency = concurrency if concurrency is not None else DEFAULT_SOURCE_FETCH_CONCURRENCY
+    batch_size = batch_size if batch_size is not None else SYNC_BATCH_SIZE
+
+    videos = jwpmodels.Video.objects.filter(item__isnull=False)
+    if not refresh_all:
+        videos = videos.filter(
+            models.Q(sources_updated__isnull=True)
+            | models.Q(sources_updated__lt=models.F('updated'))
+            | models.Q(sources_fetched_at__isnull=True)
+            | models.Q(sources_fetched_at__lte=jwpmodels.stored_sources_fetched_after())
+        )
+    keys_and_updated = list(videos.order_by('key').values_list('key', 'updated'))
+
+    stored_count = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for batch in _batched(keys_and_updated, batch_size):
+            sources_list = executor.map(_fetch_video_sources, [key for key, _ in batch])
+            fetched = [
+                (key, updated, sources)
+                for (key, updated), sources in zip(batch, sources_list) if sources is not None
+            ]
+            _store_video_sources(fetched)
+            stored_count += len(fetched)
+
+    return stored_count
+
+
+def _fetch_video_sources(key):
+    """
+    Return the list of source dicts for the JWP video with the passed key from the Delivery API
+    or None if they could not be fetched. This is called from worker threads and so must not use
+    the database.
+
+    """
+    try:
+        return jwp.DeliveryVideo.from_key(key).get('sources', [])
+    except jwp.VideoNotFoundError:
+        return None
+    except (requests.RequestException, jwp.UnparseableVideoError) as e:
+        LOG.warning('Error fetching sources for video "%s": %s', key, e)
+        return None
+
+
+@transaction.atomic
+def _store_video_sources(fetched):
+    """
+    Given a sequence of (key, updated, sources) tuples, replace the stored sources of each JWP
+    video with the given key and record the updated timestamp and time at which they were
+    fetched.
+
+    """
+    keys = [key for key, _, _ in fetched]
+    jwpmodels.VideoSource.objects.filter(video_id__in=keys).delete()
+    jwpmodels.VideoSource.objects.bulk_create([
+        jwpmodels.VideoSource(
+            video_id=key, mime_type=source.get('type', ''), url=source.get('file', ''),
+            width=source.get('width'), height=source.get('height'))
+        for key, _, sources in fetched
+        for source in sources
+    ], batch_size=SYNC_BATCH_SIZE)
+
+    with connection.cursor() as cursor:
+        execute_values(cursor, f'''
+            UPDATE {jwpmodels.Video._meta.db_table} AS jwp
+            SET sources_updated = v.updated, sources_fetched_at = NOW()
+            FROM (VALUES %s) AS v (key, updated)
+            WHERE jwp.key = v.key
+        ''', [(key, updated) for key, updated, _ in fetched], page_size=SYNC_BATCH_SIZE)
+
 
 def _default_if_none(value, default):
     return value if value is not None else default
 
 
+def _set_jwp_links(jwp_model, field_name, keys_and_objects):
+    """
+    Given a model from mediaplatform_jwp, the name of its link to the corresponding
+    mediaplatform model and a sequence of (key, object) tuples, set the link of each JWP
+    object with the given key to the object. This takes one statement per
+    :py:data:`~.SYNC_BATCH_SIZE` tuples rather than one per tuple.
+
+    """
+    table = jwp_model._meta.db_table
+    column = jwp_model._meta.get_field(field_name).column
+
+    with connection.cursor() as cursor:
+        execute_values(cursor, f'''
+            UPDATE {table} AS jwp
+            SET {column} = v.id
+            FROM (VALUES %s) AS v (key, id)
+            WHERE jwp.key = v.key
+        ''', [(key, obj.id) for key, obj in keys_and_objects], page_size=SYNC_BATCH_SIZE)
+
+
+def _batched(iterable, batch_size):
+    """
+    Yield lists of at most *batch_size* consecutive elements from *iterable*.
+
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def _update_media_items_from_videos(rows):
+    """
+    Given a sequence of (media item id, JWP video resource, SMS media item id) tuples, update the
+    metadata and view permission of each media item from the video resource. Legacy SMS media items
+    are created, updated or deleted to match the video's custom props. Rows whose video resource
+    is None are skipped.
+
+    The updates are applied with a fixed number of statements irrespective of the number of rows.
+
+    """
+    max_tag_length = mpmodels.MediaItem._meta.get_field('tags').base_field.max_length
+    now = timezone.now()
+
+    item_values, permission_values = [], []
+    sms_updated_values, sms_created_values, sms_deleted_ids = [], {}, []
+
+    for item_id, data, sms_id in rows:
+        # Skip items with no associated JWP video
+        if data is None:
+            continue
+
+        video = jwp.Video(data)
+        custom = video.get('custom', {})
+
+        downloadable = 'True' == jwp.parse_custom_field(
+            'downloadable', custom.get('sms_downloadable', 'downloadable:False:'))
+
+        published_timestamp = video.get('date')
+        if published_timestamp is not None:
+            published_at = datetime.datetime.fromtimestamp(published_timestamp, pytz.utc)
+        else:
+            published_at = None
+
+        # Since tags have database enforced maximum lengths, make sure to truncate them if
+        # they're too long. We also strip leading or trailing whitespace.
+        tags = [
+            tag.strip().lower()[:max_tag_length]
+            for tag in jwp.parse_custom_field(
+                'keywords', custom.get('sms_keywords', 'keywords::')
+            ).split('|')
+            if tag.strip() != ''
+        ]
+
+        item_values.append((
+            item_id,
+            _default_if_none(video.get('title'), ''),
+            _default_if_none(video.get('description'), ''),
+            _MEDIA_TYPE_MAP[_default_if_none(video.get('mediatype'), 'unknown')],
+            downloadable,
+            published_at,
+            _default_if_none(video.get('duration'), 0.),
+            # The language should be a three letter code. Use [:3] to make sure that it always is
+            # even if the JWP custom prop is somehow messed up.
+            jwp.parse_custom_field('language', custom.get('sms_language', 'language::'))[:3],
+            jwp.parse_custom_field('copyright', custom.get('sms_copyright', 'copyright::')),
+            tags,
+            now,
+        ))
+
+        # Compute the new view permission
+        permission = mpmodels.Permission()
+        _set_permission_from_acl(permission, video.acl)
+        permission_values.append((
+            item_id, permission.crsids, permission.lookup_groups, permission.lookup_insts,
+            permission.is_public, permission.is_signed_in,
+        ))
+
+        # Update associated SMS media item (if any)
+        sms_media_id = video.media_id
+        if sms_media_id is not None:
+            # Extract last updated timestamp. It should be an ISO 8601 date string.
+            last_updated = jwp.parse_custom_field(
+                'last_updated_at', custom.get('sms_last_updated_at', 'last_updated_at::'))
+            last_updated_at = dateutil.parser.parse(last_updated) if last_updated != '' else None
+
+            if sms_id is not None:
+                # Update the existing SMS media item.
+                sms_updated_values.append((sms_id, last_updated_at))
+            else:
+                # Create the SMS media item or take it over if it already exists. If more than one
+                # item claims a SMS media item, the last one wins.
+                sms_media_id = int(sms_media_id)
+                sms_created_values[sms_media_id] = (sms_media_id, item_id, last_updated_at)
+        elif sms_id is not None:
+            # If there is no associated SMS media item, make sure that this item doesn't have
+            # one pointing to it.
+            sms_deleted_ids.append(sms_id)
+
+    item_table = mpmodels.MediaItem._meta.db_table
+    permission_table = mpmodels.Permission._meta.db_table
+    sms_table = legacymodels.MediaItem._meta.db_table
+
+    with connection.cursor() as cursor:
+        execute_values(cursor, f'''
+            UPDATE {item_table} AS item
+            SET
+                title = v.title, description = v.description, type = v.type,
+                downloadable = v.downloadable, published_at = v.published_at,
+                duration = v.duration, language = v.language, copyright = v.copyright,
+                tags = v.tags, updated_at = v.updated_at
+            FROM (VALUES %s) AS v (
+                id, title, description, type, downloadable, published_at, duration, language,
+                copyright, tags, updated_at
+            )
+            WHERE item.id = v.id
+        ''', item_values, template='''(
+            %s, %s, %s, %s, %s::boolean, %s::timestamptz, %s::double precision, %s, %s,
+            %s::varchar[], %s::timestamptz
+        )''', page_size=SYNC_BATCH_SIZE)
+
+        execute_values(cursor, f'''
+            UPDATE {permission_table} AS permission
+            SET
+                crsids = v.crsids, lookup_groups = v.lookup_groups,
+                lookup_insts = v.lookup_insts, is_public = v.is_public,
+                is_signed_in = v.is_signed_in
+            FROM (VALUES %s) AS v (
+                item_id, crsids, lookup_groups, lookup_insts, is_public, is_signed_in
+            )
+            WHERE permission.allows_view_item_id = v.item_id
+        ''', permission_values, template='''(
+            %s, %s::text[], %s::text[], %s::text[], %s::boolean, %s::boolean
+        )''', page_size=SYNC_BATCH_SIZE)
+
+        execute_values(cursor, f'''
+            UPDATE {sms_table} AS sms
+            SET last_updated_at = v.last_updated_at
+            FROM (VALUES %s) AS v (id, last_updated_at)
+            WHERE sms.id = v.id
+        ''', sms_updated_values, template='''(
+            %s::bigint, %s::timestamptz
+        )''', page_size=SYNC_BATCH_SIZE)
+
+        execute_values(cursor, f'''
+            INSERT INTO {sms_table} (id, item_id, last_updated_at)
+            VALUES %s
+            ON CONFLICT (id) DO UPDATE SET
+                item_id = EXCLUDED.item_id, last_updated_at = EXCLUDED.last_updated_at
+        ''', list(sms_created_values.values()), template='''(
+            %s::bigint, %s, %s::timestamptz
+        )''', page_size=SYNC_BATCH_SIZE)
+
+    legacymodels.MediaItem.objects.filter(id__in=sms_deleted_ids).delete()
+
+
 def _set_permission_from_acl(permission, acl):
     """
     Given an ACL, update the passed permission to reflect it. The permission is not reset, nor is
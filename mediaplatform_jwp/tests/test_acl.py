@@ -5,7 +5,8 @@ from unittest import mock
 
 from django.test import TestCase
 
-from mediaplatform_jwp.acl import AceWorld, AceCam, AceInst, AceGroup, AceUser, build_acl
+from mediaplatform_jwp.acl import (
+    AceWorld, AceCam, AceInst, AceGroup, AceUser, build_acl, compile_acl)
 
 
 class AclTest(TestCase):
@@ -123,6 +124,54 @@ class AceUserTest(TestCase):
         self.assertTrue(ace_user.has_permission(mock.Mock(username="mb2174")))
 
 
+class CompiledAclTest(TestCase):
+    """
+    Tests for :py:func:compile_acl
+    """
+    def setUp(self):
+        self.get_person = patch_get_person(self)
+
+    def test_compiled_acl_is_cached(self):
+        self.assertIs(compile_acl(['CAM', 'USER_mb2174']), compile_acl(('CAM', 'USER_mb2174')))
+
+    def test_unrecognised_ace(self):
+        with self.assertRaises(AssertionError):
+            compile_acl(['OTHER'])
+
+    def test_world(self):
+        compiled = compile_acl(['INST_UIS', 'WORLD'])
+        self.assertTrue(compiled.has_permission(mock.Mock(is_anonymous=True)))
+        self.get_person.assert_not_called()
+
+    def test_cam(self):
+        compiled = compile_acl(['INST_UIS', 'CAM'])
+        self.assertFalse(compiled.has_permission(mock.Mock(is_anonymous=True)))
+        self.assertTrue(compiled.has_permission(mock.Mock(is_anonymous=False)))
+        self.get_person.assert_not_called()
+
+    def test_user(self):
+        compiled = compile_acl(['USER_mb2174'])
+        self.assertTrue(compiled.has_permission(mock.Mock(is_anonymous=False, username='mb2174')))
+        self.assertFalse(compiled.has_permission(mock.Mock(is_anonymous=False, username='rjw57')))
+        self.get_person.assert_not_called()
+
+    def test_inst_and_group_use_one_lookup(self):
+        """All INST_ and GROUP_ entries are evaluated with a single lookup call."""
+        user = mock.Mock(is_anonymous=False, username='rjw57')
+        compiled = compile_acl(['INST_CL', 'INST_ENG', 'GROUP_1', 'GROUP_2'])
+        self.assertFalse(compiled.has_permission(user))
+        self.assertEqual(self.get_person.call_count, 1)
+
+    def test_inst(self):
+        user = mock.Mock(is_anonymous=False, username='rjw57')
+        self.assertTrue(compile_acl(['GROUP_1', 'INST_UIS']).has_permission(user))
+
+    def test_group(self):
+        user = mock.Mock(is_anonymous=False, username='rjw57')
+        self.assertTrue(compile_acl(['INST_CL', 'GROUP_12345']).has_permission(user))
+        self.assertTrue(compile_acl(['INST_CL', 'GROUP_uis-members']).has_permission(user))
+
+
 def patch_get_person(self):
     get_person = mock.Mock()
     get_person.return_value = {
@@ -132,3 +181,4 @@ def patch_get_person(self):
     patcher = mock.patch('automationlookup.get_person', get_person)
     self.addCleanup(patcher.stop)
     patcher.start()
+    return get_person
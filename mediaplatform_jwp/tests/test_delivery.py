@@ -1,6 +1,9 @@
+import datetime
 from unittest import mock
 
-from django.test import TestCase
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
 from mediaplatform_jwp.api import delivery as jwplatform
 from mediaplatform import models as mpmodels
@@ -32,6 +35,122 @@ class SourcesTestCase(TestCase):
         expected_urls = set(source['file'] for source in DELIVERY_VIDEO_FIXTURE['sources'])
         self.assertEqual(source_urls, expected_urls)
 
+    def test_stored_sources(self):
+        """If the stored sources are current, they are used."""
+        item = mpmodels.MediaItem.objects.get(id='existing')
+        item.jwp.sources_updated = item.jwp.updated
+        item.jwp.sources_fetched_at = timezone.now()
+        item.jwp.save()
+        item.jwp.delivery_sources.create(
+            mime_type='video/mp4', url='http://cdn.invalid/stored.mp4', width=640, height=360)
+
+        item = (
+            mpmodels.MediaItem.objects.select_related('jwp')
+            .prefetch_related('jwp__delivery_sources').get(id='existing')
+        )
+        with self.assertNumQueries(0):
+            sources = item.get_sources(only_if_downloadable=False)
+        self.assertEqual([source.url for source in sources], ['http://cdn.invalid/stored.mp4'])
+        self.assertEqual((sources[0].width, sources[0].height), (640, 360))
+        self.dv_from_key.assert_not_called()
+
+    def test_stale_stored_sources(self):
+        """If the video has been updated since the sources were stored, they are not used."""
+        item = mpmodels.MediaItem.objects.get(id='existing')
+        item.jwp.sources_updated = item.jwp.updated - 1
+        item.jwp.sources_fetched_at = timezone.now()
+        item.jwp.save()
+        item.jwp.delivery_sources.create(mime_type='video/mp4', url='http://cdn.invalid/old.mp4')
+
+        sources = item.get_sources(only_if_downloadable=False)
+        self.assertNotIn('http://cdn.invalid/old.mp4', [source.url for source in sources])
+        self.dv_from_key.assert_called_once_with(item.jwp.key)
+
+    @override_settings(JWPLATFORM_STORED_SOURCES_MAX_AGE=600)
+    def test_expired_stored_sources(self):
+        """If the stored sources are older than their maximum age, they are not used."""
+        item = mpmodels.MediaItem.objects.get(id='existing')
+        item.jwp.sources_updated = item.jwp.updated
+        item.jwp.sources_fetched_at = timezone.now() - datetime.timedelta(seconds=601)
+        item.jwp.save()
+        item.jwp.delivery_sources.create(
+            mime_type='video/mp4', url='http://cdn.invalid/expired.mp4')
+
+        sources = item.get_sources(only_if_downloadable=False)
+        self.assertNotIn('http://cdn.invalid/expired.mp4', [source.url for source in sources])
+        self.dv_from_key.assert_called_once_with(item.jwp.key)
+
+
+@override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'delivery': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'delivery-tests',
+        },
+    },
+    JWPLATFORM_SOURCES_CACHE='delivery',
+    JWPLATFORM_SOURCES_CACHE_TIMEOUT=60,
+    JWPLATFORM_SOURCES_CACHE_NEGATIVE_TIMEOUT=10,
+)
+class SourcesCacheTestCase(TestCase):
+    fixtures = ['mediaplatform_jwp/tests/fixtures/mediaitems.yaml']
+
+    def setUp(self):
+        self.dv_from_key_patcher = (
+            mock.patch('mediaplatform_jwp.api.delivery.DeliveryVideo.from_key'))
+        self.dv_from_key = self.dv_from_key_patcher.start()
+        self.dv_from_key.return_value = jwplatform.DeliveryVideo(DELIVERY_VIDEO_FIXTURE)
+        self.addCleanup(self.dv_from_key_patcher.stop)
+
+        self.cache = caches['delivery']
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+    def test_sources_are_cached(self):
+        """Repeated calls for the same video result in one delivery API call."""
+        for _ in range(3):
+            self.assertEqual(
+                jwplatform.get_video_sources('mock1', 1234), DELIVERY_VIDEO_FIXTURE['sources'])
+        self.dv_from_key.assert_called_once_with('mock1')
+
+    def test_update_invalidates(self):
+        """A change to the video's updated timestamp results in a new delivery API call."""
+        jwplatform.get_video_sources('mock1', 1234)
+        jwplatform.get_video_sources('mock1', 1235)
+        self.assertEqual(self.dv_from_key.call_count, 2)
+
+    def test_not_found_is_cached(self):
+        """A video which is not found is remembered."""
+        self.dv_from_key.side_effect = jwplatform.VideoNotFoundError
+        for _ in range(2):
+            with self.assertRaises(jwplatform.VideoNotFoundError):
+                jwplatform.get_video_sources('mock1', 1234)
+        self.dv_from_key.assert_called_once_with('mock1')
+
+    def test_not_found_is_cached_for_negative_timeout(self):
+        """A video which is not found is cached with the negative timeout."""
+        self.dv_from_key.side_effect = jwplatform.VideoNotFoundError
+        with mock.patch.object(self.cache, 'set') as cache_set:
+            with self.assertRaises(jwplatform.VideoNotFoundError):
+                jwplatform.get_video_sources('mock1', 1234)
+        cache_set.assert_called_once_with('jwp-sources:mock1:1234', (False, []), 10)
+
+    @override_settings(JWPLATFORM_SOURCES_CACHE_TIMEOUT=0)
+    def test_zero_timeout_disables_cache(self):
+        """A zero timeout passes every call through to the delivery API."""
+        jwplatform.get_video_sources('mock1', 1234)
+        jwplatform.get_video_sources('mock1', 1234)
+        self.assertEqual(self.dv_from_key.call_count, 2)
+
+    def test_item_sources_use_cache(self):
+        """Media item sources are served from the cache."""
+        call_count = self.dv_from_key.call_count
+        for _ in range(2):
+            item = mpmodels.MediaItem.objects.get(id='existing')
+            self.assertEqual(len(item.get_sources(only_if_downloadable=False)), 2)
+        self.assertEqual(self.dv_from_key.call_count, call_count + 1)
+
 
 DELIVERY_VIDEO_FIXTURE = {
     'key': 'mock1',
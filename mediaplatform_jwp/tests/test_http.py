@@ -0,0 +1,143 @@
+"""
+Tests for the shared outbound HTTP session.
+
+"""
+from unittest import mock
+
+from django.test import TestCase, override_settings
+import requests
+
+from mediaplatform_jwp.api import delivery as api
+from mediaplatform_jwp.api import http
+
+
+@override_settings(
+    JWPLATFORM_HTTP_CONNECT_TIMEOUT=2,
+    JWPLATFORM_HTTP_READ_TIMEOUT=7,
+    JWPLATFORM_HTTP_POOL_SIZE=3,
+    JWPLATFORM_HTTP_MAX_RETRIES=4,
+    JWPLATFORM_HTTP_CIRCUIT_BREAKER_THRESHOLD=3,
+    JWPLATFORM_HTTP_CIRCUIT_BREAKER_RESET=30,
+)
+class OutboundSessionTests(TestCase):
+    def setUp(self):
+        self.session = http.OutboundSession()
+
+        send_patcher = mock.patch('requests.adapters.HTTPAdapter.send')
+        self.send = send_patcher.start()
+        self.addCleanup(send_patcher.stop)
+        self.send.side_effect = self._response
+
+        self.status_code = 200
+
+    def test_adapters_configured_from_settings(self):
+        """Adapters are configured from the settings."""
+        adapter = self.session.get_adapter('https://cdn.jwplayer.com/')
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertEqual(adapter.max_retries.total, 4)
+        self.assertIs(self.session.get_adapter('https://api.jwplatform.com/'), adapter)
+
+    def test_default_timeout(self):
+        """The default timeout is applied only if none is passed."""
+        self.session.get('https://cdn.jwplayer.com/')
+        self.assertEqual(self.send.call_args[1]['timeout'], (2, 7))
+
+        self.session.get('https://cdn.jwplayer.com/', timeout=1)
+        self.assertEqual(self.send.call_args[1]['timeout'], 1)
+
+    def test_circuit_breaker_opens(self):
+        """After consecutive failures, requests to a host fail without being made."""
+        self.send.side_effect = requests.ConnectionError()
+        for _ in range(3):
+            with self.assertRaises(requests.ConnectionError):
+                self.session.get('https://cdn.jwplayer.com/')
+        self.assertEqual(self.send.call_count, 3)
+
+        with self.assertRaises(http.CircuitOpenError):
+            self.session.get('https://cdn.jwplayer.com/')
+        self.assertEqual(self.send.call_count, 3)
+
+        # Other hosts are unaffected
+        self.send.side_effect = self._response
+        self.session.get('https://api.jwplatform.com/')
+        self.assertEqual(self.send.call_count, 4)
+
+    def test_server_errors_open_circuit_breaker(self):
+        """Server error responses count as failures."""
+        self.status_code = 503
+        for _ in range(3):
+            self.assertEqual(self.session.get('https://cdn.jwplayer.com/').status_code, 503)
+        with self.assertRaises(http.CircuitOpenError):
+            self.session.get('https://cdn.jwplayer.com/')
+
+    def test_not_found_does_not_open_circuit_breaker(self):
+        """Client error responses do not count as failures."""
+        self.status_code = 404
+        for _ in range(5):
+            self.session.get('https://cdn.jwplayer.com/')
+        self.assertEqual(self.send.call_count, 5)
+
+    def test_circuit_breaker_resets(self):
+        """A request is let through once the reset timeout has passed."""
+        self.send.side_effect = requests.ConnectionError()
+        for _ in range(3):
+            with self.assertRaises(requests.ConnectionError):
+                self.session.get('https://cdn.jwplayer.com/')
+
+        self.send.side_effect = self._response
+        now = http.time.monotonic()
+        with mock.patch('time.monotonic', return_value=now + 31):
+            self.session.get('https://cdn.jwplayer.com/')
+        self.session.get('https://cdn.jwplayer.com/')
+        self.assertEqual(self.send.call_count, 5)
+
+    def test_metrics(self):
+        """Requests, failures and refused requests are recorded for each host."""
+        self.session.get('https://cdn.jwplayer.com/')
+        self.session.get('https://cdn.jwplayer.com/')
+        self.send.side_effect = requests.ConnectionError()
+        for _ in range(4):
+            with self.assertRaises(requests.ConnectionError):
+                self.session.get('https://api.jwplatform.com/')
+
+        metrics = self.session.get_metrics()
+        self.assertEqual(metrics['cdn.jwplayer.com']['requests'], 2)
+        self.assertEqual(metrics['cdn.jwplayer.com']['failures'], 0)
+        self.assertIsNotNone(metrics['cdn.jwplayer.com']['mean_latency'])
+        self.assertEqual(metrics['api.jwplatform.com']['requests'], 3)
+        self.assertEqual(metrics['api.jwplatform.com']['failures'], 3)
+        self.assertEqual(metrics['api.jwplatform.com']['refused'], 1)
+
+    def _response(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class SharedSessionTests(TestCase):
+    def test_delivery_uses_shared_session(self):
+        """The Delivery API helpers use the shared session."""
+        self.assertIs(api.DEFAULT_REQUESTS_SESSION, http.SESSION)
+
+    def test_jwplatform_client_is_shared(self):
+        """The same management API client is returned for the same credentials."""
+        with self.settings(JWPLATFORM_API_KEY='key', JWPLATFORM_API_SECRET='secret'):
+            client = api.get_jwplatform_client()
+            self.assertIs(api.get_jwplatform_client(), client)
+        with self.settings(JWPLATFORM_API_KEY='key', JWPLATFORM_API_SECRET='other-secret'):
+            self.assertIsNot(api.get_jwplatform_client(), client)
+
+    def test_jwplatform_client_uses_shared_session(self):
+        """The management API client makes its requests with the shared session."""
+        with self.settings(JWPLATFORM_API_KEY='key', JWPLATFORM_API_SECRET='secret'):
+            self.assertIs(api.get_jwplatform_client()._connection, http.SESSION)
+
+    def test_jwplatform_client_without_session_warns(self):
+        """A warning is logged if the shared session cannot be swapped in to the client."""
+        api._jwplatform_client.cache_clear()
+        self.addCleanup(api._jwplatform_client.cache_clear)
+        with mock.patch('jwplatform.Client', return_value=object()), \
+                self.assertLogs(api.LOG, 'WARNING'):
+            api._jwplatform_client('key', 'secret')
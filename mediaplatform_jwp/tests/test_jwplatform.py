@@ -84,3 +84,68 @@ class PlatformDeliveryAPITests(TestCase):
         self.assertEqual(url_parts.scheme, 'http')
         self.assertEqual(url_parts.netloc, 'test.invalid')
         self.assertEqual(url_parts.path, '/example/resource')
+
+
+@override_settings(
+    JWPLATFORM_API_SECRET='some-test-secret', JWPLATFORM_API_BASE_URL='http://test.invalid/',
+    JWPLATFORM_SIGNATURE_TIMEOUT=3600)
+class SigningCacheTests(TestCase):
+    """
+    Test memoisation of signed URLs and tokens.
+
+    """
+    def setUp(self):
+        for func in [api._signed_url, api._generate_token, api._pd_api_url]:
+            func.cache_clear()
+            self.addCleanup(func.cache_clear)
+
+    def test_signed_url_identical_within_interval(self):
+        """URLs signed within the same expiry interval are identical and signed once."""
+        with mock.patch('hashlib.md5', wraps=api.hashlib.md5) as md5:
+            with mock.patch('time.time', return_value=180 * 1000 + 1):
+                url_1 = api.player_embed_url('abc', 'player')
+            with mock.patch('time.time', return_value=180 * 1000 + 179):
+                url_2 = api.player_embed_url('abc', 'player')
+
+        self.assertEqual(url_1, url_2)
+        self.assertEqual(md5.call_count, 1)
+
+    def test_signed_url_expiry_is_rounded_up(self):
+        """The expiry time is no earlier than the signature timeout."""
+        with mock.patch('time.time', return_value=180 * 1000 + 1):
+            url = api.signed_url('http://test.invalid/players/abc-player.js')
+        params = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        self.assertEqual(int(params['exp'][0]), 180 * 1001 + 3600)
+
+    def test_signed_url_differs_between_intervals(self):
+        """URLs signed in different expiry intervals differ."""
+        with mock.patch('time.time', return_value=180 * 1000):
+            url_1 = api.player_embed_url('abc', 'player')
+        with mock.patch('time.time', return_value=180 * 1001):
+            url_2 = api.player_embed_url('abc', 'player')
+        self.assertNotEqual(url_1, url_2)
+
+    def test_pd_api_url_token_generated_once(self):
+        """A token is only generated once for a resource within an expiry interval."""
+        with mock.patch('jwt.encode', wraps=api.jwt.encode) as encode:
+            url_1 = api.pd_api_url('/example/resource', now_timestamp=180 * 1000 + 1)
+            url_2 = api.pd_api_url('/example/resource', now_timestamp=180 * 1000 + 179)
+            url_3 = api.pd_api_url(
+                '/example/resource', now_timestamp=180 * 1000 + 1, format='json')
+
+        self.assertEqual(url_1, url_2)
+        self.assertNotEqual(url_1, url_3)
+        self.assertEqual(encode.call_count, 1)
+
+    def test_secret_change_is_respected(self):
+        """A change of secret results in a different signature."""
+        with mock.patch('time.time', return_value=180 * 1000):
+            url_1 = api.pd_api_url('/example/resource')
+            with self.settings(JWPLATFORM_API_SECRET='another-secret'):
+                url_2 = api.pd_api_url('/example/resource')
+        self.assertNotEqual(url_1, url_2)
+
+    def test_cache_is_bounded(self):
+        """The memoised signing functions hold a bounded number of results."""
+        for func in [api._signed_url, api._generate_token, api._pd_api_url]:
+            self.assertEqual(func.cache_info().maxsize, api.SIGNED_URL_CACHE_SIZE)
@@ -1,8 +1,19 @@
+import json
+import logging
+import os
 import random
+import time
+import unittest
+from unittest import mock
+
+from django.db import connection, transaction
 from django.test import TestCase
+from psycopg2.extras import execute_batch
 
 from .. import models
 
+LOG = logging.getLogger(__name__)
+
 
 class CachedResourceTest(TestCase):
     def setUp(self):
@@ -45,10 +56,54 @@ class CachedResourceTest(TestCase):
     def test_updated_at(self):
         """If a value is updated, the updated_at timestamp should be after created_at."""
         models.set_resources([{'key': 'foo', 'x': 5}], 'video')
-        models.set_resources([{'key': 'foo', 'x': 5}], 'video')
+        models.set_resources([{'key': 'foo', 'x': 6}], 'video')
         obj = self.videos.get(key='foo')
         self.assertGreater(obj.updated_at, obj.created_at)
 
+    def test_unchanged_not_updated(self):
+        """If a value is unchanged, the updated_at timestamp should not change."""
+        models.set_resources([{'key': 'foo', 'x': 5, 'y': 6}], 'video')
+        obj = self.videos.get(key='foo')
+        models.set_resources([{'y': 6, 'x': 5, 'key': 'foo'}], 'video')
+        self.assertEqual(self.videos.get(key='foo').updated_at, obj.updated_at)
+
+    def test_counts(self):
+        """set_resources() reports what happened to each resource."""
+        counts = models.set_resources([
+            {'key': 'foo', 'x': 5}, {'key': 'bar', 'y': 7}, {'key': 'buzz', 'z': 1},
+        ], 'video')
+        self.assertEqual(counts, models.ResourceCounts(
+            inserted=3, changed=0, unchanged=0, deleted=0))
+
+        counts = models.set_resources([
+            {'key': 'foo', 'x': 5}, {'key': 'bar', 'y': 8}, {'key': 'new', 'a': 1},
+        ], 'video')
+        self.assertEqual(counts, models.ResourceCounts(
+            inserted=1, changed=1, unchanged=1, deleted=1))
+
+    def test_duplicate_keys_counted_once(self):
+        """A resource which appears more than once is counted once."""
+        counts = models.set_resources([
+            {'key': 'foo', 'x': 5}, {'key': 'foo', 'x': 7},
+        ], 'video')
+        self.assertEqual(counts, models.ResourceCounts(
+            inserted=1, changed=0, unchanged=0, deleted=0))
+
+    def test_already_deleted_not_counted(self):
+        """Resources which were already deleted are not counted as deleted again."""
+        models.set_resources([{'key': 'foo', 'x': 5}, {'key': 'bar', 'y': 7}], 'video')
+        models.set_resources([{'key': 'foo', 'x': 5}], 'video')
+        counts = models.set_resources([{'key': 'foo', 'x': 5}], 'video')
+        self.assertEqual(counts.deleted, 0)
+
+    def test_unchanged_reinsertion(self):
+        """A deleted resource which re-appears unchanged is undeleted."""
+        models.set_resources([{'key': 'foo', 'x': 5}, {'key': 'bar', 'y': 7}], 'video')
+        models.set_resources([{'key': 'foo', 'x': 5}], 'video')
+        counts = models.set_resources([{'key': 'foo', 'x': 5}, {'key': 'bar', 'y': 7}], 'video')
+        self.assertEqual(counts.changed, 1)
+        self.assertIsNone(self.all_videos.get(key='bar').deleted_at)
+
     def test_iterable_resources(self):
         """update_resource_cache() should accept an iterable."""
         def resources():
@@ -120,3 +175,174 @@ class CachedResourceTest(TestCase):
         self.assertEqual(self.videos.filter(data__x=5).first().key, 'foo')
         self.assertEqual(self.channels.count(), 1)
         self.assertEqual(self.channels.filter(data__z=5).first().key, 'buzz')
+
+    def test_special_characters(self):
+        """Characters which are special to COPY survive the round trip."""
+        data = {'key': 'foo\\\tbar', 'title': 'a\\b\nc\td\re', 'x': '\\N'}
+        models.set_resources([data], 'video')
+        self.assertEqual(self.videos.get(key='foo\\\tbar').data, data)
+
+    def test_non_ascii_characters(self):
+        """Non-ASCII characters survive the round trip."""
+        data = {'key': 'foo', 'title': 'Caf\u00e9 \U0001f3a5'}
+        models.set_resources([data], 'video')
+        self.assertEqual(self.videos.get(key='foo').data, data)
+
+    def test_resources_streamed(self):
+        """Resources are consumed as the COPY input is read rather than all at once."""
+        read_sizes = []
+        original_read = models._CopyReader.read
+
+        def read(reader, size=-1):
+            read_sizes.append(size)
+            return original_read(reader, size)
+
+        # Record how many reads of the COPY input had been started when each resource was taken
+        reads_when_consumed = []
+
+        def resources(count):
+            for index in range(count):
+                reads_when_consumed.append(len(read_sizes))
+                yield {'key': f'resource_{index}', 'title': f'Resource {index}' * 10}
+
+        with mock.patch.object(models._CopyReader, 'read', read):
+            models.set_resources(resources(2000), 'video')
+
+        self.assertEqual(self.videos.count(), 2000)
+
+        # The first resource is taken by the first read and the last one by a later read.
+        self.assertEqual(reads_when_consumed[0], 1)
+        self.assertGreater(reads_when_consumed[-1], 1)
+
+    def test_no_delete_missing(self):
+        """If delete_missing is False, resources missing from the iterable are not deleted."""
+        models.set_resources([
+            {'key': 'foo', 'x': 5}, {'key': 'bar', 'y': 7}
+        ], 'video')
+        models.set_resources([{'key': 'foo', 'x': 6}], 'video', delete_missing=False)
+        self.assertEqual(self.videos.count(), 2)
+        self.assertEqual(self.videos.get(key='foo').data['x'], 6)
+
+    def test_mark_missing_resources_deleted(self):
+        """Resources whose keys are not passed are marked as deleted."""
+        models.set_resources([
+            {'key': 'foo', 'x': 5}, {'key': 'bar', 'y': 7}
+        ], 'video')
+        models.set_resources([{'key': 'buzz', 'z': 5}], 'channel')
+        models.mark_missing_resources_deleted(['foo'], 'video')
+        self.assertEqual([o.key for o in self.videos.all()], ['foo'])
+        self.assertIsNotNone(self.all_videos.get(key='bar').deleted_at)
+        self.assertEqual(self.channels.count(), 1)
+
+    def test_updated_high_water_mark(self):
+        """The high-water mark is the largest updated timestamp of non-deleted resources."""
+        self.assertIsNone(models.get_updated_high_water_mark('video'))
+        models.set_resources([
+            {'key': 'foo', 'updated': 5}, {'key': 'bar', 'updated': 70}
+        ], 'video')
+        models.set_resources([{'key': 'buzz', 'updated': 100}], 'channel')
+        self.assertEqual(models.get_updated_high_water_mark('video'), 70)
+        models.set_resources([{'key': 'foo', 'updated': 5}], 'video')
+        self.assertEqual(models.get_updated_high_water_mark('video'), 5)
+
+
+#: Catalogue sizes loaded by :py:class:`~.SetResourcesBenchmarkTest`. The benchmark is slow and so
+#: is skipped unless these are set via a comma-separated list in the DJANGO_JWP_BENCHMARK_SIZES
+#: environment variable. E.g. "10000,50000,200000".
+BENCHMARK_SIZES = [
+    int(size) for size in os.environ.get('DJANGO_JWP_BENCHMARK_SIZES', '').split(',') if size
+]
+
+
+@unittest.skipUnless(BENCHMARK_SIZES, 'set DJANGO_JWP_BENCHMARK_SIZES to run')
+class SetResourcesBenchmarkTest(TestCase):
+    """
+    Compare the time taken by :py:func:`~mediaplatform_jwp.models.set_resources` to load
+    synthetic catalogues with that taken by the per-row execute_batch upsert it replaced. Times are
+    logged at info level.
+
+    """
+    SIZES = BENCHMARK_SIZES
+
+    def test_benchmark(self):
+        for size in self.SIZES:
+            resources = [
+                {'key': f'resource_{index}', 'title': f'Resource {index}', 'updated': index,
+                 'custom': {'sms_acl': 'acl:WORLD:', 'sms_media_id': f'media:{index}:'}}
+                for index in range(size)
+            ]
+
+            timings = {}
+            for name, loader in [('execute_batch', set_resources_with_execute_batch),
+                                 ('copy', models.set_resources)]:
+                # Time an initial load followed by an update of a tenth of the resources with
+                # another tenth removed.
+                with transaction.atomic():
+                    start = time.perf_counter()
+                    loader(resources, 'video')
+                    updated = resources[size // 10:]
+                    for resource in updated[:size // 10]:
+                        resource['updated'] += size
+                    loader(updated, 'video')
+                    timings[name] = time.perf_counter() - start
+
+                    self.assertEqual(models.CachedResource.videos.count(), size - size // 10)
+                    transaction.set_rollback(True)
+
+                for resource in updated[:size // 10]:
+                    resource['updated'] -= size
+
+            LOG.info(
+                'Loading %s resources took %.2fs with execute_batch and %.2fs with COPY',
+                size, timings['execute_batch'], timings['copy'])
+
+
+def set_resources_with_execute_batch(resources, resource_type):
+    """
+    The implementation of :py:func:`~mediaplatform_jwp.models.set_resources` which upserted each
+    resource with its own statement via execute_batch. Kept as a baseline for benchmarking.
+
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            CREATE TEMPORARY TABLE inserted_or_updated_keys (key TEXT)
+        ''')
+
+        execute_batch(cursor, '''
+            WITH
+                insert_result
+            AS (
+                INSERT INTO mediaplatform_jwp_cachedresource (
+                    key, data, data_hash, type, updated_at, created_at, deleted_at
+                ) VALUES (
+                    %(key)s, %(data)s, MD5(%(data)s::jsonb::text), %(type)s,
+                    STATEMENT_TIMESTAMP(), STATEMENT_TIMESTAMP(), NULL
+                )
+                ON CONFLICT (key) DO
+                    UPDATE SET
+                        data = EXCLUDED.data, data_hash = EXCLUDED.data_hash, type = %(type)s,
+                        updated_at = STATEMENT_TIMESTAMP(), deleted_at = NULL
+                    WHERE
+                        mediaplatform_jwp_cachedresource.data_hash <> EXCLUDED.data_hash
+                        OR mediaplatform_jwp_cachedresource.deleted_at IS NOT NULL
+                RETURNING
+                    mediaplatform_jwp_cachedresource.key AS key
+            )
+            INSERT INTO inserted_or_updated_keys (key) SELECT %(key)s
+        ''', (
+            {'key': data['key'], 'data': json.dumps(data), 'type': resource_type}
+            for data in resources
+        ))
+
+        cursor.execute('''
+            UPDATE
+                mediaplatform_jwp_cachedresource
+            SET
+                deleted_at = STATEMENT_TIMESTAMP()
+            WHERE
+                key NOT IN (SELECT key from inserted_or_updated_keys)
+                AND type = %(type)s
+                AND deleted_at IS NULL
+        ''', {'type': resource_type})
+
+        cursor.execute('''DROP TABLE inserted_or_updated_keys''')
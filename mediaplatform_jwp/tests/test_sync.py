@@ -1,8 +1,16 @@
 import datetime
+import logging
 import secrets
+import time
+import unittest
+from unittest import mock
 
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection, transaction
 from django.utils import timezone
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 import pytz
 
 import mediaplatform.models as mpmodels
@@ -10,9 +18,12 @@ import mediaplatform_jwp.models as jwpmodels
 import legacysms.models as legacymodels
 import mediaplatform_jwp.api.delivery as jwp
 from .. models import set_resources, CachedResource
+from .test_models import BENCHMARK_SIZES
 
 from .. import sync
 
+LOG = logging.getLogger(__name__)
+
 
 class SyncTestCase(TestCase):
     def test_basic_functionality(self):
@@ -56,6 +67,79 @@ class SyncTestCase(TestCase):
         self.assertEqual(new_i1.title, v1['title'])
         self.assertEqual(new_i2.updated_at, i2.updated_at)
 
+    def test_batched_update(self):
+        """Media items are updated correctly when spread over several batches."""
+        videos = [
+            make_video(title=f'title {i}', media_id=100 + i, acl=[f'USER_spqr{i}'],
+                       keywords=[f'tag{i}'])
+            for i in range(5)
+        ]
+        with mock.patch('mediaplatform_jwp.sync.SYNC_BATCH_SIZE', 2):
+            set_resources_and_sync(videos)
+
+        for i, video in enumerate(videos):
+            item = mpmodels.MediaItem.objects.get(jwp__key=video.key)
+            self.assertEqual(item.title, f'title {i}')
+            self.assertEqual(item.tags, [f'tag{i}'])
+            self.assertEqual(item.sms.id, 100 + i)
+            self.assertEqual(item.view_permission.crsids, [f'spqr{i}'])
+
+    def test_update_query_count_is_constant(self):
+        """Updating many media items takes no more queries than updating a few."""
+        def count_update_queries(video_count):
+            videos = [make_video(media_id=i) for i in range(video_count)]
+            set_resources_and_sync(videos)
+            with CaptureQueriesContext(connection) as context:
+                set_resources_and_sync(videos, update_kwargs={'update_all_videos': True})
+            return len(context.captured_queries)
+
+        self.assertEqual(count_update_queries(2), count_update_queries(20))
+
+    def test_batched_sync(self):
+        """A batched synchronisation gives the same result as an atomic one."""
+        videos = [make_video(title=f'title {i}', media_id=10 + i) for i in range(5)]
+        channels = [
+            make_channel(title=f'channel {i}', media_ids=[str(10 + i)], collection_id=20 + i)
+            for i in range(3)
+        ]
+        set_resources_and_sync(videos, channels, update_kwargs={'batch_size': 2})
+
+        for i, video in enumerate(videos):
+            item = mpmodels.MediaItem.objects.get(jwp__key=video.key)
+            self.assertEqual(item.title, f'title {i}')
+        for i, channel in enumerate(channels):
+            c = mpmodels.Channel.objects.get(jwp__key=channel.key)
+            self.assertEqual(c.title, f'channel {i}')
+            self.assertEqual([item.sms.id for item in c.items.all()], [10 + i])
+        self.assertFalse(jwpmodels.PendingVideoUpdate.objects.exists())
+
+    def test_batched_sync_resumes(self):
+        """An interrupted batched synchronisation resumes from its checkpoint."""
+        videos = [make_video(title=f'title {i}') for i in range(5)]
+        update_media_items_from_videos = sync._update_media_items_from_videos
+        batches = []
+
+        def interrupt_second_batch(rows):
+            batches.append(rows)
+            if len(batches) == 2:
+                raise RuntimeError('interrupted')
+            update_media_items_from_videos(rows)
+
+        with mock.patch('mediaplatform_jwp.sync._update_media_items_from_videos',
+                        side_effect=interrupt_second_batch):
+            with self.assertRaises(RuntimeError):
+                set_resources_and_sync(videos, update_kwargs={'batch_size': 2})
+
+        # The first batch was committed and the remaining videos are pending
+        self.assertEqual(jwpmodels.PendingVideoUpdate.objects.count(), 3)
+
+        # Re-running the synchronisation with no changes to the cache completes the update
+        sync.update_related_models_from_cache(batch_size=2)
+        self.assertFalse(jwpmodels.PendingVideoUpdate.objects.exists())
+        for i, video in enumerate(videos):
+            item = mpmodels.MediaItem.objects.get(jwp__key=video.key)
+            self.assertEqual(item.title, f'title {i}')
+
     def test_sync_jwp(self):
         """New videos should create matching JWP video objects."""
         v1, = set_resources_and_sync([make_video()])
@@ -194,6 +278,43 @@ class SyncTestCase(TestCase):
         self.assertFalse(i3.view_permission.is_public)
         self.assertTrue(i3.view_permission.is_signed_in)
 
+    def test_view_acl_principals(self):
+        """Synchronising view ACLs updates the view permission principals."""
+        v1, = set_resources_and_sync([make_video(acl=['USER_spqr1', 'INST_botolph'])])
+        i1 = mpmodels.MediaItem.objects.get(jwp__key=v1.key)
+        self.assertEqual(
+            set(i1.view_permission.principals.values_list('principal', flat=True)),
+            {'USER_spqr1', 'INST_botolph'})
+
+        v1['updated'] += 1
+        v1['custom']['sms_acl'] = 'acl:WORLD:'
+        set_resources_and_sync([v1])
+        self.assertEqual(
+            list(i1.view_permission.principals.values_list('principal', flat=True)), ['WORLD'])
+
+    def test_view_acl_publicly_viewable(self):
+        """Synchronising view ACLs updates the publicly viewable flag of media items."""
+        v1, = set_resources_and_sync([make_video(acl=['CAM'])])
+        i1 = mpmodels.MediaItem.objects.get(jwp__key=v1.key)
+        self.assertFalse(i1.is_publicly_viewable)
+
+        v1['updated'] += 1
+        v1['custom']['sms_acl'] = 'acl:WORLD:'
+        set_resources_and_sync([v1])
+        i1.refresh_from_db()
+        self.assertTrue(i1.is_publicly_viewable)
+
+    def test_publicly_viewable_only_recomputed_for_updated_items(self):
+        """Only the publicly viewable flags of media items updated by a sync are recomputed."""
+        v1, v2 = set_resources_and_sync([make_video(acl=['CAM']), make_video(acl=['CAM'])])
+
+        # Make the flags of both items stale. Only the updated item should have it recomputed.
+        mpmodels.MediaItem.objects.update(is_publicly_viewable=True)
+        v1['updated'] += 1
+        set_resources_and_sync([v1, v2])
+        self.assertFalse(mpmodels.MediaItem.objects.get(jwp__key=v1.key).is_publicly_viewable)
+        self.assertTrue(mpmodels.MediaItem.objects.get(jwp__key=v2.key).is_publicly_viewable)
+
     def test_item_update_with_sms(self):
         """Test that updating an item's SMS last_updated_at updates SMS item."""
         last_updated_at = timezone.now()
@@ -284,6 +405,13 @@ class SyncTestCase(TestCase):
         self.assertEqual(len(playlist.media_items), 1)
         self.assertEqual(playlist.media_items[0], media_item.id)
 
+    def test_playlist_viewable(self):
+        """The shadow playlist of a synchronised collection is publicly viewable."""
+        channels = [make_channel(title='test channel', media_ids=['1'], collection_id='2')]
+        set_resources_and_sync([make_video(media_id='1')], channels)
+        playlist = mpmodels.Playlist.objects.get(sms__id='2')
+        self.assertIn(playlist, mpmodels.Playlist.objects.viewable_by_user(AnonymousUser()))
+
     def test_adding_media_to_channel(self):
         """If a new video and channel appears on JWP, objects are created."""
         videos = [
@@ -331,6 +459,17 @@ class SyncTestCase(TestCase):
         self.assertIn('01234', c1.edit_permission.lookup_groups)
         self.assertNotIn('01234', c2.edit_permission.lookup_groups)
 
+    def test_edit_acl_principals(self):
+        """Synchronising channels updates the edit permission principals."""
+        channels = [make_channel(title='test channel', groupid='01234')]
+        channels[0]['custom']['sms_created_by'] = 'created_by:spqr1:'
+        set_resources_and_sync([], channels)
+
+        c1 = mpmodels.Channel.objects.get(jwp__key=channels[0].key)
+        self.assertEqual(
+            set(c1.edit_permission.principals.values_list('principal', flat=True)),
+            {'USER_spqr1', 'GROUP_01234'})
+
     def test_last_updated_sync(self):
         """If a new video and channel appears on JWP, objects are created."""
         last_updated_at = timezone.now()
@@ -389,6 +528,138 @@ class SyncTestCase(TestCase):
             test_value, getattr(mpmodels.MediaItem.objects.get(jwp__key=v1.key), model_attr))
 
 
+class FirstImportTestCase(TestCase):
+    def first_import(self, video_count):
+        """
+        Import a synthetic catalogue of *video_count* videos into an empty database and return a
+        tuple giving the time taken in seconds and the number of queries made. The import is
+        rolled back afterwards.
+
+        """
+        with transaction.atomic():
+            videos = [
+                make_video(title=f'video {i}', media_id=i, acl=['WORLD'], keywords=['benchmark'])
+                for i in range(video_count)
+            ]
+            set_resources(videos, 'video')
+            set_resources([], 'channel')
+
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                sync.update_related_models_from_cache()
+                duration = time.perf_counter() - start
+
+            self.assertEqual(mpmodels.MediaItem.objects.count(), video_count)
+            self.assertFalse(jwpmodels.Video.objects.filter(item__isnull=True).exists())
+
+            transaction.set_rollback(True)
+
+        return duration, len(context.captured_queries)
+
+
+class FirstImportTest(FirstImportTestCase):
+    def test_query_count_independent_of_size(self):
+        """The number of queries made by the first import does not grow with the catalogue."""
+        _, small_count = self.first_import(10)
+        _, large_count = self.first_import(100)
+        self.assertEqual(small_count, large_count)
+
+
+@unittest.skipUnless(BENCHMARK_SIZES, 'set DJANGO_JWP_BENCHMARK_SIZES to run')
+class FirstImportBenchmarkTest(FirstImportTestCase):
+    """
+    Time the first import of synthetic catalogues of the sizes given by DJANGO_JWP_BENCHMARK_SIZES.
+    Times are logged at info level.
+
+    """
+    SIZES = BENCHMARK_SIZES
+
+    def test_benchmark(self):
+        for size in self.SIZES:
+            duration, query_count = self.first_import(size)
+            LOG.info('First import of %s videos took %.2fs and %s queries',
+                     size, duration, query_count)
+
+
+class VideoSourcesTest(TestCase):
+    SOURCES = [
+        {'type': 'video/mp4', 'width': 1920, 'height': 1080, 'file': 'http://cdn.invalid/1.mp4'},
+        {'type': 'audio/mp4', 'file': 'http://cdn.invalid/1.m4a'},
+    ]
+
+    def setUp(self):
+        self.dv_from_key_patcher = mock.patch(
+            'mediaplatform_jwp.api.delivery.DeliveryVideo.from_key')
+        self.dv_from_key = self.dv_from_key_patcher.start()
+        self.dv_from_key.side_effect = lambda key: jwp.DeliveryVideo({'sources': self.SOURCES})
+        self.addCleanup(self.dv_from_key_patcher.stop)
+
+    def test_sources_stored(self):
+        """Sources of new videos are fetched and stored."""
+        v1, v2 = set_resources_and_sync([make_video(), make_video()])
+        self.assertEqual(sync.update_video_sources(), 2)
+
+        for video in jwpmodels.Video.objects.all():
+            self.assertEqual(video.sources_updated, video.updated)
+            self.assertIsNotNone(video.sources_fetched_at)
+            self.assertTrue(video.has_current_sources())
+            self.assertEqual(
+                sorted(source.url for source in video.delivery_sources.all()),
+                sorted(source['file'] for source in self.SOURCES))
+        self.assertIsNone(jwpmodels.VideoSource.objects.get(mime_type='audio/mp4').width)
+
+    def test_current_sources_not_fetched(self):
+        """Only videos which are new or updated have their sources fetched."""
+        v1, v2 = set_resources_and_sync([make_video(), make_video()])
+        sync.update_video_sources()
+        self.dv_from_key.reset_mock()
+
+        v2['updated'] += 1
+        set_resources_and_sync([v1, v2])
+        self.assertEqual(sync.update_video_sources(), 1)
+        self.dv_from_key.assert_called_once_with(v2['key'])
+        self.assertEqual(jwpmodels.VideoSource.objects.filter(video_id=v2['key']).count(), 2)
+
+    def test_expired_sources_fetched(self):
+        """Videos whose sources are older than their maximum age have their sources fetched."""
+        v1, v2 = set_resources_and_sync([make_video(), make_video()])
+        sync.update_video_sources()
+        self.dv_from_key.reset_mock()
+
+        jwpmodels.Video.objects.filter(key=v2['key']).update(
+            sources_fetched_at=timezone.now() - datetime.timedelta(
+                seconds=settings.JWPLATFORM_STORED_SOURCES_MAX_AGE + 1))
+        self.assertEqual(sync.update_video_sources(), 1)
+        self.dv_from_key.assert_called_once_with(v2['key'])
+        self.assertTrue(jwpmodels.Video.objects.get(key=v2['key']).has_current_sources())
+
+    def test_refresh_all(self):
+        """All videos have their sources fetched if asked."""
+        set_resources_and_sync([make_video(), make_video()])
+        sync.update_video_sources()
+        self.dv_from_key.reset_mock()
+
+        self.assertEqual(sync.update_video_sources(refresh_all=True), 2)
+        self.assertEqual(self.dv_from_key.call_count, 2)
+        self.assertEqual(jwpmodels.VideoSource.objects.count(), 4)
+
+    def test_not_found_skipped(self):
+        """Videos which are not found are skipped and retried next time."""
+        v1, = set_resources_and_sync([make_video()])
+        self.dv_from_key.side_effect = jwp.VideoNotFoundError
+        self.assertEqual(sync.update_video_sources(), 0)
+        self.assertIsNone(jwpmodels.Video.objects.get(key=v1['key']).sources_updated)
+
+        self.dv_from_key.side_effect = lambda key: jwp.DeliveryVideo({'sources': self.SOURCES})
+        self.assertEqual(sync.update_video_sources(), 1)
+
+    def test_batched(self):
+        """Sources are stored in batches."""
+        set_resources_and_sync([make_video() for _ in range(5)])
+        self.assertEqual(sync.update_video_sources(concurrency=2, batch_size=2), 5)
+        self.assertEqual(jwpmodels.VideoSource.objects.count(), 10)
+
+
 def set_resources_and_sync(videos, channels=[], update_kwargs={}):
     """
     Convenience wrapper which sets the cached video resource and synchronises the DB. Returns its
@@ -1,5 +1,32 @@
+import logging
+
 from automationlookup.models import UserLookup
 from django.conf import settings
+from django.db import connection
+
+from mediaplatform import models as mpmodels
+from mediaplatform_jwp.api import delivery as jwplatform
+
+
+LOG = logging.getLogger(__name__)
+
+#: Session key recording the primary key of the user for which a UserLookup model is known to
+#: exist.
+USER_LOOKUP_SESSION_KEY = 'mediawebapp_user_lookup_recorded_for'
+
+
+class _QueryCounter:
+    """
+    A database execute wrapper which counts the queries run while it is installed. See
+    :py:meth:`django.db.backends.base.base.BaseDatabaseWrapper.execute_wrapper`.
+
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
 
 
 def user_lookup_middleware(get_response):
@@ -7,16 +34,68 @@ def user_lookup_middleware(get_response):
     def middleware(request):
         """
         This middleware ensures that a UserLookup model exists
-        to map an authenticated user to lookup
+        to map an authenticated user to lookup. The mapping is only
+        recorded once per session. The number of database queries
+        made by this middleware is available as the
+        ``user_lookup_query_count`` attribute of the request.
         """
 
-        if not request.user.is_anonymous:
-            UserLookup.objects.get_or_create(
-                user=request.user,
-                scheme=settings.LOOKUP_PEOPLE_ID_SCHEME,
-                identifier=request.user.username
-            )
+        counter = _QueryCounter()
+        with connection.execute_wrapper(counter):
+            if (not request.user.is_anonymous and
+                    request.session.get(USER_LOOKUP_SESSION_KEY) != request.user.pk):
+                UserLookup.objects.get_or_create(
+                    user=request.user,
+                    scheme=settings.LOOKUP_PEOPLE_ID_SCHEME,
+                    identifier=request.user.username
+                )
+                request.session[USER_LOOKUP_SESSION_KEY] = request.user.pk
+
+        request.user_lookup_query_count = counter.count
+        LOG.debug('User lookup middleware queries for %s: %s', request.path, counter.count)
 
         return get_response(request)
 
     return middleware
+
+
+def lookup_membership_middleware(get_response):
+
+    def middleware(request):
+        """
+        This middleware activates a :py:class:`mediaplatform.models.MembershipResolver` for the
+        duration of the request so that a user's lookup groups and institutions are fetched at most
+        once no matter how many querysets or serializers build permission conditions. The resolver
+        is available as the ``lookup_memberships`` attribute of the request.
+        """
+
+        with mpmodels.resolving_memberships() as resolver:
+            request.lookup_memberships = resolver
+            response = get_response(request)
+
+        LOG.debug('Lookup membership calls for %s: %s made, %s saved',
+                  request.path, resolver.lookup_count, resolver.saved_lookup_count)
+
+        return response
+
+    return middleware
+
+
+def delivery_call_middleware(get_response):
+
+    def middleware(request):
+        """
+        This middleware counts the HTTP requests made to the JWPlatform Delivery API while
+        handling the request. The count is available as the ``delivery_call_count`` attribute of
+        the request once the response has been generated.
+        """
+
+        with jwplatform.counting_delivery_calls() as counter:
+            response = get_response(request)
+
+        request.delivery_call_count = counter.count
+        LOG.debug('Delivery API calls for %s: %s', request.path, counter.count)
+
+        return response
+
+    return middleware
@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 
 #: Base directory containing the project. Build paths inside the project via
 #: ``os.path.join(BASE_DIR, ...)``.
@@ -58,7 +59,9 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'mediawebapp.middleware.user_lookup_middleware'
+    'mediawebapp.middleware.user_lookup_middleware',
+    'mediawebapp.middleware.lookup_membership_middleware',
+    'mediawebapp.middleware.delivery_call_middleware',
 ]
 
 #: Root URL patterns
@@ -179,6 +182,46 @@ UCAMWEBAUTH_NOT_CURRENT = False
 # Lookup-proxy root URL
 LOOKUP_ROOT = os.environ.get('LOOKUP_ROOT')
 
+#: Caches. In addition to the default per-process cache, a "lookup" cache is configured which is
+#: shared between all worker processes. It is used to hold lookup person resources. See
+#: :py:mod:`mediaplatform.lookup`. It is held in the database since the lock which stops workers
+#: looking up the same person at once needs a backend with an atomic ``add()``. The table is
+#: created by the ``createcachetable`` management command. A "delivery" cache is shared between
+#: worker processes on a host and used to hold video source lists from the JWPlatform Delivery
+#: API. See :py:func:`mediaplatform_jwp.api.delivery.get_video_sources`.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'lookup': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'mediawebapp_lookup_cache',
+    },
+    'delivery': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'DJANGO_DELIVERY_CACHE_DIR',
+            os.path.join(tempfile.gettempdir(), 'mediawebapp-delivery-cache')),
+    },
+}
+
+#: Alias of the cache used to share lookup person resources between worker processes.
+LOOKUP_MEMBERSHIP_CACHE = 'lookup'
+
+#: Time in seconds for which lookup person resources are held in the shared cache. Set to zero to
+#: disable the shared cache.
+LOOKUP_MEMBERSHIP_CACHE_TIMEOUT = 1800
+
+#: Age in seconds after which a cached lookup person resource is refreshed in the background.
+LOOKUP_MEMBERSHIP_CACHE_SOFT_TIMEOUT = 900
+
+#: Maximum time in seconds to wait for another worker to fetch a person from lookup.
+LOOKUP_MEMBERSHIP_CACHE_LOCK_TIMEOUT = 10
+
+
+#: Alias of the cache used to share JWPlatform video source lists between worker processes.
+JWPLATFORM_SOURCES_CACHE = 'delivery'
+
 
 # jwplatform API credentials
 
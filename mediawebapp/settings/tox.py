@@ -48,3 +48,9 @@ LOGGING = None
 
 #: Do not synchronise items using the JWP API unless tests expect it
 JWP_SYNC_ITEMS = False
+
+#: Do not share lookup responses between tests via the cache unless tests expect it
+LOOKUP_MEMBERSHIP_CACHE_TIMEOUT = 0
+
+#: Do not share video source lists between tests via the cache unless tests expect it
+JWPLATFORM_SOURCES_CACHE_TIMEOUT = 0
@@ -0,0 +1,113 @@
+"""
+Test the project-specific middleware.
+
+"""
+from unittest import mock
+
+from automationlookup.models import UserLookup
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+
+from mediaplatform import models as mpmodels
+from mediaplatform_jwp.api import delivery as jwplatform
+
+from .. import middleware
+
+
+class UserLookupMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='spqr1')
+        self.session = SessionStore()
+        self.middleware = middleware.user_lookup_middleware(lambda request: HttpResponse())
+
+    def make_request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        request.session = self.session
+        return request
+
+    def test_user_lookup_created(self):
+        """A UserLookup is created for an authenticated user."""
+        request = self.make_request(self.user)
+        self.middleware(request)
+        self.assertTrue(UserLookup.objects.filter(user=self.user).exists())
+        self.assertGreater(request.user_lookup_query_count, 0)
+
+    def test_user_lookup_recorded_once_per_session(self):
+        """Subsequent requests in the same session make no database queries."""
+        self.middleware(self.make_request(self.user))
+        request = self.make_request(self.user)
+        self.middleware(request)
+        self.assertEqual(request.user_lookup_query_count, 0)
+
+    def test_user_change_within_session(self):
+        """A different user in the same session has their UserLookup created."""
+        self.middleware(self.make_request(self.user))
+        other_user = User.objects.create(username='spqr2')
+        self.middleware(self.make_request(other_user))
+        self.assertTrue(UserLookup.objects.filter(user=other_user).exists())
+
+    def test_anonymous_user(self):
+        """No UserLookup is created for the anonymous user."""
+        request = self.make_request(AnonymousUser())
+        self.middleware(request)
+        self.assertEqual(UserLookup.objects.count(), 0)
+        self.assertEqual(request.user_lookup_query_count, 0)
+
+
+class LookupMembershipMiddlewareTests(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+
+    def test_resolver_active_during_request(self):
+        """The resolver is attached to the request and active while the view runs."""
+        def get_response(request):
+            self.assertIs(mpmodels._CONTEXT.resolver, request.lookup_memberships)
+            return HttpResponse()
+
+        middleware.lookup_membership_middleware(get_response)(self.request)
+        self.assertIsInstance(self.request.lookup_memberships, mpmodels.MembershipResolver)
+
+    def test_resolver_deactivated_after_request(self):
+        """No resolver remains active once the request has been processed."""
+        middleware.lookup_membership_middleware(lambda request: HttpResponse())(self.request)
+        self.assertIsNone(getattr(mpmodels._CONTEXT, 'resolver', None))
+
+    def test_lookup_calls_are_shared(self):
+        """Repeated membership lookups within a request result in one lookup call."""
+        user = mock.MagicMock(username='testuser', is_anonymous=False)
+
+        def get_response(request):
+            for _ in range(3):
+                mpmodels._groupids_and_instids_for_user(user)
+            return HttpResponse()
+
+        with mock.patch('mediaplatform.models._lookup_groupids_and_instids_for_user') as lookup:
+            lookup.return_value = ([], [])
+            middleware.lookup_membership_middleware(get_response)(self.request)
+
+        lookup.assert_called_once_with(user)
+        self.assertEqual(self.request.lookup_memberships.saved_lookup_count, 2)
+
+
+class DeliveryCallMiddlewareTests(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+
+    def test_delivery_calls_are_counted(self):
+        """Delivery API calls made while handling the request are counted."""
+        def get_response(request):
+            for _ in range(2):
+                jwplatform._record_delivery_call()
+            return HttpResponse()
+
+        middleware.delivery_call_middleware(get_response)(self.request)
+        self.assertEqual(self.request.delivery_call_count, 2)
+
+    def test_counter_deactivated_after_request(self):
+        """No counter remains active once the request has been processed."""
+        middleware.delivery_call_middleware(lambda request: HttpResponse())(self.request)
+        self.assertEqual(self.request.delivery_call_count, 0)
+        self.assertIsNone(getattr(jwplatform._CONTEXT, 'counter', None))
@@ -0,0 +1,122 @@
+"""
+Load test of the application while the JWPlatform Delivery API is slow to respond.
+
+The application is served by Django's threaded live server, which handles requests in the same way
+as the gunicorn gthread workers used in production. The Delivery API is replaced by a local
+stand-in which waits before responding.
+
+Since the test asserts on timings, it is skipped unless the upstream delay is set via the
+DJANGO_LOAD_TEST_UPSTREAM_DELAY environment variable.
+
+"""
+import concurrent.futures
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+import unittest
+
+from django.test import LiveServerTestCase, override_settings
+from django.urls import reverse
+import requests
+
+LOG = logging.getLogger(__name__)
+
+#: Time in seconds which the stand-in Delivery API waits before responding. Zero if not set.
+UPSTREAM_DELAY = float(os.environ.get('DJANGO_LOAD_TEST_UPSTREAM_DELAY', '0'))
+
+#: Number of concurrent requests which wait on the stand-in Delivery API.
+SLOW_REQUESTS = 8
+
+#: Number of requests which do not call the Delivery API made while the slow requests are waiting.
+FAST_REQUESTS = 5
+
+
+class SlowDeliveryAPIHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Responds to every GET request with a Delivery API media response after waiting for the delay
+    set on the server.
+
+    """
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        body = json.dumps({'playlist': [{
+            'mediaid': 'jwpvid1',
+            'sources': [
+                {'type': 'video/mp4', 'width': 1280, 'height': 720,
+                 'file': 'http://cdn.invalid/vid.mp4'},
+            ],
+        }]}).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipUnless(UPSTREAM_DELAY > 0, 'set DJANGO_LOAD_TEST_UPSTREAM_DELAY to run')
+@override_settings(JWPLATFORM_SOURCES_CACHE_TIMEOUT=0)
+class SlowUpstreamLoadTest(LiveServerTestCase):
+    fixtures = ['api/tests/fixtures/mediaitems.yaml']
+
+    def setUp(self):
+        self.upstream = http.server.ThreadingHTTPServer(
+            ('localhost', 0), SlowDeliveryAPIHandler)
+        self.upstream.delay = UPSTREAM_DELAY
+        upstream_thread = threading.Thread(target=self.upstream.serve_forever, daemon=True)
+        upstream_thread.start()
+        self.addCleanup(self.upstream.server_close)
+        self.addCleanup(self.upstream.shutdown)
+
+        upstream_settings = override_settings(
+            JWPLATFORM_API_BASE_URL=f'http://localhost:{self.upstream.server_port}/')
+        upstream_settings.enable()
+        self.addCleanup(upstream_settings.disable)
+
+        self.source_url = (
+            self.live_server_url + reverse('api:media_source', kwargs={'pk': 'populated'}))
+        self.fast_url = self.live_server_url + reverse('api:channel_list')
+
+    def test_throughput_with_slow_upstream(self):
+        """
+        Requests waiting on a slow Delivery API are served concurrently and do not hold up other
+        requests.
+
+        """
+        with concurrent.futures.ThreadPoolExecutor(SLOW_REQUESTS) as executor:
+            start = time.perf_counter()
+            slow_futures = [
+                executor.submit(requests.get, self.source_url, allow_redirects=False)
+                for _ in range(SLOW_REQUESTS)
+            ]
+
+            # Make the fast requests while the slow requests are waiting on the Delivery API.
+            time.sleep(UPSTREAM_DELAY / 4)
+            fast_latencies = []
+            for _ in range(FAST_REQUESTS):
+                fast_start = time.perf_counter()
+                response = requests.get(self.fast_url)
+                fast_latencies.append(time.perf_counter() - fast_start)
+                self.assertEqual(response.status_code, 200)
+
+            for future in slow_futures:
+                response = future.result()
+                self.assertEqual(response.status_code, 302)
+                self.assertEqual(response.headers['Location'], 'http://cdn.invalid/vid.mp4')
+            slow_duration = time.perf_counter() - start
+
+        LOG.info(
+            'Served %s requests with a %.2fs upstream delay in %.2f seconds. Other requests took '
+            'at most %.3f seconds', SLOW_REQUESTS, UPSTREAM_DELAY, slow_duration,
+            max(fast_latencies))
+
+        # The slow requests were served concurrently rather than one after another.
+        self.assertLess(slow_duration, 2 * UPSTREAM_DELAY)
+
+        # Other requests were not queued behind the slow requests.
+        self.assertLess(max(fast_latencies), UPSTREAM_DELAY / 2)
@@ -7,6 +7,7 @@ from unittest import mock
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
 from django.test import override_settings
 from django.urls import reverse
 
@@ -91,6 +92,63 @@ class MediaViewTestCase(ViewTestCase):
         self.assertIn('<script type="application/profile+json">', content)
 
 
+@override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'delivery': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ui-delivery-tests',
+        },
+    },
+    JWPLATFORM_SOURCES_CACHE='delivery',
+    JWPLATFORM_SOURCES_CACHE_TIMEOUT=60,
+)
+class MediaViewDeliveryCallsTestCase(_ViewTestCase):
+    """
+    Check the number of outbound Delivery API calls made to render a media item page. Rather than
+    mocking DeliveryVideo.from_key, these tests mock the HTTP session so that the calls are
+    counted.
+
+    """
+    def setUp(self):
+        super().setUp()
+        response = mock.MagicMock(status_code=200)
+        response.json.side_effect = lambda: {'playlist': [dict(DELIVERY_VIDEO_FIXTURE)]}
+        session_patch = mock.patch('mediaplatform_jwp.api.delivery.DEFAULT_REQUESTS_SESSION')
+        self.session = session_patch.start()
+        self.session.get.return_value = response
+        self.addCleanup(session_patch.stop)
+
+        get_profile_patch = mock.patch('api.views.get_profile')
+        get_profile_patch.start().return_value = {'user': AnonymousUser()}
+        self.addCleanup(get_profile_patch.stop)
+
+        caches['delivery'].clear()
+        self.addCleanup(caches['delivery'].clear)
+
+        self.item = self.non_deleted_media.get(id='populated')
+
+    def test_one_delivery_call_per_render(self):
+        """A page render resolves the item's sources with a single Delivery API call."""
+        r = self.client.get(reverse('ui:media_item', kwargs={'pk': self.item.pk}))
+
+        self.assertEqual(r.status_code, 200)
+        self.assertIsNotNone(r.context['resource']['bestSourceUrl'])
+        self.assertEqual(r.wsgi_request.delivery_call_count, 1)
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_no_delivery_call_with_warm_cache(self):
+        """A page render makes no Delivery API calls if the sources are cached."""
+        self.client.get(reverse('ui:media_item', kwargs={'pk': self.item.pk}))
+
+        r = self.client.get(reverse('ui:media_item', kwargs={'pk': self.item.pk}))
+
+        self.assertEqual(r.status_code, 200)
+        self.assertIsNotNone(r.context['resource']['bestSourceUrl'])
+        self.assertEqual(r.wsgi_request.delivery_call_count, 0)
+        self.assertEqual(self.session.get.call_count, 1)
+
+
 class UploadViewTestCase(ViewTestCase):
     def setUp(self):
         super().setUp()